@@ -0,0 +1,335 @@
+"""JSON API, version 1, mounted at `/api/v1`.
+
+The same timelines, profiles, follow lists, likes and follows as the HTML
+pages, for clients that render their own UI:
+
+    GET    /api/v1/timeline                     logged-in user's home timeline
+    GET    /api/v1/users/<id>                   profile
+    GET    /api/v1/users/<id>/messages          a user's messages
+    GET    /api/v1/users/<id>/following         who they follow
+    GET    /api/v1/users/<id>/followers         who follows them
+    PUT    /api/v1/messages/<id>/like           like (idempotent)
+    DELETE /api/v1/messages/<id>/like           unlike
+    PUT    /api/v1/users/<id>/follow            follow (idempotent)
+    DELETE /api/v1/users/<id>/follow            unfollow
+    PUT    /api/v1/following                    follow many: {"user_ids": [...]}
+    DELETE /api/v1/following                    unfollow many: {"user_ids": [...]}
+    PUT    /api/v1/following/import             follow a follows.csv (text/csv body)
+
+Requests are authenticated by the web session cookie (log in through
+`/login`). Writes use PUT and DELETE, which a cross-site form can't send,
+and answer with the new state and count, so a client never needs a second
+request to redraw.
+
+Lists are `{"data": [...], "next_cursor": ...}`, paged like the HTML pages
+with `limit` and `before` (messages) or `after` (users). `fields` picks the
+fields to return (`?fields=id,username`); viewer-specific fields (`liked`,
+`following`) and the columns behind fields that aren't asked for are never
+loaded.
+"""
+
+from flask import Blueprint, abort, g, jsonify, request
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only
+from werkzeug.exceptions import HTTPException
+
+import bulk_follows
+import conditional
+from follow_state import follow_state, prime_follow_state
+from fragments import author_option
+import graph
+import likes
+from models import db, Follows, Likes, Message, User
+from pagination import page_size, paginate_newest_first
+import timeline
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+##############################################################################
+# Serialization
+
+
+def author(msg):
+    user = msg.user
+    return dict(id=user.id, username=user.username, image_url=user.image_url)
+
+
+MESSAGE_FIELDS = {
+    'id': lambda msg, viewer: msg.id,
+    'text': lambda msg, viewer: msg.text,
+    'timestamp': lambda msg, viewer: msg.timestamp.isoformat(),
+    'likes_count': lambda msg, viewer: msg.likes_count,
+    'liked': lambda msg, viewer: msg.id in viewer['liked'],
+    'user': lambda msg, viewer: author(msg),
+}
+
+USER_FIELDS = {
+    'id': lambda user, viewer: user.id,
+    'username': lambda user, viewer: user.username,
+    'image_url': lambda user, viewer: user.image_url,
+    'header_image_url': lambda user, viewer: user.header_image_url,
+    'bio': lambda user, viewer: user.bio,
+    'location': lambda user, viewer: user.location,
+    'messages_count': lambda user, viewer: user.messages_count,
+    'following_count': lambda user, viewer: user.following_count,
+    'followers_count': lambda user, viewer: user.followers_count,
+    'likes_count': lambda user, viewer: user.likes_count,
+    'following': lambda user, viewer: viewer['follows'].is_following(user.id),
+}
+
+# fields computed from something other than the row's own column
+COMPUTED_FIELDS = {'liked', 'following', 'user'}
+
+
+def requested_fields(available):
+    """The `fields` param, checked against `available`; all of them if absent."""
+
+    fields = request.args.get('fields')
+    if not fields:
+        return list(available)
+
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def column_options(fields):
+    """load_only() for the `User` columns behind `fields`."""
+
+    columns = ['id'] + [field for field in fields
+                        if field not in COMPUTED_FIELDS and field != 'id']
+    return load_only(*columns)
+
+
+def serialize(items, fields, getters, viewer):
+    """`items` as dicts of `fields`, in the order asked for."""
+
+    pairs = [(field, getters[field]) for field in fields]
+    return [{field: get(item, viewer) for field, get in pairs} for item in items]
+
+
+def message_list(page):
+    fields = requested_fields(MESSAGE_FIELDS)
+    viewer = {}
+    if 'liked' in fields:
+        viewer['liked'] = Likes.liked_among(g.user.id, [msg.id for msg in page.items])
+
+    return jsonify(data=serialize(page.items, fields, MESSAGE_FIELDS, viewer),
+                   next_cursor=page.next_cursor)
+
+
+def user_list(user, pages):
+    """`pages` (`graph.following_page` or `graph.followers_page`) of `user`, as JSON."""
+
+    fields = requested_fields(USER_FIELDS)
+    page = pages(user,
+                 User.query.options(column_options(fields)).filter(User.deleted_at.is_(None)),
+                 request.args.get('after'), page_size())
+    viewer = {}
+    if 'following' in fields:
+        prime_follow_state(page.items)
+        viewer['follows'] = follow_state()
+
+    return jsonify(data=serialize(page.items, fields, USER_FIELDS, viewer),
+                   next_cursor=page.next_cursor)
+
+
+##############################################################################
+# Reads
+
+
+@api.before_request
+def require_login():
+    if not g.user:
+        abort(401)
+
+
+@api.route('/timeline')
+def get_timeline():
+    """The logged-in user's home timeline, newest first."""
+
+    page = timeline.get_timeline(g.user.id, limit=page_size(),
+                                 before=request.args.get('before'),
+                                 options=[author_option()])
+    return message_list(page)
+
+
+@api.route('/users/<int:user_id>')
+def get_user(user_id):
+    """A user's profile."""
+
+    fields = requested_fields(USER_FIELDS)
+    user = User.live_or_404(user_id)
+
+    not_modified = conditional.validate(user.id, user.updated_at, fields)
+    if not_modified:
+        return not_modified
+
+    viewer = {'follows': follow_state()}
+    return jsonify(serialize([user], fields, USER_FIELDS, viewer)[0])
+
+
+@api.route('/users/<int:user_id>/messages')
+def get_user_messages(user_id):
+    """A user's messages, newest first."""
+
+    user = User.live_or_404(user_id)
+    query = Message.query.options(author_option()).filter(Message.user_id == user.id)
+    page = paginate_newest_first(query, Message.timestamp, Message.id,
+                                 request.args.get('before'), page_size())
+    return message_list(page)
+
+
+@api.route('/users/<int:user_id>/following')
+def get_following(user_id):
+    """The users `user_id` follows, by id."""
+
+    user = User.live_or_404(user_id)
+    return user_list(user, graph.following_page)
+
+
+@api.route('/users/<int:user_id>/followers')
+def get_followers(user_id):
+    """The users following `user_id`, by id."""
+
+    user = User.live_or_404(user_id)
+    return user_list(user, graph.followers_page)
+
+
+##############################################################################
+# Writes
+
+
+def like_state(message_id, liked):
+    likes_count = (db.session.query(Message.likes_count)
+                   .filter(Message.id == message_id)
+                   .scalar())
+    return jsonify(liked=liked, likes_count=likes_count)
+
+
+@api.route('/messages/<int:message_id>/like', methods=['PUT'])
+def like(message_id):
+    msg = Message.query.get_or_404(message_id)
+
+    try:
+        likes.add_like(g.user.id, msg.id)
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent request liked it first
+        db.session.rollback()
+
+    return like_state(message_id, True)
+
+
+@api.route('/messages/<int:message_id>/like', methods=['DELETE'])
+def unlike(message_id):
+    msg = Message.query.get_or_404(message_id)
+
+    likes.remove_like(g.user.id, msg.id)
+    db.session.commit()
+
+    return like_state(message_id, False)
+
+
+def follow_state_of(user_id, following):
+    followers_count = (db.session.query(User.followers_count)
+                       .filter(User.id == user_id)
+                       .scalar())
+    return jsonify(following=following, followers_count=followers_count)
+
+
+@api.route('/users/<int:user_id>/follow', methods=['PUT'])
+def follow(user_id):
+    followed_user = User.live_or_404(user_id)
+    if followed_user.id == g.user.id:
+        abort(400, "You can't follow yourself.")
+
+    # add the Follows row itself so the timeline and counter hooks run
+    if not Follows.exists(g.user.id, followed_user.id):
+        try:
+            db.session.add(Follows(user_being_followed_id=followed_user.id,
+                                   user_following_id=g.user.id))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+
+    return follow_state_of(user_id, True)
+
+
+@api.route('/users/<int:user_id>/follow', methods=['DELETE'])
+def unfollow(user_id):
+    User.query.get_or_404(user_id)
+
+    follow = Follows.query.get((user_id, g.user.id))
+    if follow:
+        db.session.delete(follow)
+        db.session.commit()
+
+    return follow_state_of(user_id, False)
+
+
+def requested_ids():
+    """The ids in a {"user_ids": [...]} request body."""
+
+    body = request.get_json(silent=True) or {}
+    user_ids = body.get('user_ids') if isinstance(body, dict) else None
+    if not isinstance(user_ids, list):
+        abort(400, 'Expected a JSON body of {"user_ids": [...]}.')
+
+    try:
+        return bulk_follows.parse_ids(user_ids)
+    except ValueError as e:
+        abort(400, str(e))
+
+
+def following_count():
+    return (db.session.query(User.following_count)
+            .filter(User.id == g.user.id)
+            .scalar())
+
+
+@api.route('/following', methods=['PUT'])
+def follow_users():
+    added = bulk_follows.follow_many(g.user.id, requested_ids())
+    db.session.commit()
+
+    return jsonify(followed=sorted(added), following_count=following_count())
+
+
+@api.route('/following', methods=['DELETE'])
+def unfollow_users():
+    removed = bulk_follows.unfollow_many(g.user.id, requested_ids())
+    db.session.commit()
+
+    return jsonify(unfollowed=sorted(removed), following_count=following_count())
+
+
+@api.route('/following/import', methods=['PUT'])
+def import_following():
+    """Follow the users in a follows.csv; rows for other followers are skipped."""
+
+    lines = request.get_data(as_text=True).splitlines()
+    try:
+        added = bulk_follows.import_follows(lines, follower_id=g.user.id)
+    except ValueError as e:
+        db.session.rollback()
+        abort(400, str(e))
+
+    return jsonify(followed_count=added, following_count=following_count())
+
+
+##############################################################################
+# Errors
+
+
+# Flask tries handlers for the status code before the exception class, so
+# codes the app has pages for (404) need one here too
+@api.errorhandler(404)
+@api.errorhandler(HTTPException)
+def http_error(e):
+    """Errors as JSON rather than HTML pages."""
+
+    return jsonify(error=e.name, message=e.description), e.code
@@ -1,11 +1,37 @@
 import os
+import signal
+from datetime import datetime
 
-from flask import Flask, render_template, request, flash, redirect, session, g, abort
+import click
+from flask import Flask, render_template, request, flash, redirect, session, g, abort, jsonify
 from flask_debugtoolbar import DebugToolbarExtension
+from sqlalchemy.orm import load_only, selectinload
 from sqlalchemy.exc import IntegrityError, InvalidRequestError
 
+from api import api, http_error
+import bulk_follows
+import graph
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm,EditPasswordForm
-from models import db, connect_db, User, Message
+from models import db, connect_db, User, Message, Follows, Likes
+import conditional
+import counters
+import jobs
+import likes
+import loader
+import metrics
+import migrations
+from passwords import hasher, HasherBusy
+import purge
+import recommendations
+from replicas import router
+import search
+import sqlstats
+from follow_state import is_following, prime_follow_state
+import timeline
+import trending
+from principal import PrincipalCache, CurrentUser
+from fragments import FragmentCache, author_option, USER_CARD_COLUMNS
+from pagination import page_size, paginate_newest_first, paginate_by_id
 
 CURR_USER_KEY = "curr_user"
 
@@ -16,13 +42,120 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = (
     os.environ.get('DATABASE_URL', 'postgres:///warbler'))
 
+# read replicas, comma separated; see replicas.py
+app.config['SQLALCHEMY_REPLICA_URIS'] = [
+    uri for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if uri]
+app.config['REPLICA_PIN_SECONDS'] = 5
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 # app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+# keep API fields in the order they're asked for
+app.config['JSON_SORT_KEYS'] = False
+app.config['PRINCIPAL_CACHE_SIZE'] = 10000
+app.config['PRINCIPAL_CACHE_TTL'] = 60
+app.config['FRAGMENT_CACHE_SIZE'] = 50000
+app.config['SQL_N_PLUS_ONE_THRESHOLD'] = 5
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['PASSWORD_HASH_WORKERS'] = 4
+app.config['PASSWORD_HASH_MAX_PENDING'] = 32
+app.config['PASSWORD_HASH_TIMEOUT'] = 10
 # toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+router.init_app(app)
+hasher.init_app(app)
+sqlstats.init_app(app)
+metrics.init_app(app)
+trending.init_app(app)
+graph.init_app(app)
+
+app.add_template_global(is_following)
+
+principal_cache = PrincipalCache(maxsize=app.config['PRINCIPAL_CACHE_SIZE'],
+                                 ttl=app.config['PRINCIPAL_CACHE_TTL'])
+
+# a shared backend (memcached, redis, ...) can be passed as `backend=`
+fragment_cache = FragmentCache(maxsize=app.config['FRAGMENT_CACHE_SIZE'])
+app.add_template_global(fragment_cache.message, 'message_fragment')
+app.add_template_global(fragment_cache.user_card, 'user_card')
+
+app.register_blueprint(api)
+
+
+##############################################################################
+# Metrics sampled when /metrics is collected (see metrics.py)
+
+
+def engines():
+    """Every engine in use, by the name metrics report it under."""
+
+    return {'primary': db.engine, **{name: engine for engine, name in router.names.items()}}
+
+
+def pool_gauge(measure):
+    def sample():
+        values = {}
+        for name, engine in engines().items():
+            try:
+                values[(name,)] = measure(engine.pool)
+            except AttributeError:
+                # NullPool and friends keep no such count
+                pass
+        return values
+    return sample
+
+
+def cache_stat(stat):
+    def sample():
+        values = {('principal',): principal_cache.stats()[stat]}
+        for template, counts in fragment_cache.stats()['templates'].items():
+            values[(template,)] = counts[stat]
+        return values
+    return sample
+
+
+def graph_stat(stat):
+    def sample():
+        stats = graph.index.stats()
+        return {(): stats[stat]} if stats['loaded'] else {}
+    return sample
+
+
+metrics.registry.callback(
+    'warbler_db_pool_checked_out', "Connections checked out of the pool.",
+    'gauge', ['engine'], pool_gauge(lambda pool: pool.checkedout()))
+metrics.registry.callback(
+    'warbler_db_pool_overflow', "Connections open beyond the pool size.",
+    'gauge', ['engine'], pool_gauge(lambda pool: max(0, pool.overflow())))
+metrics.registry.callback(
+    'warbler_db_queries_total', "SQL statements run, by engine.",
+    'counter', ['engine'],
+    lambda: {(name,): count for name, count in router.stats()['queries'].items()})
+metrics.registry.callback(
+    'warbler_cache_hits_total', "Principal and fragment cache hits.",
+    'counter', ['cache'], cache_stat('hits'))
+metrics.registry.callback(
+    'warbler_cache_misses_total', "Principal and fragment cache misses.",
+    'counter', ['cache'], cache_stat('misses'))
+metrics.registry.callback(
+    'warbler_cache_entries', "Entries held by each cache.",
+    'gauge', ['cache'],
+    lambda: {('principal',): principal_cache.stats()['size'],
+             ('fragments',): fragment_cache.stats()['size']})
+metrics.registry.callback(
+    'warbler_follow_graph_edges', "Follows held by the in-memory follow graph.",
+    'gauge', [], graph_stat('edges'))
+metrics.registry.callback(
+    'warbler_follow_graph_bytes', "Memory used by the in-memory follow graph.",
+    'gauge', [], graph_stat('bytes'))
+metrics.registry.callback(
+    'warbler_password_hashes_in_flight', "Password hashes running or queued.",
+    'gauge', [], lambda: {(): hasher.stats()['in_flight']})
+metrics.registry.callback(
+    'warbler_password_hashes_rejected_total', "Password hashes refused as the pool was full.",
+    'counter', [], lambda: {(): hasher.stats()['rejected']})
 
 
 ##############################################################################
@@ -31,13 +164,18 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    g.user is a CurrentUser built from the principal cache, so most requests
+    never query users; see principal.py.
+    """
     # print("Before request is running")
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+    g.user = None
 
-    else:
-        g.user = None
+    if CURR_USER_KEY in session:
+        snapshot = principal_cache.get(session[CURR_USER_KEY])
+        if snapshot:
+            g.user = CurrentUser(snapshot)
 
 
 def do_login(user):
@@ -106,6 +244,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # authenticate() may have rehashed the password at a new cost
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -129,41 +269,73 @@ def logout():
 ##############################################################################
 # General user routes:
 
+def user_cards():
+    """Users that aren't deleted, loading just the columns a user card shows."""
+
+    return (User.query
+            .options(load_only(*USER_CARD_COLUMNS))
+            .filter(User.deleted_at.is_(None)))
+
+
 @app.route('/users')
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by username, bio or
+    location (ranked; see search.py). Paged with the 'after' and 'limit'
+    params.
     """
 
-    search = request.args.get('q')
+    term = request.args.get('q')
+    after = request.args.get('after')
 
-    if not search:
-        users = User.query.all()
+    if term:
+        page = search.search_users(term, page_size(), after)
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        page = paginate_by_id(User.query.filter(User.deleted_at.is_(None)),
+                              User.id, after, page_size())
+    prime_follow_state(page.items)
+
+    suggested = []
+    if g.user and not term and not after:
+        suggested = recommendations.suggested_users(g.user.id)
+
+    return render_template('users/index.html', users=page.items,
+                           next_cursor=page.next_cursor, suggested=suggested)
+
 
-    return render_template('users/index.html', users=users)
+@app.route('/users/autocomplete')
+def users_autocomplete():
+    """JSON list of users whose username starts with the 'q' param."""
+
+    prefix = request.args.get('q', '')
+    if not prefix:
+        return jsonify(users=[])
+
+    users = search.autocomplete(prefix)
+    return jsonify(users=[dict(id=id, username=username, image_url=image_url)
+                          for id, username, image_url in users])
 
 
 @app.route('/users/<int:user_id>')
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = User.live_or_404(user_id)
+
+    not_modified = conditional.validate(user.id, user.updated_at)
+    if not_modified:
+        return not_modified
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    likes = [message.id for message in user.likes]
-    print("============================")
-    print(likes)
-    return render_template('users/show.html', user=user, messages=messages, likes=likes)
+    page = paginate_newest_first(Message.query.filter(Message.user_id == user_id),
+                                 Message.timestamp, Message.id,
+                                 request.args.get('before'), page_size())
+    messages = page.items
+    liked_msg_ids = Likes.liked_among(g.user.id, [m.id for m in messages]) if g.user else set()
+    return render_template('users/show.html', user=user, messages=messages, likes=liked_msg_ids,
+                           next_cursor=page.next_cursor)
 
 
 @app.route('/users/<int:user_id>/following')
@@ -174,8 +346,19 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = User.live_or_404(user_id)
+    page = graph.following_page(user, user_cards(),
+                                request.args.get('after'), page_size())
+
+    # the cards show the followed users' own profiles, so they count too
+    cards_updated = max((card.updated_at for card in page.items), default=None)
+    not_modified = conditional.validate(user.id, user.updated_at, cards_updated)
+    if not_modified:
+        return not_modified
+
+    prime_follow_state(page.items)
+    return render_template('users/following.html', user=user, following=page.items,
+                           next_cursor=page.next_cursor)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -186,8 +369,18 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = User.live_or_404(user_id)
+    page = graph.followers_page(user, user_cards(),
+                                request.args.get('after'), page_size())
+
+    cards_updated = max((card.updated_at for card in page.items), default=None)
+    not_modified = conditional.validate(user.id, user.updated_at, cards_updated)
+    if not_modified:
+        return not_modified
+
+    prime_follow_state(page.items)
+    return render_template('users/followers.html', user=user, followers=page.items,
+                           next_cursor=page.next_cursor)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -198,9 +391,14 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+    followed_user = User.live_or_404(follow_id)
+
+    # insert the Follows row itself (not through g.user.following) so the
+    # timeline fan-out hooks in timeline.py run
+    if not Follows.exists(g.user.id, followed_user.id):
+        db.session.add(Follows(user_being_followed_id=followed_user.id,
+                               user_following_id=g.user.id))
+        db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -213,10 +411,53 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    follow = Follows.query.get((follow_id, g.user.id))
+    if follow:
+        db.session.delete(follow)
+        db.session.commit()
+
+    return redirect(f"/users/{g.user.id}/following")
+
+
+@app.route('/users/follow', methods=['POST'])
+def add_follows():
+    """Follow every user in the 'user_ids' form field(s) at once."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    try:
+        user_ids = bulk_follows.parse_ids(request.form.getlist('user_ids'))
+    except ValueError as e:
+        flash(str(e), "danger")
+        return redirect(f"/users/{g.user.id}/following")
+
+    added = bulk_follows.follow_many(g.user.id, user_ids)
+    db.session.commit()
+
+    flash(f"Followed {len(added)} users.", "success")
+    return redirect(f"/users/{g.user.id}/following")
+
+
+@app.route('/users/stop-following', methods=['POST'])
+def stop_following_many():
+    """Stop following every user in the 'user_ids' form field(s) at once."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    try:
+        user_ids = bulk_follows.parse_ids(request.form.getlist('user_ids'))
+    except ValueError as e:
+        flash(str(e), "danger")
+        return redirect(f"/users/{g.user.id}/following")
+
+    removed = bulk_follows.unfollow_many(g.user.id, user_ids)
     db.session.commit()
 
+    flash(f"Unfollowed {len(removed)} users.", "success")
     return redirect(f"/users/{g.user.id}/following")
 
 # Adding Like Routes
@@ -226,7 +467,8 @@ def show_likes(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = User.live_or_404(
+        user_id, User.query.options(selectinload(User.likes).options(author_option())))
     return render_template('users/likes.html', user=user, likes=user.likes)
 
 @app.route('/users/add_like/<int:message_id>', methods=['POST'])
@@ -238,16 +480,13 @@ def toggle_like(message_id):
         return redirect("/")
 
     liked_message = Message.query.get_or_404(message_id)
-    
-
-    user_likes = g.user.likes
 
-    if liked_message in user_likes:
-        g.user.likes = [like for like in user_likes if like != liked_message]
-    else:
-        g.user.likes.append(liked_message)
-
-    db.session.commit()
+    try:
+        likes.toggle_like(g.user.id, liked_message.id)
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent request liked it first
+        db.session.rollback()
 
     return redirect("/")
 
@@ -277,6 +516,7 @@ def profile():
             user.header_image_url = form.header_image_url.data
             user.bio = form.bio.data
             db.session.commit()
+            principal_cache.invalidate(user.id)
             flash(f"Updated Profile {user.username}!", "success")
             return redirect(f"/users/{g.user.id}")
     
@@ -290,7 +530,7 @@ def change_password():
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    form = EditPasswordForm(obj=g.user)
+    form = EditPasswordForm()
 
     if form.validate_on_submit():
         user = User.change_password(g.user.username,
@@ -302,6 +542,7 @@ def change_password():
             return redirect('/')
         try:
             db.session.commit()
+            principal_cache.invalidate(user.id)
             flash('Password successfully changed', 'success')
             return redirect(f"/users/{g.user.id}")
         except (InvalidRequestError, IntegrityError):
@@ -320,12 +561,30 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    # tombstone the account now; the purge runs in the background
+    user = g.user.load()
+    user.deleted_at = datetime.utcnow()
+    jobs.enqueue('delete_account', key=f"delete-account:{user.id}", user_id=user.id)
     db.session.commit()
+    principal_cache.invalidate(g.user.id)
 
     return redirect("/signup")
 
 
+@jobs.task
+def delete_account(user_id, part=0):
+    """Purge a user whose account deletion was requested; see delete_user.
+
+    Each run out of time queues the next `part`, keyed so a rerun of this
+    one doesn't queue it twice.
+    """
+
+    if not purge.purge_user(user_id):
+        # out of time; a fresh job picks up where this one stopped
+        jobs.enqueue('delete_account', key=f"delete-account:{user_id}:{part + 1}",
+                     user_id=user_id, part=part + 1)
+
+
 ##############################################################################
 # Messages routes:
 
@@ -356,10 +615,28 @@ def messages_add():
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get_or_404(message_id)
+    msg = (Message.query
+           .options(author_option())
+           .filter(Message.id == message_id,
+                   Message.by_live_authors())
+           .first_or_404())
+
+    not_modified = conditional.validate(msg.id, msg.version, msg.user.updated_at)
+    if not_modified:
+        return not_modified
+
     return render_template('messages/show.html', message=msg)
 
 
+@app.route('/trending')
+def trending_messages():
+    """Messages with the most recent likes, best first; paged with 'after'."""
+
+    page = trending.trending_page(page_size(), request.args.get('after'))
+    return render_template('messages/trending.html', messages=page.items,
+                           next_cursor=page.next_cursor)
+
+
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
 def messages_destroy(message_id):
     """Delete a message."""
@@ -391,24 +668,22 @@ def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages of followed_users, read from the
+      precomputed timeline (see timeline.py)
+
+    Both are paged with the 'before' and 'limit' params.
     """
 
+    before = request.args.get('before')
+
     if g.user:
-        f_ids = [f.id for f in g.user.following]
-        # print(f_ids)
-        # print(g.user.following)
-
-        
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(f_ids + [g.user.id]))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-        
-        liked_msg_ids = [msg.id for msg in g.user.likes]
+        page = timeline.get_timeline(g.user.id, limit=page_size(), before=before,
+                                     options=[author_option()])
+        messages = page.items
+
+        liked_msg_ids = Likes.liked_among(g.user.id, [msg.id for msg in messages])
         # print(dir(messages))
+        suggested = recommendations.suggested_users(g.user.id)
 
         form = MessageForm()
 
@@ -417,15 +692,18 @@ def homepage():
             g.user.messages.append(msg)
             db.session.commit()
 
-            return render_template('home.html', messages=messages, likes=liked_msg_ids, form = form)
-        return render_template('home.html', messages=messages, likes=liked_msg_ids, form = form)
+            return render_template('home.html', messages=messages, likes=liked_msg_ids, form = form,
+                                   next_cursor=page.next_cursor, suggested=suggested)
+        return render_template('home.html', messages=messages, likes=liked_msg_ids, form = form,
+                               next_cursor=page.next_cursor, suggested=suggested)
     else:
-        messages = (Message
-                    .query
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-        
+        page = paginate_newest_first(Message.query
+                                     .options(author_option())
+                                     .filter(Message.by_live_authors()),
+                                     Message.timestamp, Message.id,
+                                     before, page_size())
+        messages = page.items
+
         form = LoginForm()
 
         if form.validate_on_submit():
@@ -433,35 +711,184 @@ def homepage():
                                  form.password.data)
 
             if user:
+                db.session.commit()
                 do_login(user)
                 flash(f"Hello, {user.username}!", "success")
                 return redirect("/")
 
-        return render_template('home-anon.html', messages=messages, form = form)
+        hot = trending.trending_page(limit=5).items
+
+        return render_template('home-anon.html', messages=messages, form = form,
+                               next_cursor=page.next_cursor, trending=hot)
+
+
+
+##############################################################################
+# Management commands
+
+
+@app.cli.command('rebuild-timelines')
+@click.option('--batch-size', default=500, help='Users rebuilt per commit.')
+@click.argument('user_ids', nargs=-1, type=int)
+def rebuild_timelines_command(batch_size, user_ids):
+    """Rebuild precomputed home timelines (all users, or just USER_IDS)."""
+
+    rebuilt = timeline.rebuild_all(batch_size=batch_size, user_ids=user_ids)
+    click.echo(f"Rebuilt {rebuilt} timelines.")
+
+
+@app.cli.command('trim-timelines')
+@click.option('--batch-size', default=500, help='Users trimmed per commit.')
+def trim_timelines_command(batch_size):
+    """Cut timelines back to their maximum length; run periodically."""
+
+    trimmed = timeline.trim_all(batch_size=batch_size)
+    click.echo(f"Trimmed {trimmed} timelines.")
+
+
+@app.cli.command('reconcile-counters')
+@click.option('--batch-size', default=1000, help='Users recounted per commit.')
+def reconcile_counters_command(batch_size):
+    """Recount every user's message/follow/like counters."""
+
+    checked = counters.reconcile(batch_size=batch_size)
+    click.echo(f"Recounted {checked} users.")
+
+
+@app.cli.command('create-search-index')
+def create_search_index_command():
+    """Create or repopulate the user search index on an existing database."""
+
+    search.create_search_index()
+    click.echo("Search index ready.")
+
+
+@app.cli.command('migrate')
+@click.option('--status', is_flag=True, help='List pending migrations, applying none.')
+def migrate_command(status):
+    """Apply pending schema migrations; see migrations.py."""
 
+    if status:
+        for version, _, _ in migrations.pending():
+            click.echo(f"pending: {version}")
+        return
+
+    for version in migrations.migrate():
+        click.echo(f"Applied {version}.")
+    click.echo("Schema up to date.")
+
+
+@app.cli.command('load-csvs')
+@click.option('--directory', default='generator', help='Where users/messages/follows.csv are.')
+@click.option('--chunk-size', default=loader.DEFAULT_CHUNK_SIZE, help='Rows per COPY/INSERT.')
+@click.option('--workers', type=int, default=None, help='Tables loaded at once.')
+@click.option('--reset/--no-reset', default=False, help='Drop and recreate all tables first.')
+def load_csvs_command(directory, chunk_size, workers, reset):
+    """Bulk-load the seed CSVs, then rebuild timelines and counters."""
+
+    if reset:
+        db.drop_all()
+        db.create_all()
+
+    for result in loader.load_csvs(directory, chunk_size=chunk_size, workers=workers):
+        rate = result.rows / result.seconds if result.seconds else 0
+        click.echo(f"{result.table}: {result.rows} rows in {result.seconds:.1f}s "
+                   f"({rate:,.0f} rows/s)")
+
+    timeline.rebuild_all()
+    counters.reconcile()
+    click.echo("Rebuilt timelines and counters.")
+
+
+@app.cli.command('run-jobs')
+@click.option('--concurrency', default=4, help='Jobs run at once.')
+@click.option('--poll-interval', default=1.0, help='Seconds between polls when idle.')
+@click.option('--stale-after', default=jobs.DEFAULT_STALE_AFTER,
+              help='Seconds before a running job is presumed abandoned.')
+@click.option('--burst', is_flag=True, help='Exit once no job is due.')
+def run_jobs_command(concurrency, poll_interval, stale_after, burst):
+    """Run background jobs until interrupted; see jobs.py."""
+
+    worker = jobs.Worker(app, concurrency=concurrency, poll_interval=poll_interval,
+                         stale_after=stale_after)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+
+    click.echo(f"Worker {worker.name}: {concurrency} threads.")
+    worker.run(burst=burst)
+    click.echo(f"Jobs: {jobs.stats()}")
+
+
+@app.cli.command('rebuild-trending')
+@click.option('--batch-size', default=1000, help='Messages rescored per commit.')
+def rebuild_trending_command(batch_size):
+    """Recompute every message's trending score from its like count."""
+
+    rebuilt = trending.rebuild(batch_size=batch_size)
+    click.echo(f"Rescored {rebuilt} messages.")
+
+
+@app.cli.command('recommend-follows')
+@click.option('--workers', type=int, default=None, help='Scoring processes (default: one per core).')
+@click.option('--chunk-size', default=recommendations.DEFAULT_CHUNK_SIZE,
+              help='Users scored and written per chunk.')
+@click.argument('user_ids', nargs=-1, type=int)
+def recommend_follows_command(workers, chunk_size, user_ids):
+    """Recompute "who to follow" suggestions (for USER_IDS, or everyone)."""
+
+    result = recommendations.recommend(user_ids or None, workers=workers,
+                                       chunk_size=chunk_size)
+    click.echo(f"{result.suggestions} suggestions for {result.users} users "
+               f"in {result.seconds:.1f}s; graph of {result.edges} follows "
+               f"in {result.graph_bytes / 2**20:.1f} MiB.")
+
+
+@app.cli.command('graph-stats')
+def graph_stats_command():
+    """Load the follow graph and report its size in memory."""
+
+    graph.index.load()
+    stats = graph.index.stats()
+    per_edge = f"{stats['bytes_per_edge']:.2f}" if stats['edges'] else "-"
+    click.echo(f"{stats['edges']} follows in {stats['bytes'] / 2**20:.1f} MiB "
+               f"({per_edge} bytes per follow, both directions), "
+               f"loaded in {stats['load_seconds']:.1f}s.")
+
+
+@app.cli.command('import-follows')
+@click.option('--file', 'path', required=True, help='A follows.csv to apply.')
+def import_follows_command(path):
+    """Add the follows in a follows.csv, skipping ones that already exist."""
+
+    with open(path, newline='') as f:
+        added = bulk_follows.import_follows(f)
+    click.echo(f"Added {added} follows.")
 
 
 @app.errorhandler(404)
 def page_not_found(e):
     """404 NOT FOUND page."""
 
+    # API URLs matching no route have no blueprint to handle their errors
+    if request.path.startswith(f"{api.url_prefix}/"):
+        return http_error(e)
+
     return render_template('404.html'), 404
-##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
 
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
 
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+@app.errorhandler(HasherBusy)
+def hasher_busy(e):
+    """503 when too many password hashes are queued; see passwords.py."""
 
+    db.session.rollback()
+    return render_template('503.html'), 503, {'Retry-After': '1'}
 
 
+##############################################################################
+# Caching headers
+
+
+@app.after_request
+def add_header(response):
+    """Add validators and Cache-Control to every response; see conditional.py."""
+
+    return conditional.finish(response)
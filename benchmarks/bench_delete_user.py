@@ -0,0 +1,161 @@
+"""Benchmark deleting a prolific account.
+
+Seeds one user with --messages messages, --followers followers (each
+liking one of their messages) and --following followed users, then times:
+
+- the POST /users/delete request, which only locks the account and
+  queues the purge;
+- the `delete_account` job, batch by batch (see purge.py) -- the longest
+  batch is the longest any row stays locked;
+- with --cascade, on a fresh copy of the data, the alternative of a
+  single DELETE of the user row left to ON DELETE CASCADE, in one
+  transaction.
+
+    python benchmarks/bench_delete_user.py --messages 1000000 --followers 100000
+
+Uses a throwaway SQLite database unless DATABASE_URL is set.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault(
+    'DATABASE_URL',
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_delete_user.db')}")
+
+from app import app, CURR_USER_KEY  # noqa: E402
+from models import db, User, Message, Follows, Likes  # noqa: E402
+import counters  # noqa: E402
+import jobs  # noqa: E402
+import purge  # noqa: E402
+
+BATCH = 10000
+VICTIM_ID = 1
+
+
+def insert_batches(table, rows):
+    """Insert `rows` (an iterable of dicts) into `table`, BATCH at a time."""
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+
+
+def seed(num_messages, num_followers, num_following):
+    """The victim (user 1), their followers and the users they follow."""
+
+    db.drop_all()
+    db.create_all()
+
+    num_users = 1 + max(num_followers, num_following)
+    insert_batches(User.__table__, (
+        dict(id=i, username=f"user{i}", email=f"user{i}@test.com", password='x')
+        for i in range(1, num_users + 1)))
+
+    now = datetime.utcnow()
+    insert_batches(Message.__table__, (
+        dict(id=i, text=f"message {i}", timestamp=now, user_id=VICTIM_ID)
+        for i in range(1, num_messages + 1)))
+
+    insert_batches(Follows.__table__, (
+        dict(user_being_followed_id=VICTIM_ID, user_following_id=i)
+        for i in range(2, num_followers + 2)))
+    insert_batches(Follows.__table__, (
+        dict(user_being_followed_id=i, user_following_id=VICTIM_ID)
+        for i in range(2, num_following + 2)))
+
+    # every follower likes one of the victim's messages
+    insert_batches(Likes.__table__, (
+        dict(user_id=i, message_id=1 + i % num_messages)
+        for i in range(2, num_followers + 2)))
+
+    db.session.commit()
+    counters.reconcile()
+
+
+def time_request():
+    """Milliseconds for POST /users/delete."""
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = VICTIM_ID
+
+        start = perf_counter()
+        client.post("/users/delete")
+        return 1000 * (perf_counter() - start)
+
+
+def time_purge():
+    """(total seconds, batches, longest batch in ms) for the queued purge."""
+
+    timings = []
+
+    def timed(step):
+        def run(connection, user_id, batch_size):
+            start = perf_counter()
+            purged = step(connection, user_id, batch_size)
+            timings.append(perf_counter() - start)
+            return purged
+        return run
+
+    steps = purge.STEPS
+    purge.STEPS = [timed(step) for step in steps]
+    try:
+        start = perf_counter()
+        jobs.work_off()
+        total = perf_counter() - start
+    finally:
+        purge.STEPS = steps
+
+    return total, len(timings), 1000 * max(timings, default=0)
+
+
+def time_cascade():
+    """Seconds for one DELETE of the user row, cascading in one transaction."""
+
+    start = perf_counter()
+    db.session.execute(User.__table__.delete().where(User.__table__.c.id == VICTIM_ID))
+    db.session.commit()
+    return perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--followers', type=int, default=100000)
+    parser.add_argument('--following', type=int, default=1000)
+    parser.add_argument('--cascade', action='store_true')
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed(args.messages, args.followers, args.following)
+        print(f"user with {args.messages} messages, {args.followers} followers "
+              f"and {args.following} followed")
+
+        print(f"{'request':>20}: {time_request():10.2f} ms")
+
+        total, batches, longest = time_purge()
+        print(f"{'batched purge':>20}: {total:10.2f} s in {batches} batches, "
+              f"longest {longest:.2f} ms")
+        assert User.query.get(VICTIM_ID) is None
+
+        if args.cascade:
+            db.session.remove()
+            seed(args.messages, args.followers, args.following)
+            print(f"{'single cascade':>20}: {time_cascade():10.2f} s in one transaction")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Benchmark like toggling for a user with many likes.
+
+Compares the old toggle_like path (load g.user.likes, scan it, reassign the
+collection) against likes.toggle_like (one DELETE, maybe one INSERT).
+
+    python benchmarks/bench_likes.py --likes 50000 --rounds 20
+
+Uses a throwaway SQLite database unless DATABASE_URL is set.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault(
+    'DATABASE_URL',
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_likes.db')}")
+
+from app import app  # noqa: E402
+from models import db, User, Message, Likes  # noqa: E402
+import counters  # noqa: E402
+import likes  # noqa: E402
+
+
+def seed(num_likes):
+    """One author, one liker who has liked `num_likes` messages."""
+
+    db.drop_all()
+    db.create_all()
+
+    db.session.execute(User.__table__.insert(), [
+        dict(id=1, username='author', email='author@test.com', password='x'),
+        dict(id=2, username='liker', email='liker@test.com', password='x'),
+    ])
+
+    now = datetime.utcnow()
+    for start in range(0, num_likes + 1, 10000):
+        ids = range(start + 1, min(start + 10000, num_likes + 1) + 1)
+        db.session.execute(Message.__table__.insert(), [
+            dict(id=i, text=f"message {i}", timestamp=now, user_id=1) for i in ids])
+        liked = [dict(user_id=2, message_id=i) for i in ids if i <= num_likes]
+        if liked:
+            db.session.execute(Likes.__table__.insert(), liked)
+    db.session.commit()
+    counters.reconcile()
+
+    # the message being toggled is the one the liker hasn't liked yet
+    return num_likes + 1
+
+
+def legacy_toggle(user_id, message_id):
+    user = User.query.get(user_id)
+    message = Message.query.get(message_id)
+
+    user_likes = user.likes
+    if message in user_likes:
+        user.likes = [like for like in user_likes if like != message]
+    else:
+        user.likes.append(message)
+
+    db.session.commit()
+
+
+def keyed_toggle(user_id, message_id):
+    likes.toggle_like(user_id, message_id)
+    db.session.commit()
+
+
+def run(toggle, message_id, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = perf_counter()
+        toggle(2, message_id)
+        timings.append(perf_counter() - start)
+        # each request starts with an empty session
+        db.session.remove()
+    timings.sort()
+    return dict(mean_ms=1000 * sum(timings) / rounds,
+                p50_ms=1000 * timings[rounds // 2],
+                max_ms=1000 * timings[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--likes', type=int, default=50000)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    with app.app_context():
+        message_id = seed(args.likes)
+        print(f"user with {args.likes} likes, {args.rounds} toggles each")
+
+        for name, toggle in [('legacy collection', legacy_toggle),
+                             ('keyed delete/insert', keyed_toggle)]:
+            result = run(toggle, message_id, args.rounds)
+            print(f"{name:>20}: mean {result['mean_ms']:8.2f} ms  "
+                  f"p50 {result['p50_ms']:8.2f} ms  max {result['max_ms']:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+"""HTTP load test for the main Warbler routes.
+
+Seeds a database of the requested size (through generator/create_csvs.py and
+the bulk loader), serves the app, then drives a weighted mix of requests
+from concurrent logged-in clients for a fixed time. Reports requests/sec and
+p50/p95/p99 latency per route, optionally writes them as JSON, and compares
+them against a stored baseline -- exiting non-zero on a regression.
+
+    python benchmarks/bench_load.py --users 2000 --messages 20000 --follows 40000 \\
+        --clients 16 --duration 30 --output results.json
+
+    python benchmarks/bench_load.py --baseline results.json
+
+By default the app runs in-process on a threaded werkzeug server, which
+shares the interpreter with the clients; for real numbers run the app under
+a production server and point --url at it (with the same DATABASE_URL, so
+seeding and logins line up, or with --no-seed against an existing one).
+
+Uses a throwaway SQLite database unless DATABASE_URL is set.
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import defaultdict
+from random import Random
+from time import perf_counter
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import build_opener, HTTPCookieProcessor, HTTPRedirectHandler, Request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault(
+    'DATABASE_URL',
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_load.db')}")
+
+from app import app  # noqa: E402
+from models import db, User, Message  # noqa: E402
+import counters  # noqa: E402
+import loader  # noqa: E402
+import timeline  # noqa: E402
+
+# every generated user's password (see generator/create_csvs.py)
+PASSWORD = 'password'
+
+DEFAULT_MIX = 'homepage=40,users_show=20,list_users=10,toggle_like=15,add_follow=5,messages_add=10'
+
+CSRF_INPUT = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+##############################################################################
+# Setup
+
+
+def seed(args):
+    """Generate and bulk-load a dataset of the requested size."""
+
+    out = tempfile.mkdtemp()
+    subprocess.run([sys.executable, os.path.join(ROOT, 'generator', 'create_csvs.py'),
+                    '--users', str(args.users),
+                    '--messages', str(args.messages),
+                    '--follows', str(args.follows),
+                    '--seed', str(args.seed),
+                    '--out', out],
+                   check=True)
+
+    db.drop_all()
+    db.create_all()
+    loader.load_csvs(out)
+    timeline.rebuild_all()
+    counters.reconcile()
+
+
+def serve():
+    """Run the app on a threaded local server; returns its base URL."""
+
+    from werkzeug.serving import make_server
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+class NoRedirect(HTTPRedirectHandler):
+    """Report redirects as they are instead of following them."""
+
+    def redirect_request(self, *args):
+        return None
+
+
+##############################################################################
+# Traffic
+
+
+class Client:
+    """One logged-in browser session against the app at `base_url`."""
+
+    def __init__(self, base_url, username):
+        self.base_url = base_url
+        self.opener = build_opener(HTTPCookieProcessor(), NoRedirect())
+        self.csrf_token = None
+
+        self.get('/login')
+        status = self.post('/login', username=username, password=PASSWORD)
+        if status != 302:
+            raise RuntimeError(f"could not log in as {username} (HTTP {status})")
+        self.get('/messages/new')
+
+    def request(self, path, data=None):
+        if data is not None:
+            data = urlencode(data).encode()
+
+        try:
+            with self.opener.open(Request(self.base_url + path, data=data)) as res:
+                body = res.read().decode('UTF-8', 'replace')
+                status = res.status
+        except HTTPError as e:
+            return e.code
+
+        # keep the newest CSRF token for the forms that need one
+        match = CSRF_INPUT.search(body)
+        if match:
+            self.csrf_token = match.group(1)
+        return status
+
+    def get(self, path):
+        return self.request(path)
+
+    def post(self, path, **data):
+        if self.csrf_token:
+            data.setdefault('csrf_token', self.csrf_token)
+        return self.request(path, data)
+
+
+def homepage(client, rng, sizes):
+    return client.get('/')
+
+
+def users_show(client, rng, sizes):
+    return client.get(f"/users/{rng.randint(1, sizes['users'])}")
+
+
+def list_users(client, rng, sizes):
+    if rng.random() < 0.5:
+        term = ''.join(rng.choice('aeinorst') for _ in range(3))
+        return client.get(f"/users?q={term}")
+    return client.get(f"/users?after={rng.randint(0, sizes['users'])}")
+
+
+def toggle_like(client, rng, sizes):
+    return client.post(f"/users/add_like/{rng.randint(1, sizes['messages'])}")
+
+
+def add_follow(client, rng, sizes):
+    return client.post(f"/users/follow/{rng.randint(1, sizes['users'])}")
+
+
+def messages_add(client, rng, sizes):
+    return client.post('/messages/new', text=f"load test {rng.random():.6f}")
+
+
+ROUTES = {route.__name__: route for route in
+          [homepage, users_show, list_users, toggle_like, add_follow, messages_add]}
+
+
+def parse_mix(mix):
+    """'homepage=40,users_show=20' -> [('homepage', 40), ('users_show', 20)]"""
+
+    weights = []
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ROUTES:
+            raise SystemExit(f"unknown route in --mix: {name}")
+        weights.append((name, float(weight)))
+    return weights
+
+
+def drive(client, rng, mix, sizes, deadline, timings, errors):
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+
+    while perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        start = perf_counter()
+        try:
+            status = ROUTES[name](client, rng, sizes)
+        except (URLError, ConnectionError):
+            status = None
+        elapsed = perf_counter() - start
+
+        if status is None or status >= 500:
+            errors[name] += 1
+        else:
+            timings[name].append(elapsed)
+
+
+##############################################################################
+# Reporting
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(timings, errors, elapsed):
+    routes = {}
+    for name in sorted(set(timings) | set(errors)):
+        values = sorted(timings[name])
+        routes[name] = dict(requests=len(values),
+                            errors=errors[name],
+                            rps=len(values) / elapsed,
+                            p50_ms=1000 * percentile(values, 0.50) if values else None,
+                            p95_ms=1000 * percentile(values, 0.95) if values else None,
+                            p99_ms=1000 * percentile(values, 0.99) if values else None)
+    return routes
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of `results` against `baseline`, as readable strings."""
+
+    regressions = []
+    for name, base in baseline['routes'].items():
+        current = results['routes'].get(name)
+        if not current:
+            continue
+
+        for metric in ('p95_ms', 'p99_ms'):
+            if base[metric] and current[metric] and current[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {current[metric]:.1f} "
+                                   f"(baseline {base[metric]:.1f})")
+        if current['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f"{name} rps: {current['rps']:.1f} (baseline {base['rps']:.1f})")
+        if current['errors'] > base['errors']:
+            regressions.append(f"{name} errors: {current['errors']} (baseline {base['errors']})")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--follows', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-seed', action='store_true', help="Use the database as it is.")
+    parser.add_argument('--url', help="Load-test an already running server instead.")
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20, help="Seconds of traffic.")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="Route weights.")
+    parser.add_argument('--output', help="Write results here as JSON.")
+    parser.add_argument('--baseline', help="Fail if results regress against this JSON.")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed slowdown against the baseline (0.2 = 20%%).")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+
+    with app.app_context():
+        if not args.no_seed:
+            seed(args)
+
+        sizes = dict(users=db.session.query(db.func.max(User.id)).scalar() or 1,
+                     messages=db.session.query(db.func.max(Message.id)).scalar() or 1)
+        usernames = [username for (username,) in
+                     db.session.query(User.username).order_by(User.id).limit(args.clients)]
+        db.session.remove()
+
+    base_url = args.url or serve()
+    clients = [Client(base_url, username) for username in usernames]
+    print(f"{len(clients)} clients against {base_url} for {args.duration:.0f}s "
+          f"({sizes['users']} users, {sizes['messages']} messages)")
+
+    # each client records into its own dicts; they're merged afterwards
+    per_client = [(defaultdict(list), defaultdict(int)) for _ in clients]
+    start = perf_counter()
+    deadline = start + args.duration
+    threads = [threading.Thread(target=drive,
+                                args=(client, Random(f"{args.seed}-{i}"), mix, sizes,
+                                      deadline, *per_client[i]))
+               for i, client in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - start
+
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+    for client_timings, client_errors in per_client:
+        for name, values in client_timings.items():
+            timings[name].extend(values)
+        for name, count in client_errors.items():
+            errors[name] += count
+
+    results = dict(clients=len(clients),
+                   duration=elapsed,
+                   sizes=sizes,
+                   routes=summarize(timings, errors, elapsed))
+
+    for name, route in results['routes'].items():
+        if route['requests']:
+            print(f"{name:>13}: {route['rps']:8.1f} req/s  p50 {route['p50_ms']:8.2f} ms  "
+                  f"p95 {route['p95_ms']:8.2f} ms  p99 {route['p99_ms']:8.2f} ms  "
+                  f"errors {route['errors']}")
+        else:
+            print(f"{name:>13}: no successful requests, errors {route['errors']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nREGRESSIONS against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Benchmark login throughput against bcrypt cost.
+
+Posts to /login from `--clients` threads for each cost in `--rounds`, and
+reports logins per second, latency percentiles and how many logins were
+shed with a 503 because the hashing queue was full.
+
+    python benchmarks/bench_login.py --rounds 10 11 12 --clients 16 --logins 200
+
+Uses a throwaway SQLite database unless DATABASE_URL is set.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault(
+    'DATABASE_URL',
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_login.db')}")
+
+from app import app  # noqa: E402
+from models import db, User  # noqa: E402
+from passwords import hasher  # noqa: E402
+
+PASSWORD = 'benchmark-password'
+
+
+def seed(rounds):
+    """One user whose password is already hashed at `rounds`, so no rehash."""
+
+    db.drop_all()
+    db.create_all()
+    hasher.configure(rounds=rounds,
+                     workers=app.config['PASSWORD_HASH_WORKERS'],
+                     max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+                     timeout=app.config['PASSWORD_HASH_TIMEOUT'])
+    User.signup('bench', 'bench@test.com', PASSWORD, None)
+    db.session.commit()
+
+
+def login():
+    with app.test_client() as client:
+        start = perf_counter()
+        res = client.post('/login', data=dict(username='bench', password=PASSWORD))
+        return res.status_code, perf_counter() - start
+
+
+def run(clients, logins):
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        start = perf_counter()
+        results = list(pool.map(lambda _: login(), range(logins)))
+        elapsed = perf_counter() - start
+
+    timings = sorted(seconds for status, seconds in results if status == 302)
+    shed = sum(1 for status, _ in results if status == 503)
+    if not timings:
+        return dict(per_sec=0.0, p50_ms=0.0, p95_ms=0.0, shed=shed)
+
+    return dict(per_sec=len(timings) / elapsed,
+                p50_ms=1000 * timings[len(timings) // 2],
+                p95_ms=1000 * timings[int(len(timings) * 0.95)],
+                shed=shed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, nargs='+', default=[10, 11, 12])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--logins', type=int, default=200)
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.app_context():
+        print(f"{args.logins} logins from {args.clients} clients, "
+              f"{app.config['PASSWORD_HASH_WORKERS']} hashing threads")
+
+        for rounds in args.rounds:
+            seed(rounds)
+            result = run(args.clients, args.logins)
+            print(f"cost {rounds:>2}: {result['per_sec']:8.1f} logins/s  "
+                  f"p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+                  f"shed {result['shed']}")
+
+
+if __name__ == '__main__':
+    main()
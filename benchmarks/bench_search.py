@@ -0,0 +1,120 @@
+"""Benchmark user search and username autocomplete on a large users table.
+
+Seeds --users users with generated usernames, bios and locations, then
+times GET /users/autocomplete for random 1-4 character prefixes and
+search.search_users for random 3-6 character substrings, and reports
+latency percentiles against the 10 ms autocomplete budget.
+
+    python benchmarks/bench_search.py --users 1000000 --queries 500
+
+Uses a throwaway SQLite database unless DATABASE_URL is set.
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault(
+    'DATABASE_URL',
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_search.db')}")
+
+from app import app  # noqa: E402
+from models import db, User  # noqa: E402
+import search  # noqa: E402
+
+BATCH = 10000
+BUDGET_MS = 10
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'ten', 'zu', 'be', 'shi', 'no', 'var', 'el', 'qu']
+PLACES = ['Lisbon', 'Osaka', 'Denver', 'Nairobi', 'Quito', 'Tallinn', 'Perth', 'Leeds']
+
+
+def username(rng, i):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(3)) + str(i)
+
+
+def seed(num_users, rng):
+    """`num_users` users, loaded with the search index dropped, then rebuilt."""
+
+    db.drop_all()
+    db.create_all()
+    search.drop_search_index()
+
+    for start in range(1, num_users + 1, BATCH):
+        db.session.execute(User.__table__.insert(), [
+            dict(id=i, username=username(rng, i), email=f"user{i}@test.com", password='x',
+                 bio=' '.join(rng.choice(SYLLABLES) for _ in range(6)),
+                 location=rng.choice(PLACES))
+            for i in range(start, min(start + BATCH, num_users + 1))])
+    db.session.commit()
+
+    search.create_search_index()
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return dict(p50_ms=1000 * timings[len(timings) // 2],
+                p99_ms=1000 * timings[min(len(timings) - 1, len(timings) * 99 // 100)],
+                max_ms=1000 * timings[-1])
+
+
+def time_autocomplete(client, prefixes):
+    timings = []
+    for prefix in prefixes:
+        start = perf_counter()
+        client.get('/users/autocomplete', query_string=dict(q=prefix))
+        timings.append(perf_counter() - start)
+    return percentiles(timings)
+
+
+def time_search(terms):
+    timings = []
+    for term in terms:
+        start = perf_counter()
+        search.search_users(term, 20)
+        timings.append(perf_counter() - start)
+        db.session.remove()
+    return percentiles(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        seed(args.users, rng)
+        print(f"{args.users} users, {args.queries} queries each")
+
+        prefixes = [username(rng, 0)[:rng.randint(1, 4)] for _ in range(args.queries)]
+        terms = [''.join(rng.choice(SYLLABLES) for _ in range(3))[:rng.randint(3, 6)]
+                 for _ in range(args.queries)]
+        misses = [''.join(rng.choice(string.ascii_lowercase) for _ in range(4))
+                  for _ in range(args.queries)]
+
+        with app.test_client() as client:
+            results = [('autocomplete', time_autocomplete(client, prefixes))]
+        results += [('search', time_search(terms)),
+                    ('search, rare terms', time_search(misses))]
+
+        for name, result in results:
+            print(f"{name:>20}: p50 {result['p50_ms']:8.2f} ms  "
+                  f"p99 {result['p99_ms']:8.2f} ms  max {result['max_ms']:8.2f} ms")
+
+        p99 = results[0][1]['p99_ms']
+        verdict = "within" if p99 < BUDGET_MS else "over"
+        print(f"autocomplete p99 is {verdict} the {BUDGET_MS} ms budget")
+
+
+if __name__ == '__main__':
+    main()
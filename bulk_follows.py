@@ -0,0 +1,158 @@
+"""Following and unfollowing many users at once.
+
+`follow_many` and `unfollow_many` diff the requested ids against the
+follower's existing `follows` rows with set operations, then apply the
+difference with one multi-row INSERT or one DELETE. Counters move in one
+UPDATE per side, and the follower's timeline is rebuilt once, rather than
+backfilled or trimmed per followed user.
+
+These are Core writes, so the mapper events in counters.py, timeline.py
+and graph.py don't see them; everything they would have done happens here
+instead.
+
+`import_follows` applies a CSV in the generator's follows.csv format
+(user_being_followed_id, user_following_id), a chunk of rows at a time.
+"""
+
+import csv
+from collections import defaultdict
+
+from sqlalchemy import and_
+
+from models import db, Follows, User
+import counters
+import graph
+import timeline
+
+# most ids one request may follow or unfollow
+MAX_BATCH_SIZE = 5000
+
+follows = Follows.__table__
+
+
+def parse_ids(values):
+    """Ints from `values`, each a single id or comma/whitespace separated ids.
+
+    Raises ValueError on anything that isn't an id.
+    """
+
+    ids = set()
+    for value in values:
+        for part in str(value).replace(',', ' ').split():
+            try:
+                ids.add(int(part))
+            except ValueError:
+                raise ValueError(f"Not a user id: {part}")
+
+    if len(ids) > MAX_BATCH_SIZE:
+        raise ValueError(f"At most {MAX_BATCH_SIZE} users at a time.")
+    return ids
+
+
+def existing_users(user_ids):
+    """Which of `user_ids` are real users, not tombstoned? Returns a set."""
+
+    if not user_ids:
+        return set()
+
+    rows = (db.session.query(User.id)
+            .filter(User.id.in_(user_ids))
+            .filter(User.deleted_at.is_(None)))
+    return {user_id for (user_id,) in rows}
+
+
+def follow_many(follower_id, user_ids):
+    """Have `follower_id` follow every user in `user_ids`.
+
+    Unknown or deleted ids, the follower themselves and users already
+    followed are skipped. Returns the set of newly followed ids. The caller commits.
+    """
+
+    wanted = existing_users(set(user_ids) - {follower_id})
+    added = wanted - Follows.followed_among(follower_id, wanted)
+    if not added:
+        return added
+
+    connection = db.session.connection()
+    connection.execute(follows.insert().values([
+        dict(user_being_followed_id=user_id, user_following_id=follower_id)
+        for user_id in sorted(added)]))
+
+    counters.bump(connection, follower_id, 'following_count', len(added))
+    counters.bump_many(connection, added, 'followers_count', 1)
+    timeline.rebuild_timeline(connection, follower_id)
+    graph.record(follower_id, added, True)
+    return added
+
+
+def unfollow_many(follower_id, user_ids):
+    """Have `follower_id` stop following every user in `user_ids`.
+
+    Returns the set of ids actually unfollowed. The caller commits.
+    """
+
+    removed = Follows.followed_among(follower_id, set(user_ids))
+    if not removed:
+        return removed
+
+    connection = db.session.connection()
+    connection.execute(follows.delete().where(and_(
+        follows.c.user_following_id == follower_id,
+        follows.c.user_being_followed_id.in_(removed))))
+
+    counters.bump(connection, follower_id, 'following_count', -len(removed))
+    counters.bump_many(connection, removed, 'followers_count', -1)
+    timeline.rebuild_timeline(connection, follower_id)
+    graph.record(follower_id, removed, False)
+    return removed
+
+
+def read_follows(lines, follower_id=None):
+    """(follower id, followed id) pairs from follows.csv-style `lines`.
+
+    With `follower_id`, the file may leave out the user_following_id column,
+    and rows for any other follower are skipped.
+    """
+
+    for row in csv.DictReader(lines):
+        followed = row.get('user_being_followed_id')
+        follower = row.get('user_following_id') or follower_id
+        if not followed or follower is None:
+            continue
+
+        follower = int(follower)
+        if follower_id is not None and follower != follower_id:
+            continue
+        yield follower, int(followed)
+
+
+def import_follows(lines, follower_id=None, commit_every=MAX_BATCH_SIZE):
+    """Apply a follows.csv; see `read_follows`. Returns the number of follows added.
+
+    The file is read `commit_every` rows at a time, so memory doesn't grow
+    with it. Each chunk's rows are grouped by follower (the generator
+    doesn't write them in follower order), and each follower's follows in
+    the chunk go in one batch, committed on its own.
+    """
+
+    added = 0
+    by_follower = defaultdict(set)
+    rows = 0
+
+    def flush():
+        nonlocal added
+        live = existing_users(set(by_follower))
+        for follower in sorted(by_follower):
+            if follower in live:
+                added += len(follow_many(follower, by_follower[follower]))
+                db.session.commit()
+        by_follower.clear()
+
+    for follower, followed in read_follows(lines, follower_id):
+        by_follower[follower].add(followed)
+        rows += 1
+        if rows % commit_every == 0:
+            flush()
+    flush()
+
+    return added
@@ -0,0 +1,90 @@
+"""Conditional GET (ETag / Last-Modified / 304) for Warbler pages.
+
+Views whose output is determined by a few markers -- a message's version,
+a user's `updated_at` -- call `validate(*markers)` before doing any real
+work. The markers, the endpoint, the query string (so each page of a
+paged view has its own) and the viewer (id and `updated_at`, which covers
+the nav bar, like buttons and follow buttons) are hashed into an ETag; the newest datetime among them is the Last-Modified. If the client's
+`If-None-Match` / `If-Modified-Since` already match, `validate` returns a
+304 to send instead of rendering.
+
+`finish` then sets the validators and Cache-Control on every response:
+
+- validated pages: `public, no-cache` for anonymous viewers (a CDN may keep
+  them and revalidate), `private, no-cache` when logged in.
+- everything else: `no-cache` anonymously, `private, no-store` logged in.
+"""
+
+from datetime import datetime
+from hashlib import sha1
+
+from flask import g, request, session, Response
+from werkzeug.http import is_resource_modified
+
+from models import db, User
+
+
+def viewer_marker():
+    """The logged-in user's `updated_at`, or None when logged out.
+
+    Read fresh rather than from the principal cache, which may lag.
+    """
+
+    if not g.user:
+        return None
+
+    return (db.session.query(User.updated_at)
+            .filter(User.id == g.user.id)
+            .scalar())
+
+
+def validate(*markers):
+    """Set this response's validators; return a 304 if the client is current.
+
+    Returns None when the page has to be rendered.
+    """
+
+    viewer = viewer_marker()
+    parts = (request.endpoint, request.query_string, *markers,
+             g.user.id if g.user else None, viewer)
+    dates = [part for part in parts if isinstance(part, datetime)]
+
+    g.etag = sha1(repr(parts).encode()).hexdigest()
+    g.last_modified = max(dates).replace(microsecond=0) if dates else None
+
+    # pending flash messages are only shown by rendering
+    if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+        return None
+
+    if is_resource_modified(request.environ, etag=g.etag, last_modified=g.last_modified):
+        return None
+
+    return Response(status=304)
+
+
+def finish(response):
+    """Attach validators and Cache-Control to `response`."""
+
+    if request.endpoint == 'static':
+        return response
+
+    etag = g.get('etag')
+    # a modified session means a Set-Cookie, which must never be shared
+    private = bool(g.get('user')) or session.modified
+
+    if etag:
+        response.set_etag(etag)
+        response.last_modified = g.last_modified
+        response.cache_control.no_cache = True
+        if private:
+            response.cache_control.private = True
+        else:
+            response.cache_control.public = True
+    elif private:
+        response.cache_control.private = True
+        response.cache_control.no_store = True
+    else:
+        response.cache_control.no_cache = True
+
+    response.vary.add('Cookie')
+    return response
@@ -0,0 +1,155 @@
+"""Denormalized per-user counters for Warbler.
+
+Profiles and the home page show how many messages, followers, followed
+users and likes a user has. Rather than loading each relationship just to
+take its length, `User` carries `messages_count`, `followers_count`,
+`following_count` and `likes_count` columns, and `Message` carries its own
+`likes_count` for the timelines.
+
+The mapper events below adjust them inside the same flush (and so the same
+transaction) as the row that changed them. Writes that bypass the ORM should
+call `reconcile` (or `flask reconcile-counters`) afterwards.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import event, select, func
+
+from models import db, Follows, Likes, Message, User
+
+users = User.__table__
+messages = Message.__table__
+follows = Follows.__table__
+likes = Likes.__table__
+
+
+def bump(connection, user_id, column, delta):
+    """Add `delta` to counter `column` of user `user_id`."""
+
+    counter = users.c[column]
+    connection.execute(users.update()
+                       .where(users.c.id == user_id)
+                       .values({counter: counter + delta}))
+
+
+def bump_many(connection, user_ids, column, delta):
+    """Add `delta` to counter `column` of every user in `user_ids`."""
+
+    counter = users.c[column]
+    connection.execute(users.update()
+                       .where(users.c.id.in_(user_ids))
+                       .values({counter: counter + delta}))
+
+
+def bump_message(connection, message_id, delta):
+    """Add `delta` to the like count of message `message_id`."""
+
+    connection.execute(messages.update()
+                       .where(messages.c.id == message_id)
+                       .values(likes_count=messages.c.likes_count + delta))
+
+    # the count shows on the author's profile, so that changes too
+    author = select([messages.c.user_id]).where(messages.c.id == message_id)
+    connection.execute(users.update()
+                       .where(users.c.id == author.as_scalar())
+                       .values(updated_at=datetime.utcnow()))
+
+
+def like_added(connection, user_id, message_id):
+    bump(connection, user_id, 'likes_count', 1)
+    bump_message(connection, message_id, 1)
+
+
+def like_removed(connection, user_id, message_id):
+    bump(connection, user_id, 'likes_count', -1)
+    bump_message(connection, message_id, -1)
+
+
+def reconcile(batch_size=1000):
+    """Recount every user's and message's counters, committing per id range.
+
+    Returns the number of users checked.
+    """
+
+    def count(table, column):
+        return (select([func.count()])
+                .select_from(table)
+                .where(column == users.c.id)
+                .as_scalar())
+
+    recounted = {
+        users.c.messages_count: count(messages, messages.c.user_id),
+        users.c.following_count: count(follows, follows.c.user_following_id),
+        users.c.followers_count: count(follows, follows.c.user_being_followed_id),
+        users.c.likes_count: count(likes, likes.c.user_id),
+    }
+
+    max_id = db.session.query(func.max(User.id)).scalar() or 0
+    checked = 0
+
+    for start in range(0, max_id, batch_size):
+        result = db.session.execute(
+            users.update()
+            .where(users.c.id > start)
+            .where(users.c.id <= start + batch_size)
+            .values(recounted))
+        db.session.commit()
+        checked += result.rowcount
+
+    message_likes = (select([func.count()])
+                     .select_from(likes)
+                     .where(likes.c.message_id == messages.c.id)
+                     .as_scalar())
+    max_message_id = db.session.query(func.max(Message.id)).scalar() or 0
+
+    for start in range(0, max_message_id, batch_size):
+        db.session.execute(
+            messages.update()
+            .where(messages.c.id > start)
+            .where(messages.c.id <= start + batch_size)
+            .values(likes_count=message_likes))
+        db.session.commit()
+
+    return checked
+
+
+##############################################################################
+# Keep counters current for ORM writes
+
+
+@event.listens_for(Message, 'after_insert')
+def _message_added(mapper, connection, target):
+    bump(connection, target.user_id, 'messages_count', 1)
+
+
+@event.listens_for(Message, 'before_delete')
+def _message_deleted(mapper, connection, target):
+    bump(connection, target.user_id, 'messages_count', -1)
+
+    # the message's likes go with it by cascade, which no hook sees
+    likers = select([likes.c.user_id]).where(likes.c.message_id == target.id)
+    connection.execute(users.update()
+                       .where(users.c.id.in_(likers))
+                       .values(likes_count=users.c.likes_count - 1))
+
+
+@event.listens_for(Follows, 'after_insert')
+def _follow_added(mapper, connection, target):
+    bump(connection, target.user_following_id, 'following_count', 1)
+    bump(connection, target.user_being_followed_id, 'followers_count', 1)
+
+
+@event.listens_for(Follows, 'after_delete')
+def _follow_removed(mapper, connection, target):
+    bump(connection, target.user_following_id, 'following_count', -1)
+    bump(connection, target.user_being_followed_id, 'followers_count', -1)
+
+
+@event.listens_for(Likes, 'after_insert')
+def _like_added(mapper, connection, target):
+    like_added(connection, target.user_id, target.message_id)
+
+
+@event.listens_for(Likes, 'after_delete')
+def _like_removed(mapper, connection, target):
+    like_removed(connection, target.user_id, target.message_id)
@@ -0,0 +1,62 @@
+"""Per-request follow-state resolver.
+
+Listings show a Follow/Unfollow button on every user card. Instead of asking
+`g.user.is_following(user)` once per card, views `prime` the resolver with
+the ids on the page -- answered by the in-memory follow graph once it's
+loaded, else one query against `follows` (see graph.py) -- and templates
+answer each card with a set lookup through `is_following(user)`.
+"""
+
+from flask import g
+
+import graph
+
+
+class FollowState:
+    """Which users the viewer follows, resolved in batches and memoized."""
+
+    def __init__(self, viewer):
+        self.viewer = viewer
+        self.resolved = set()
+        self.followed = set()
+
+    def prime(self, user_ids):
+        """Resolve follow state for every id in `user_ids` in one go."""
+
+        pending = set(user_ids) - self.resolved
+        if pending:
+            self.followed |= graph.index.followed_among(self.viewer, pending)
+            self.resolved |= pending
+
+    def is_following(self, user_id):
+        """Does the viewer follow `user_id`? Resolves it alone if not primed."""
+
+        self.prime([user_id])
+        return user_id in self.followed
+
+
+def follow_state():
+    """The current request's `FollowState`, or None when logged out."""
+
+    if not g.user:
+        return None
+
+    if 'follow_state' not in g:
+        g.follow_state = FollowState(g.user)
+
+    return g.follow_state
+
+
+def prime_follow_state(users):
+    """Resolve follow state for a page of `users` up front."""
+
+    state = follow_state()
+    if state:
+        state.prime(user.id for user in users)
+
+
+def is_following(user):
+    """Template helper: does the logged-in user follow `user`?"""
+
+    state = follow_state()
+    return bool(state) and state.is_following(user.id)
@@ -0,0 +1,127 @@
+"""Rendered-fragment cache for message list items and user cards.
+
+The timelines, profiles and user listings render the same message and
+user-card markup for every viewer. `FragmentCache` keeps that markup,
+keyed by template, entity id and a version stamp, in a bounded in-process
+LRU, optionally backed by a shared store (anything with `get(key)` and
+`set(key, value)` on str values, e.g. a thin memcached or redis wrapper).
+
+A stamp changes whenever the markup would:
+
+- message items: the message's timestamp and edit `version` plus the
+  author's username and avatar -- not the author's `updated_at`, which
+  moves on every like and follow. (The timestamp guards against ids being
+  reused after the database is reseeded.)
+- user cards: the user's `updated_at`.
+
+Per-viewer parts (like buttons and counts, follow buttons) are never cached.
+Each fragment leaves a `HOLE` where they go, and templates fill it:
+
+    {% set follow %}...{% endset %}
+    {{ user_card(user, follow) }}
+"""
+
+from collections import OrderedDict, defaultdict
+from threading import Lock
+
+from flask import render_template
+from markupsafe import Markup, escape
+from sqlalchemy.orm import joinedload
+
+from models import Message
+
+# Where a fragment's per-viewer part goes; an HTML comment so an unfilled
+# hole is harmless.
+HOLE = Markup('<!--viewer-->')
+
+MESSAGE_TEMPLATE = 'fragments/message.html'
+USER_CARD_TEMPLATE = 'fragments/user_card.html'
+
+# The `User` columns each fragment renders (or stamps with), so views can
+# load just those; see `author_option` below and the follow-list views in app.py.
+MESSAGE_AUTHOR_COLUMNS = ('id', 'username', 'image_url', 'updated_at')
+USER_CARD_COLUMNS = ('id', 'username', 'image_url', 'header_image_url', 'bio', 'updated_at')
+
+
+def author_option():
+    """Join each message's author, with only the columns a message item uses."""
+
+    return joinedload(Message.user).load_only(*MESSAGE_AUTHOR_COLUMNS)
+
+
+class FragmentCache:
+    """Bounded LRU of rendered fragments, with an optional shared backend."""
+
+    def __init__(self, maxsize=10000, backend=None):
+        self.maxsize = maxsize
+        self.backend = backend
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    def render(self, template, entity_id, stamp, **context):
+        """`template` rendered with `context`, from cache when `stamp` matches."""
+
+        key = f"{template}:{entity_id}:{stamp}"
+
+        with self.lock:
+            html = self.entries.get(key)
+            if html is not None:
+                self.entries.move_to_end(key)
+                self.hits[template] += 1
+                return html
+
+        if self.backend is not None:
+            html = self.backend.get(key)
+
+        if html is None:
+            html = render_template(template, hole=HOLE, **context)
+            if self.backend is not None:
+                self.backend.set(key, html)
+            counts = self.misses
+        else:
+            counts = self.hits
+
+        with self.lock:
+            counts[template] += 1
+            self.entries[key] = html
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+        return html
+
+    def fill(self, html, filling):
+        return Markup(html.replace(HOLE, escape(filling)))
+
+    def message(self, msg, filling=''):
+        """Template helper: a message item, with `filling` in its hole."""
+
+        author = msg.user
+        stamp = (msg.timestamp, msg.version, author.username, author.image_url)
+        return self.fill(self.render(MESSAGE_TEMPLATE, msg.id, stamp, msg=msg), filling)
+
+    def user_card(self, user, filling=''):
+        """Template helper: a user card, with `filling` in its hole."""
+
+        html = self.render(USER_CARD_TEMPLATE, user.id, user.updated_at, user=user)
+        return self.fill(html, filling)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits.clear()
+            self.misses.clear()
+
+    def stats(self):
+        """Hit/miss counts and hit rate per template, for monitoring."""
+
+        with self.lock:
+            templates = {}
+            for template in set(self.hits) | set(self.misses):
+                hits, misses = self.hits[template], self.misses[template]
+                templates[template] = dict(hits=hits,
+                                           misses=misses,
+                                           hit_rate=hits / (hits + misses))
+            return dict(templates=templates, size=len(self.entries))
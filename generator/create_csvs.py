@@ -2,15 +2,32 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. for a load test:
+
+    python generator/create_csvs.py --users 1000000 --messages 50000000 \\
+        --follows 100000000 --processes 8 --out /data/warbler
+
+Rows are written in chunks by a process pool and streamed to disk, so memory
+stays flat however large the files get. The output depends only on the sizes
+and --seed, and nothing is fetched over the network.
+
+Who posts and who gets followed follow power laws: a few users are very
+active and very popular, most are not. Follow edges are drawn per follower
+(each picks its out-degree, then that many distinct followees weighted by
+popularity), so the N x N pair space is never materialized. Load the result
+with `flask load-csvs --directory <out>`.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import os
+import shutil
+from datetime import datetime
+from multiprocessing import Pool
+from random import Random
+
 from faker import Faker
-from helpers import get_random_datetime
+from helpers import get_random_datetime, power_law_rank, power_law_total, Ranking
 
 MAX_WARBLER_LENGTH = 140
 
@@ -22,9 +39,14 @@ NUM_USERS = 300
 NUM_MESSAGES = 1000
 NUM_FOLLWERS = 5000
 
-fake = Faker()
+CHUNK_SIZE = 20000
 
-# Generate random profile image URLs to use for users
+# Timestamps fall in the two years before this, so a given seed always
+# produces the same files.
+END_DATE = datetime(2020, 5, 1)
+
+# every generated user's password is "password"
+PASSWORD_HASH = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
 image_urls = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
@@ -32,46 +54,185 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
+header_image_urls = ["/static/images/warbler-hero.jpg"]
 
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+def chunk_random(settings, kind, index):
+    """Independent, reproducible Random and Faker for one chunk."""
+
+    chunk_seed = f"{settings['seed']}-{kind}-{index}"
+    fake = Faker()
+    fake.seed_instance(chunk_seed)
+    return Random(chunk_seed), fake
+
+
+def popularity(settings):
+    return Ranking(settings['users'], Random(f"{settings['seed']}-popularity").randrange(2 ** 32))
+
+
+def sociability(settings):
+    return Ranking(settings['users'], Random(f"{settings['seed']}-sociability").randrange(2 ** 32))
+
+
+def write_users(settings, index, start, stop, path):
+    rng, fake = chunk_random(settings, 'users', index)
+    width = len(str(settings['users']))
+
+    with open(path, 'w', newline='') as users_csv:
+        users_writer = csv.writer(users_csv)
+
+        for user_id in range(start, stop):
+            # the fixed-width id suffix keeps usernames (and emails) unique
+            username = f"{fake.user_name()}{user_id:0{width}d}"
+            users_writer.writerow([
+                f"{username}@{fake.free_email_domain()}",
+                username,
+                rng.choice(image_urls),
+                PASSWORD_HASH,
+                fake.sentence(),
+                rng.choice(header_image_urls),
+                fake.city(),
+            ])
+
+    return stop - start
+
+
+def write_messages(settings, index, start, stop, path):
+    rng, fake = chunk_random(settings, 'messages', index)
+    authors = popularity(settings)
+
+    with open(path, 'w', newline='') as messages_csv:
+        messages_writer = csv.writer(messages_csv)
+
+        for _ in range(start, stop):
+            rank = power_law_rank(rng, settings['users'], settings['activity_alpha'])
+            messages_writer.writerow([
+                fake.sentence(nb_words=rng.randint(4, 20))[:MAX_WARBLER_LENGTH],
+                get_random_datetime(rng=rng, end=END_DATE),
+                authors.user(rank),
+            ])
+
+    return stop - start
+
+
+def follow_count(settings, rng, follower_id, ranking):
+    """How many users `follower_id` follows: its power-law share of the total."""
+
+    num_users = settings['users']
+    share = (ranking.rank(follower_id) ** -settings['out_alpha']
+             / settings['out_total'] * settings['follows'])
+
+    # round up with probability equal to the fraction, so the expected
+    # total is exactly --follows
+    count = int(share) + (rng.random() < share - int(share))
+    return min(count, num_users // 2, num_users - 1)
+
+
+def write_follows(settings, index, start, stop, path):
+    rng, _ = chunk_random(settings, 'follows', index)
+    num_users = settings['users']
+    followed = popularity(settings)
+    followers = sociability(settings)
+    written = 0
+
+    with open(path, 'w', newline='') as follows_csv:
+        follows_writer = csv.writer(follows_csv)
+
+        for follower_id in range(start, stop):
+            count = follow_count(settings, rng, follower_id, followers)
+            chosen = set()
+            attempts = 0
+
+            while len(chosen) < count:
+                # popular users are drawn over and over; past a few misses per
+                # slot, fill the rest uniformly so this always terminates quickly
+                if attempts < 4 * count + 16:
+                    rank = power_law_rank(rng, num_users, settings['in_alpha'])
+                    user_id = followed.user(rank)
+                else:
+                    user_id = rng.randint(1, num_users)
+                attempts += 1
+
+                if user_id != follower_id:
+                    chosen.add(user_id)
+
+            follows_writer.writerows([user_id, follower_id] for user_id in sorted(chosen))
+            written += len(chosen)
+
+    return written
+
+
+def run_task(task):
+    writer, settings, index, start, stop, path = task
+    return writer(settings, index, start, stop, path)
+
+
+def generate(writer, headers, filename, total, settings, pool, ids_from=0,
+             chunk_size=CHUNK_SIZE):
+    """Write `total` rows to `filename` from chunks written in parallel.
+
+    Chunks go to part files, which are appended in order so the output
+    doesn't depend on which process finishes first. Returns the row count.
+    """
+
+    path = os.path.join(settings['out'], filename)
+    tasks = [(writer, settings, index, start, min(start + chunk_size, total + ids_from),
+              f"{path}.part{index:05d}")
+             for index, start in enumerate(range(ids_from, total + ids_from, chunk_size))]
+
+    written = 0
+    with open(path, 'w', newline='') as out:
+        csv.writer(out).writerow(headers)
+        for task, rows in zip(tasks, pool.imap(run_task, tasks)):
+            part = task[-1]
+            with open(part, newline='') as chunk:
+                shutil.copyfileobj(chunk, out)
+            os.remove(part)
+            written += rows
+
+    print(f"{filename}: {written} rows")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate Warbler CSVs.")
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLWERS,
+                        help="Expected number of follows (actual count varies slightly).")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--out', default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument('--in-alpha', type=float, default=1.0,
+                        help="Power-law exponent of how often a user is followed.")
+    parser.add_argument('--out-alpha', type=float, default=0.5,
+                        help="Power-law exponent of how many users a user follows.")
+    parser.add_argument('--activity-alpha', type=float, default=1.0,
+                        help="Power-law exponent of how often a user posts.")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+
+    settings = dict(users=args.users,
+                    follows=args.follows,
+                    seed=args.seed,
+                    out=args.out,
+                    in_alpha=args.in_alpha,
+                    out_alpha=args.out_alpha,
+                    activity_alpha=args.activity_alpha,
+                    out_total=power_law_total(args.users, args.out_alpha))
+
+    with Pool(args.processes) as pool:
+        # ids are 1-based, matching the serial ids the rows get when loaded
+        generate(write_users, USERS_CSV_HEADERS, 'users.csv',
+                 args.users, settings, pool, ids_from=1)
+        generate(write_messages, MESSAGES_CSV_HEADERS, 'messages.csv',
+                 args.messages, settings, pool)
+        # follows are chunked by follower, sized to ~CHUNK_SIZE edges each
+        generate(write_follows, FOLLOWS_CSV_HEADERS, 'follows.csv',
+                 args.users, settings, pool, ids_from=1,
+                 chunk_size=max(1, CHUNK_SIZE * args.users // max(args.follows, 1)))
+
+
+if __name__ == '__main__':
+    main()
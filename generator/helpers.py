@@ -1,14 +1,59 @@
 """Support functions for CSV generation."""
 
+import random
 from datetime import datetime
-from random import uniform
 
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+def get_random_datetime(year_gap=2, rng=random, end=None):
+    """Get a random datetime within `year_gap` years before `end` (default: now).
 
-    now = datetime.now()
+    Pass a seeded `rng` and a fixed `end` for reproducible output.
+    """
+
+    now = end or datetime.now()
     then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+    random_timestamp = rng.uniform(then.timestamp(), now.timestamp())
 
     return datetime.fromtimestamp(random_timestamp)
+
+
+def power_law_rank(rng, n, alpha):
+    """Draw a rank in 1..`n` with P(rank = r) roughly proportional to r**-alpha.
+
+    Inverse-CDF sampling of the continuous power law, so it's O(1) and needs
+    no table of weights.
+    """
+
+    u = rng.random()
+    if alpha == 1:
+        x = n ** u
+    else:
+        x = ((n ** (1 - alpha) - 1) * u + 1) ** (1 / (1 - alpha))
+    return min(max(int(x), 1), n)
+
+
+def power_law_total(n, alpha):
+    """Sum of r**-alpha for r in 1..`n`, to normalize power-law weights."""
+
+    return sum(r ** -alpha for r in range(1, n + 1))
+
+
+class Ranking:
+    """A seeded bijection between user ids 1..n and ranks 1..n.
+
+    Multiplying by a prime larger than n permutes the residues mod n, so
+    the order is scrambled without storing it.
+    """
+
+    PRIME = 2654435761
+
+    def __init__(self, n, offset):
+        self.n = n
+        self.offset = offset % n
+        self.inverse = pow(self.PRIME, -1, n) if n > 1 else 0
+
+    def user(self, rank):
+        return ((rank - 1) * self.PRIME + self.offset) % self.n + 1
+
+    def rank(self, user_id):
+        return ((user_id - 1 - self.offset) * self.inverse) % self.n + 1
@@ -0,0 +1,354 @@
+"""Process-local index of the follow graph.
+
+Profiles, the following/followers pages and their API twins all ask the
+same two questions of `follows`: who does this user follow, and who follows
+them. `index` answers both from memory, as two compressed sparse row (CSR)
+`Adjacency` structures -- one per direction, each an int32 array of user
+ids sorted within each user's row plus an int64 array of row offsets:
+
+- `index.followed_among(user, ids)`, which resolves the Follow/Unfollow
+  buttons on a page (see follow_state.py), searches `user`'s row for each
+  of `ids`; `index.is_following(a, b)` is a binary search of a's row:
+  O(log d).
+- `index.following_ids(user)` and `index.follower_ids(user)` are views into
+  the arrays, not copies; a page of them is a slice (see
+  `pagination.paginate_ids`) and one query for the users on it.
+
+A background thread started by the first request loads the whole table,
+then reloads it every FOLLOW_GRAPH_RELOAD_SECONDS; until the first load
+is done, `following_page` and friends query `follows` as before. In
+between loads, follows and unfollows committed in this process are applied
+as they happen: the two users' rows are replaced by patched copies. Writes
+made by other processes show up at the next reload -- or sooner, because
+the id lists are checked against the user's own `following_count` /
+`followers_count` (which counters.py keeps exact) and a row that disagrees
+is re-read on the spot.
+
+`index.stats()` reports edges, bytes and bytes per edge; so does
+`flask graph-stats`.
+"""
+
+import logging
+from threading import Event, Lock, Thread
+from time import perf_counter
+
+import numpy as np
+from sqlalchemy import event, select
+
+from models import db, Follows, User
+from pagination import paginate_by_id, paginate_ids
+from replicas import RoutingSession
+
+DEFAULT_RELOAD_SECONDS = 600
+LOAD_BATCH = 100000
+
+logger = logging.getLogger('warbler.graph')
+
+follows = Follows.__table__
+
+EMPTY = np.zeros(0, dtype=np.int32)
+
+
+class Adjacency:
+    """Sorted int32 neighbour ids per user id, in CSR form.
+
+    User `u`'s row is `ids[offsets[u]:offsets[u + 1]]`, unless it has been
+    patched since the arrays were built, in which case it's `patched[u]`.
+    """
+
+    def __init__(self, offsets, ids):
+        self.offsets = offsets
+        self.ids = ids
+        self.patched = {}
+
+    @classmethod
+    def from_edges(cls, sources, targets):
+        """Rows of `targets` for each of `sources`, from parallel id arrays."""
+
+        size = int(max(sources.max(), targets.max())) + 1 if len(sources) else 0
+
+        order = np.lexsort((targets, sources))
+        counts = np.bincount(sources, minlength=size)
+        offsets = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        return cls(offsets, targets[order])
+
+    @property
+    def size(self):
+        """One more than the highest user id with a row."""
+
+        return len(self.offsets) - 1
+
+    @property
+    def edges(self):
+        patched = sum(len(row) - len(self.built_row(user_id))
+                      for user_id, row in list(self.patched.items()))
+        return len(self.ids) + patched
+
+    @property
+    def nbytes(self):
+        return (self.offsets.nbytes + self.ids.nbytes
+                + sum(row.nbytes for row in list(self.patched.values())))
+
+    def built_row(self, user_id):
+        if user_id >= self.size:
+            return EMPTY
+        return self.ids[self.offsets[user_id]:self.offsets[user_id + 1]]
+
+    def row(self, user_id):
+        """`user_id`'s neighbours, as a sorted array view."""
+
+        row = self.patched.get(user_id)
+        if row is None:
+            return self.built_row(user_id)
+        return row
+
+    def contains(self, user_id, other_id):
+        row = self.row(user_id)
+        i = np.searchsorted(row, other_id)
+        return bool(i < len(row) and row[i] == other_id)
+
+    def add(self, user_id, other_id):
+        row = self.row(user_id)
+        i = np.searchsorted(row, other_id)
+        if not (i < len(row) and row[i] == other_id):
+            self.patched[user_id] = np.insert(row, i, other_id).astype(np.int32)
+
+    def remove(self, user_id, other_id):
+        row = self.row(user_id)
+        i = np.searchsorted(row, other_id)
+        if i < len(row) and row[i] == other_id:
+            self.patched[user_id] = np.delete(row, i)
+
+    def replace(self, user_id, other_ids):
+        self.patched[user_id] = np.array(sorted(other_ids), dtype=np.int32)
+
+
+def load_edges(batch_size=LOAD_BATCH):
+    """(followers, followed): the `follows` table as two int32 arrays."""
+
+    followers, followed = [EMPTY], [EMPTY]
+    with db.engine.connect() as connection:
+        result = (connection
+                  .execution_options(stream_results=True)
+                  .execute(select([follows.c.user_following_id,
+                                   follows.c.user_being_followed_id])))
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            pairs = np.array([tuple(row) for row in rows], dtype=np.int32)
+            followers.append(pairs[:, 0])
+            followed.append(pairs[:, 1])
+
+    return np.concatenate(followers), np.concatenate(followed)
+
+
+class FollowGraph:
+    """Who follows whom, both ways, kept current from this process's writes."""
+
+    def __init__(self):
+        self.following = None
+        self.followers = None
+        self.lock = Lock()
+        # changes committed while a load is running, replayed once it's done
+        self.replay = None
+        self.load_seconds = None
+        self.stopping = Event()
+
+    @property
+    def loaded(self):
+        return self.following is not None
+
+    def load(self):
+        """(Re)build both directions from the `follows` table."""
+
+        start = perf_counter()
+        with self.lock:
+            self.replay = []
+
+        followers, followed = load_edges()
+        following = Adjacency.from_edges(followers, followed)
+        followed_by = Adjacency.from_edges(followed, followers)
+
+        with self.lock:
+            replay, self.replay = self.replay, None
+            self.following, self.followers = following, followed_by
+            for change in replay:
+                self.apply(*change)
+
+        self.load_seconds = perf_counter() - start
+
+    def reset(self):
+        """Start over from an empty graph."""
+
+        with self.lock:
+            self.following = Adjacency.from_edges(EMPTY, EMPTY)
+            self.followers = Adjacency.from_edges(EMPTY, EMPTY)
+
+    def clear(self):
+        """Forget the graph; reads go to the database until the next load."""
+
+        with self.lock:
+            self.following = self.followers = None
+
+    def apply(self, follower_id, followed_id, following):
+        """Record that `follower_id` now does (or doesn't) follow `followed_id`."""
+
+        if self.replay is not None:
+            self.replay.append((follower_id, followed_id, following))
+        if not self.loaded:
+            return
+
+        if following:
+            self.following.add(follower_id, followed_id)
+            self.followers.add(followed_id, follower_id)
+        else:
+            self.following.remove(follower_id, followed_id)
+            self.followers.remove(followed_id, follower_id)
+
+    def is_following(self, follower_id, followed_id):
+        """Does `follower_id` follow `followed_id`?"""
+
+        if not self.loaded:
+            return Follows.exists(follower_id, followed_id)
+        return self.following.contains(follower_id, followed_id)
+
+    def followed_among(self, user, user_ids):
+        """Which of `user_ids` does `user` follow? Returns a set."""
+
+        if not self.loaded:
+            return Follows.followed_among(user.id, user_ids)
+
+        ids = np.fromiter(user_ids, dtype=np.int64)
+        row = self.following_ids(user)
+        return set(ids[np.isin(ids, row, assume_unique=True)].tolist())
+
+    def following_ids(self, user):
+        """Sorted ids of the users `user` follows."""
+
+        return self.checked_row(self.following, user.id, user.following_count,
+                                follows.c.user_following_id,
+                                follows.c.user_being_followed_id)
+
+    def follower_ids(self, user):
+        """Sorted ids of the users following `user`."""
+
+        return self.checked_row(self.followers, user.id, user.followers_count,
+                                follows.c.user_being_followed_id,
+                                follows.c.user_following_id)
+
+    def checked_row(self, adjacency, user_id, count, key_col, other_col):
+        """`user_id`'s row, re-read from the database if it's not `count` long."""
+
+        row = adjacency.row(user_id)
+        if len(row) == count:
+            return row
+
+        ids = [other_id for (other_id,) in
+               db.session.execute(select([other_col]).where(key_col == user_id))]
+        with self.lock:
+            adjacency.replace(user_id, ids)
+        return adjacency.row(user_id)
+
+    def stats(self):
+        """Edge count and memory use, for monitoring."""
+
+        if not self.loaded:
+            return dict(loaded=False)
+
+        edges = self.following.edges
+        nbytes = self.following.nbytes + self.followers.nbytes
+        return dict(loaded=True,
+                    edges=edges,
+                    bytes=nbytes,
+                    bytes_per_edge=nbytes / edges if edges else None,
+                    load_seconds=self.load_seconds)
+
+    def reload_every(self, app, seconds):
+        """Load, then reload every `seconds` until `stop()`, in a daemon thread.
+
+        With `seconds` 0, just load once.
+        """
+
+        def run():
+            while True:
+                try:
+                    with app.app_context():
+                        self.load()
+                except Exception:
+                    logger.exception("loading the follow graph failed")
+                if not seconds or self.stopping.wait(seconds):
+                    return
+
+        Thread(target=run, name='follow-graph-reload', daemon=True).start()
+
+    def stop(self):
+        self.stopping.set()
+
+
+index = FollowGraph()
+
+
+def following_page(user, query, after, limit):
+    """A `Page` of `query`'s users that `user` follows, by id, after `after`."""
+
+    if not index.loaded:
+        return paginate_by_id(query.with_parent(user, 'following'), User.id, after, limit)
+    return paginate_ids(query, User.id, index.following_ids(user), after, limit)
+
+
+def followers_page(user, query, after, limit):
+    """A `Page` of `query`'s users that follow `user`, by id, after `after`."""
+
+    if not index.loaded:
+        return paginate_by_id(query.with_parent(user, 'followers'), User.id, after, limit)
+    return paginate_ids(query, User.id, index.follower_ids(user), after, limit)
+
+
+def record(follower_id, followed_ids, following):
+    """Apply follows (or unfollows) to the index once the transaction commits."""
+
+    changes = db.session.info.setdefault('follow_graph', [])
+    changes.extend((follower_id, followed_id, following) for followed_id in followed_ids)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _apply_after_commit(db_session):
+    changes = db_session.info.pop('follow_graph', ())
+    if changes:
+        with index.lock:
+            for change in changes:
+                index.apply(*change)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_after_rollback(db_session):
+    db_session.info.pop('follow_graph', None)
+
+
+@event.listens_for(Follows, 'after_insert')
+def _follow_added(mapper, connection, target):
+    record(target.user_following_id, [target.user_being_followed_id], True)
+
+
+@event.listens_for(Follows, 'after_delete')
+def _follow_removed(mapper, connection, target):
+    record(target.user_following_id, [target.user_being_followed_id], False)
+
+
+@event.listens_for(follows, 'after_create')
+def _follows_created(target, connection, **kw):
+    # a new table is an empty graph; no need to read it
+    index.reset()
+
+
+def init_app(app):
+    """Load the index from the first request on, and reload it periodically."""
+
+    app.config.setdefault('FOLLOW_GRAPH_RELOAD_SECONDS', DEFAULT_RELOAD_SECONDS)
+
+    @app.before_first_request
+    def load_follow_graph():
+        index.reload_every(app, app.config['FOLLOW_GRAPH_RELOAD_SECONDS'])
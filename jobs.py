@@ -0,0 +1,267 @@
+"""Durable background jobs, queued in the `jobs` table.
+
+Handlers hand slow side effects to a worker instead of doing them inline:
+
+    jobs.enqueue('delete_account', key=f"delete-account:{user.id}", user_id=user.id)
+    db.session.commit()
+
+The job row is written in the caller's transaction, so it exists exactly
+when the caller's other writes do. A `key` makes enqueueing idempotent:
+while a job with that key exists, enqueueing it again returns the same job,
+even when two requests race to enqueue it.
+
+Tasks are plain functions registered with `@task`, called with the job's
+payload as keyword arguments. A worker (`flask run-jobs`, a separate
+process with a configurable number of threads) claims due jobs, runs each
+task, then marks the job done in the transaction the task left open -- so
+a task that doesn't commit has its writes and its completion commit
+together. Tasks may commit on their own too (a long purge commits per
+batch); what they committed stays committed if they fail later. A task
+that raises has its open transaction rolled back and is retried with
+exponential backoff, up to its `max_attempts`, then left `failed` with its
+last error. Jobs left `running` by a worker that died are put back after
+`stale_after` seconds. Either way a task can run again over work it has
+partly or wholly done, so every task must be idempotent.
+
+Claiming is an UPDATE guarded by `status = 'pending'`, so it works on SQLite
+as well as Postgres, where FOR UPDATE SKIP LOCKED also keeps concurrent
+workers from contending for the same rows.
+"""
+
+import json
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from random import random
+from threading import Event, Thread
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+
+from models import db, Job
+
+DEFAULT_MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2
+BACKOFF_MAX = 3600
+DEFAULT_STALE_AFTER = 600
+
+# how many due jobs a worker looks at per claim
+CLAIM_BATCH = 10
+
+logger = logging.getLogger('warbler.jobs')
+
+jobs = Job.__table__
+
+TASKS = {}
+
+
+def task(fn):
+    """Register `fn` as a task, under its function name."""
+
+    TASKS[fn.__name__] = fn
+    return fn
+
+
+def enqueue(name, key=None, delay=0, max_attempts=DEFAULT_MAX_ATTEMPTS,
+            connection=None, **payload):
+    """Queue `name(**payload)` to run `delay` seconds from now.
+
+    Returns the job id; if a job with `key` already exists, that job's id.
+    Pass `connection` to enqueue from inside a flush (e.g. a mapper event).
+    The caller commits.
+    """
+
+    connection = connection or db.session.connection()
+    values = dict(name=name,
+                  payload=json.dumps(payload),
+                  key=key,
+                  max_attempts=max_attempts,
+                  run_at=datetime.utcnow() + timedelta(seconds=delay))
+
+    if key is None:
+        return connection.execute(jobs.insert().values(**values)).inserted_primary_key[0]
+
+    existing = select([jobs.c.id]).where(jobs.c.key == key)
+    job_id = connection.execute(existing).scalar()
+    if job_id is not None:
+        return job_id
+
+    # a concurrent enqueue may insert the same key between the check and
+    # here; let the database skip the duplicate rather than raise
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        insert = postgresql_insert(jobs).values(**values).on_conflict_do_nothing(
+            index_elements=[jobs.c.key])
+    elif dialect == 'sqlite':
+        insert = jobs.insert().values(**values).prefix_with('OR IGNORE')
+    else:
+        insert = jobs.insert().values(**values)
+
+    result = connection.execute(insert)
+    if not result.rowcount:
+        return connection.execute(existing).scalar()
+    return result.inserted_primary_key[0]
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying after `attempts` tries, with jitter."""
+
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * (0.5 + random() / 2)
+
+
+def claim(worker_id):
+    """Claim one due job for `worker_id` and commit; returns it, or None."""
+
+    now = datetime.utcnow()
+    candidates = [job_id for (job_id,) in
+                  db.session.query(Job.id)
+                  .filter(Job.status == 'pending', Job.run_at <= now)
+                  .order_by(Job.run_at, Job.id)
+                  .limit(CLAIM_BATCH)
+                  .with_for_update(skip_locked=True)]
+
+    for job_id in candidates:
+        claimed = db.session.execute(
+            jobs.update()
+            .where(and_(jobs.c.id == job_id, jobs.c.status == 'pending'))
+            .values(status='running',
+                    attempts=jobs.c.attempts + 1,
+                    locked_by=worker_id,
+                    locked_at=now)).rowcount
+        if claimed:
+            db.session.commit()
+            return Job.query.get(job_id)
+
+    db.session.commit()
+    return None
+
+
+def execute(job):
+    """Run a claimed `job` and record the outcome. Returns True on success."""
+
+    job_id, name, payload = job.id, job.name, job.payload
+    attempts, max_attempts = job.attempts, job.max_attempts
+
+    try:
+        fn = TASKS.get(name)
+        if fn is None:
+            raise LookupError(f"no task named {name!r}")
+        fn(**json.loads(payload))
+
+        db.session.execute(
+            jobs.update()
+            .where(jobs.c.id == job_id)
+            .values(status='done', finished_at=datetime.utcnow(),
+                    locked_by=None, locked_at=None, last_error=None))
+        db.session.commit()
+        return True
+
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("job %s (%s) failed, attempt %s of %s",
+                         job_id, name, attempts, max_attempts)
+
+        if attempts >= max_attempts:
+            outcome = dict(status='failed', finished_at=datetime.utcnow())
+        else:
+            outcome = dict(status='pending',
+                           run_at=datetime.utcnow() + timedelta(seconds=backoff(attempts)))
+
+        db.session.execute(
+            jobs.update()
+            .where(jobs.c.id == job_id)
+            .values(locked_by=None, locked_at=None,
+                    last_error=f"{type(e).__name__}: {e}"[:2000],
+                    **outcome))
+        db.session.commit()
+        return False
+
+
+def requeue_stale(stale_after=DEFAULT_STALE_AFTER):
+    """Put jobs `running` for over `stale_after` seconds back in the queue.
+
+    Returns how many were requeued.
+    """
+
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_after)
+    requeued = db.session.execute(
+        jobs.update()
+        .where(and_(jobs.c.status == 'running', jobs.c.locked_at < cutoff))
+        .values(status='pending', locked_by=None, locked_at=None)).rowcount
+    db.session.commit()
+    return requeued
+
+
+def work_off(worker_id='inline', limit=None):
+    """Run due jobs in this thread until there are none (or `limit` ran).
+
+    Returns the number of jobs run.
+    """
+
+    ran = 0
+    while limit is None or ran < limit:
+        job = claim(worker_id)
+        if job is None:
+            break
+        execute(job)
+        ran += 1
+    return ran
+
+
+def stats():
+    """Job counts by status."""
+
+    return dict(db.session.query(Job.status, func.count()).group_by(Job.status))
+
+
+class Worker:
+    """`concurrency` threads claiming and running jobs until stopped."""
+
+    def __init__(self, app, concurrency=4, poll_interval=1.0,
+                 stale_after=DEFAULT_STALE_AFTER):
+        self.app = app
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = Event()
+
+    def run(self, burst=False):
+        """Work until `stop()`; with `burst`, until no job is due."""
+
+        with self.app.app_context():
+            requeue_stale(self.stale_after)
+
+        threads = [Thread(target=self.work, args=(f"{self.name}:{i}", burst),
+                          name=f"jobs-{i}")
+                   for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    def work(self, worker_id, burst):
+        while not self.stopping.is_set():
+            with self.app.app_context():
+                job = claim(worker_id)
+                if job is not None:
+                    execute(job)
+                    continue
+                if self.stale_after:
+                    requeue_stale(self.stale_after)
+
+            if burst:
+                return
+            self.stopping.wait(self.poll_interval)
+
+    def stop(self):
+        """Finish the jobs in hand, then stop."""
+
+        self.stopping.set()
@@ -0,0 +1,65 @@
+"""Constant-time like toggling.
+
+A like is one `likes` row keyed on (user_id, message_id). Toggling is a
+single DELETE by primary key, followed by an INSERT only if nothing was
+deleted -- it never loads the user's other likes.
+"""
+
+from sqlalchemy import and_
+
+from models import db, Likes
+import counters
+import trending
+
+likes = Likes.__table__
+
+
+def insert_like(connection, user_id, message_id):
+    connection.execute(likes.insert().values(user_id=user_id, message_id=message_id))
+    counters.like_added(connection, user_id, message_id)
+    trending.record(message_id, 1)
+
+
+def remove_like(user_id, message_id):
+    """Unlike `message_id` for `user_id`.
+
+    Returns True if it had been liked. The caller commits.
+    """
+
+    connection = db.session.connection()
+
+    removed = connection.execute(likes.delete().where(and_(
+        likes.c.user_id == user_id,
+        likes.c.message_id == message_id))).rowcount
+
+    if removed:
+        counters.like_removed(connection, user_id, message_id)
+        trending.record(message_id, -1)
+    return bool(removed)
+
+
+def add_like(user_id, message_id):
+    """Like `message_id` for `user_id`, if it isn't liked already.
+
+    Returns True if a like was added. The caller commits; a concurrent like
+    of the same message surfaces as an IntegrityError.
+    """
+
+    if Likes.exists(user_id, message_id):
+        return False
+
+    insert_like(db.session.connection(), user_id, message_id)
+    return True
+
+
+def toggle_like(user_id, message_id):
+    """Like `message_id` for `user_id`, or unlike it if already liked.
+
+    Returns True if the message is now liked. The caller commits.
+    """
+
+    if remove_like(user_id, message_id):
+        return False
+
+    insert_like(db.session.connection(), user_id, message_id)
+    return True
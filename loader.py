@@ -0,0 +1,153 @@
+"""Streaming bulk loader for the seed CSVs.
+
+`seed.py` used to read each CSV whole into `bulk_insert_mappings` and commit
+once at the end, so memory grew with the file. `load_csvs` instead streams
+each file in fixed-size chunks and commits per chunk:
+
+- Postgres: each chunk is sent with `COPY ... FROM STDIN`.
+- anything else: each chunk is one executemany INSERT.
+
+Secondary indexes on the loaded tables (and the user search index) are
+dropped first and rebuilt once at the end. `users` is loaded on its own,
+then `messages` and `follows` -- which only depend on users -- in parallel
+on Postgres. SQLite allows one writer at a time, so there it stays serial.
+
+Bulk loads bypass the ORM hooks; callers should rebuild timelines and
+counters afterwards (as `seed.py` and `flask load-csvs` do).
+"""
+
+import csv
+import io
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from time import perf_counter
+
+from sqlalchemy import text
+
+from models import db, User, Message, Follows
+import search
+
+DEFAULT_CHUNK_SIZE = 50000
+
+# Loaded in stages; tables within a stage don't reference each other.
+STAGES = [
+    [(User.__table__, 'users.csv')],
+    [(Message.__table__, 'messages.csv'), (Follows.__table__, 'follows.csv')],
+]
+
+LoadResult = namedtuple('LoadResult', ['table', 'rows', 'seconds'])
+
+
+def read_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield (columns, rows) for `path` in chunks of at most `chunk_size` rows.
+
+    `columns` comes from the CSV header; rows are lists of strings.
+    """
+
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        columns = next(reader)
+        while True:
+            rows = list(islice(reader, chunk_size))
+            if not rows:
+                return
+            yield columns, rows
+
+
+def copy_rows(connection, table, columns, rows):
+    """Send `rows` to `table` with Postgres COPY."""
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    column_list = ', '.join(columns)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table.name} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+
+def insert_rows(connection, table, columns, rows):
+    """Insert `rows` into `table` as one executemany.
+
+    Empty fields become NULL, as they do with COPY.
+    """
+
+    statement = text(f"INSERT INTO {table.name} ({', '.join(columns)}) "
+                     f"VALUES ({', '.join(':' + column for column in columns)})")
+    connection.execute(statement, [
+        {column: value or None for column, value in zip(columns, row)}
+        for row in rows])
+
+
+def load_table(engine, table, path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Stream the CSV at `path` into `table`, one transaction per chunk."""
+
+    write = copy_rows if engine.dialect.name == 'postgresql' else insert_rows
+    loaded = 0
+    start = perf_counter()
+
+    with engine.connect() as connection:
+        for columns, rows in read_chunks(path, chunk_size):
+            unknown = set(columns) - set(table.columns.keys())
+            if unknown:
+                raise ValueError(f"{path}: no such columns in {table.name}: "
+                                 f"{', '.join(sorted(unknown))}")
+
+            with connection.begin():
+                write(connection, table, columns, rows)
+            loaded += len(rows)
+
+    return LoadResult(table.name, loaded, perf_counter() - start)
+
+
+def load_csvs(directory='generator', chunk_size=DEFAULT_CHUNK_SIZE, workers=None):
+    """Load users, messages and follows from the CSVs in `directory`.
+
+    Returns a list of `LoadResult`s. `workers` caps how many tables load at
+    once (default: as many as a stage has on Postgres, 1 elsewhere).
+    """
+
+    engine = db.engine
+    if workers is None:
+        workers = 2 if engine.dialect.name == 'postgresql' else 1
+
+    tables = [table for stage in STAGES for table, _ in stage]
+    indexes = [index for table in tables for index in table.indexes]
+
+    search.drop_search_index()
+    for index in indexes:
+        engine.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for stage in STAGES:
+            futures = [pool.submit(load_table, engine, table,
+                                   os.path.join(directory, filename), chunk_size)
+                       for table, filename in stage]
+            results.extend(future.result() for future in futures)
+
+    for index in indexes:
+        index.create(bind=engine)
+    search.create_search_index()
+
+    if engine.dialect.name == 'postgresql':
+        reset_sequences(engine, tables)
+        engine.execute(text("ANALYZE"))
+
+    return results
+
+
+def reset_sequences(engine, tables):
+    """Move serial id sequences past any ids the CSVs supplied themselves."""
+
+    for table in tables:
+        if 'id' in table.columns:
+            engine.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"coalesce(max(id), 0) + 1, false) FROM {table.name}"))
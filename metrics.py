@@ -0,0 +1,321 @@
+"""Prometheus metrics for Warbler, served at `/metrics`.
+
+A small in-process registry -- no client library needed -- of:
+
+- counters and histograms updated as things happen (request latency by
+  endpoint, responses by status, SQL per request, bcrypt time).
+- callbacks sampled when metrics are collected, for numbers other modules
+  already keep (pool checkouts, cache hit counts, hasher load).
+
+Under a multi-process server every worker has its own registry, and a
+scrape only reaches one of them. Set METRICS_DIR (a directory shared by the
+workers, emptied whenever the server starts) and each worker writes its
+values there as `<pid>.json`, at most every METRICS_SYNC_SECONDS; `/metrics`
+then adds up all the files. Counters and histograms of workers that have
+exited still count, while gauges only count live workers.
+"""
+
+import json
+import os
+from glob import glob
+from threading import Lock
+from time import monotonic, perf_counter
+
+from flask import g, request, Response
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+DEFAULT_SYNC_SECONDS = 1
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape_label(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Metric:
+    """A named metric; values are kept per tuple of label values."""
+
+    kind = None
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def describe(self):
+        return dict(kind=self.kind, help=self.help, labelnames=self.labelnames)
+
+    def sample(self):
+        """{label values: value}, copied."""
+
+        with self.registry.lock:
+            return dict(self.values)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    """Observations counted into `buckets`; values are
+    [count per bucket..., count above the last bucket, sum]."""
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound),
+                     len(self.buckets))
+        with self.registry.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def describe(self):
+        return dict(super().describe(), buckets=self.buckets)
+
+    def sample(self):
+        with self.registry.lock:
+            return {key: list(counts) for key, counts in self.values.items()}
+
+
+class Callback(Metric):
+    """A counter or gauge read from `fn()` -> {label values: value} on collection."""
+
+    def __init__(self, registry, name, help, kind, labelnames, fn):
+        super().__init__(registry, name, help, labelnames)
+        self.kind = kind
+        self.fn = fn
+
+    def sample(self):
+        return {tuple(str(v) for v in key): value for key, value in self.fn().items()}
+
+
+class Registry:
+    """The metrics of this process, and their collection across processes."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = Lock()
+        self.sync_lock = Lock()
+        self.last_sync = None
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.add(Counter(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.add(Histogram(self, name, help, labelnames, buckets))
+
+    def callback(self, name, help, kind, labelnames, fn):
+        """Register `fn` as a 'counter' or 'gauge' sampled on collection."""
+
+        return self.add(Callback(self, name, help, kind, labelnames, fn))
+
+    def snapshot(self):
+        """This process's metrics: {name: description with `values`}.
+
+        Label tuples are JSON-encoded so snapshots can be written to disk.
+        """
+
+        return {name: dict(metric.describe(),
+                           values={json.dumps(key): value
+                                   for key, value in metric.sample().items()})
+                for name, metric in list(self.metrics.items())}
+
+    def sync(self, directory):
+        """Write this process's snapshot to `directory`/<pid>.json."""
+
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        temp = f"{path}.tmp"
+        with self.sync_lock:
+            with open(temp, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(temp, path)
+            self.last_sync = monotonic()
+
+    def sync_every(self, directory, seconds):
+        """`sync`, unless it last ran less than `seconds` ago."""
+
+        if self.last_sync is None or monotonic() - self.last_sync >= seconds:
+            self.sync(directory)
+
+    def collect(self, directory=None):
+        """Snapshot of this process, or the sum of every process in `directory`."""
+
+        if directory is None:
+            return self.snapshot()
+
+        self.sync(directory)
+        merged = {}
+        for path in glob(os.path.join(directory, '*.json')):
+            pid = int(os.path.basename(path).split('.')[0])
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                # a worker mid-write; its next sync will be picked up
+                continue
+            merge(merged, snapshot, alive=process_alive(pid))
+        return merged
+
+    def exposition(self, directory=None):
+        """The collected metrics in Prometheus text exposition format."""
+
+        lines = []
+        for name, metric in sorted(self.collect(directory).items()):
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['kind']}")
+            labelnames = list(metric['labelnames'])
+
+            for encoded, value in sorted(metric['values'].items()):
+                key = json.loads(encoded)
+                if metric['kind'] != 'histogram':
+                    lines.append(f"{name}{format_labels(labelnames, key)} {format_value(value)}")
+                    continue
+
+                cumulative = 0
+                bounds = list(metric['buckets']) + [float('inf')]
+                for bound, count in zip(bounds, value):
+                    cumulative += count
+                    labels = format_labels(labelnames + ['le'], key + [format_value(bound)])
+                    lines.append(f"{name}_bucket{labels} {cumulative}")
+                labels = format_labels(labelnames, key)
+                lines.append(f"{name}_sum{labels} {format_value(value[-1])}")
+                lines.append(f"{name}_count{labels} {cumulative}")
+
+        return '\n'.join(lines) + '\n'
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def merge(merged, snapshot, alive=True):
+    """Add `snapshot` into `merged`; gauges only count if the process is `alive`."""
+
+    for name, metric in snapshot.items():
+        target = merged.setdefault(name, dict(metric, values={}))
+        if metric['kind'] == 'gauge' and not alive:
+            continue
+
+        for key, value in metric['values'].items():
+            current = target['values'].get(key)
+            if current is None:
+                target['values'][key] = value
+            elif isinstance(value, list):
+                target['values'][key] = [a + b for a, b in zip(current, value)]
+            else:
+                target['values'][key] = current + value
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    'warbler_http_request_duration_seconds',
+    "Time to handle a request, by endpoint.",
+    ['endpoint', 'method'])
+
+RESPONSES = registry.counter(
+    'warbler_http_responses_total',
+    "Responses sent, by endpoint and status code.",
+    ['endpoint', 'status'])
+
+SQL_QUERIES = registry.counter(
+    'warbler_sql_queries_total',
+    "SQL statements run while handling requests, by endpoint.",
+    ['endpoint'])
+
+SQL_SECONDS = registry.histogram(
+    'warbler_sql_request_duration_seconds',
+    "Time a request spent running SQL, by endpoint.",
+    ['endpoint'])
+
+BCRYPT_SECONDS = registry.histogram(
+    'warbler_bcrypt_duration_seconds',
+    "Time to hash or check a password, including any wait for the pool.",
+    ['op'],
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10))
+
+
+##############################################################################
+# Flask integration
+
+
+def init_app(app):
+    """Time every request and serve `/metrics`."""
+
+    app.config.setdefault('METRICS_DIR', None)
+    app.config.setdefault('METRICS_SYNC_SECONDS', DEFAULT_SYNC_SECONDS)
+
+    @app.before_request
+    def start_metrics_timer():
+        g.metrics_started = perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_SECONDS.observe(perf_counter() - started,
+                                endpoint=endpoint, method=request.method)
+        RESPONSES.inc(endpoint=endpoint, status=response.status_code)
+
+        sql = g.get('sql')
+        if sql is not None:
+            SQL_QUERIES.inc(sql.count, endpoint=endpoint)
+            SQL_SECONDS.observe(sql.seconds, endpoint=endpoint)
+
+        directory = app.config['METRICS_DIR']
+        if directory:
+            registry.sync_every(directory, app.config['METRICS_SYNC_SECONDS'])
+
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(registry.exposition(app.config['METRICS_DIR']),
+                        content_type=CONTENT_TYPE)
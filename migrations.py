@@ -0,0 +1,380 @@
+"""Versioned schema migrations.
+
+`db.create_all()` creates missing tables but never changes existing ones,
+so a database created before a model gained a column or an index never
+gets it. Migrations fill that gap: each is a function registered with
+`@migration` under a version, applied once and in order by `flask
+migrate`, which records it in `schema_migrations`.
+
+The first migration creates the schema as it was before migrations
+existed, from table definitions frozen below rather than read from
+models.py (which only describes the latest schema); every later one
+makes a single change to it. So an empty database and one from any
+earlier release both end up with the schema models.py describes.
+
+A fresh database can still be made with `db.create_all()` (as the tests
+do): each migration skips what already exists -- tables, columns, indexes,
+the likes key -- so running them over it changes nothing.
+
+Columns are added with ALTER TABLE ADD COLUMN and a server default, which
+fills in the existing rows. Counters are recounted as they're added; the
+other derived data -- home timelines, trending scores, suggestions -- is
+rebuilt by its own command (`flask rebuild-timelines` and so on).
+
+New indexes on tables that already hold data are built with
+`build_index`. On Postgres that's CREATE INDEX CONCURRENTLY, which doesn't
+block writes while it reads the table, but can't run in a transaction --
+so such migrations are registered `transactional=False` and must be safe
+to run again. A concurrent build that fails leaves an INVALID index
+behind; the next run drops and rebuilds it.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import (Column, DateTime, Float, ForeignKey, Index, Integer, MetaData,
+                        String, Table, Text, inspect, select, text)
+
+from models import db, SchemaMigration
+
+schema_migrations = SchemaMigration.__table__
+
+MIGRATIONS = []
+
+
+def migration(version, transactional=True):
+    """Register the decorated function as migration `version`.
+
+    It's called with a connection: inside a transaction, or, if not
+    `transactional`, in autocommit mode.
+    """
+
+    def register(fn):
+        MIGRATIONS.append((version, fn, transactional))
+        return fn
+    return register
+
+
+def column_names(connection, table):
+    return {column['name'] for column in inspect(connection).get_columns(table)}
+
+
+def add_column(connection, table, name, type_, constraints=''):
+    """ALTER TABLE `table` ADD COLUMN `name`, unless it's there already."""
+
+    if name in column_names(connection, table):
+        return
+    connection.execute(text(
+        f"ALTER TABLE {table} ADD COLUMN {name} "
+        f"{type_.compile(dialect=connection.dialect)} {constraints}"))
+
+
+def build_index(connection, name, table, columns, using=None, where=None):
+    """Create index `name` on `table` (`columns`, as SQL) if it doesn't exist,
+    without blocking writes on Postgres. `using` is a Postgres index method;
+    `where`, SQL, makes it a partial index.
+    """
+
+    predicate = f" WHERE {where}" if where else ""
+
+    if connection.dialect.name != 'postgresql':
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns}){predicate}"))
+        return
+
+    invalid = connection.execute(text(
+        "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+        "WHERE pg_class.relname = :name AND NOT pg_index.indisvalid"), name=name).scalar()
+    if invalid:
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+    method = f"USING {using} " if using else ""
+    connection.execute(text(
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+        f"ON {table} {method}({columns}){predicate}"))
+
+
+##############################################################################
+# Tables as they were created; later changes are the migrations' own
+
+frozen = MetaData()
+
+users = Table(
+    'users', frozen,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('email', Text, nullable=False, unique=True),
+    Column('username', Text, nullable=False, unique=True),
+    Column('image_url', Text),
+    Column('header_image_url', Text),
+    Column('bio', Text),
+    Column('location', Text),
+    Column('password', Text, nullable=False),
+)
+
+messages = Table(
+    'messages', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('text', String(140), nullable=False),
+    Column('timestamp', DateTime, nullable=False),
+    Column('user_id', Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+)
+
+follows = Table(
+    'follows', frozen,
+    Column('user_being_followed_id', Integer,
+           ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+    Column('user_following_id', Integer,
+           ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+)
+
+likes = Table(
+    'likes', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('users.id', ondelete='cascade')),
+    Column('message_id', Integer, ForeignKey('messages.id', ondelete='cascade'), unique=True),
+)
+
+timelines = Table(
+    'timelines', frozen,
+    Column('user_id', Integer, ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+    Column('message_id', Integer,
+           ForeignKey('messages.id', ondelete='cascade'), primary_key=True),
+    Column('timestamp', DateTime, nullable=False),
+    Index('ix_timelines_user_id_timestamp', 'user_id', 'timestamp', 'message_id'),
+)
+
+jobs = Table(
+    'jobs', frozen,
+    Column('id', Integer, primary_key=True),
+    Column('name', Text, nullable=False),
+    Column('payload', Text, nullable=False),
+    Column('key', Text, unique=True),
+    Column('status', Text, nullable=False),
+    Column('attempts', Integer, nullable=False),
+    Column('max_attempts', Integer, nullable=False),
+    Column('run_at', DateTime, nullable=False),
+    Column('locked_by', Text),
+    Column('locked_at', DateTime),
+    Column('last_error', Text),
+    Column('created_at', DateTime, nullable=False),
+    Column('finished_at', DateTime),
+    Index('ix_jobs_status_run_at', 'status', 'run_at'),
+)
+
+suggestions = Table(
+    'suggestions', frozen,
+    Column('user_id', Integer, ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+    Column('suggested_id', Integer,
+           ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+    Column('score', Integer, nullable=False),
+)
+
+
+##############################################################################
+# Migrations, oldest first
+
+@migration('0001_baseline')
+def baseline(connection):
+    frozen.create_all(bind=connection, tables=[users, messages, follows, likes])
+
+
+@migration('0002_timelines')
+def create_timelines(connection):
+    timelines.create(bind=connection, checkfirst=True)
+
+
+@migration('0003_user_counters_and_updated_at')
+def user_counters_and_updated_at(connection):
+    for name in ['messages_count', 'following_count', 'followers_count', 'likes_count']:
+        add_column(connection, 'users', name, Integer(), "NOT NULL DEFAULT 0")
+
+    connection.execute(text(
+        "UPDATE users SET "
+        "messages_count = (SELECT count(*) FROM messages WHERE messages.user_id = users.id), "
+        "following_count = (SELECT count(*) FROM follows "
+        "                   WHERE follows.user_following_id = users.id), "
+        "followers_count = (SELECT count(*) FROM follows "
+        "                   WHERE follows.user_being_followed_id = users.id), "
+        "likes_count = (SELECT count(*) FROM likes WHERE likes.user_id = users.id)"))
+
+    if connection.dialect.name == 'sqlite':
+        # SQLite only adds columns with a constant default
+        add_column(connection, 'users', 'updated_at', DateTime(),
+                   "NOT NULL DEFAULT '1970-01-01 00:00:00'")
+        connection.execute(text(
+            "UPDATE users SET updated_at = CURRENT_TIMESTAMP "
+            "WHERE updated_at = '1970-01-01 00:00:00'"))
+    else:
+        add_column(connection, 'users', 'updated_at', DateTime(), "NOT NULL DEFAULT now()")
+
+
+@migration('0004_search_index', transactional=False)
+def search_index(connection):
+    dialect = connection.dialect.name
+
+    if dialect == 'postgresql':
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        for column in ['username', 'bio', 'location']:
+            build_index(connection, f"ix_users_{column}_trgm", 'users',
+                        f"{column} gin_trgm_ops", using='gin')
+        build_index(connection, 'ix_users_username_c', 'users', 'username COLLATE "C"')
+
+    elif dialect == 'sqlite':
+        exists = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'users_search'")).scalar()
+        for statement in [
+            """CREATE VIRTUAL TABLE IF NOT EXISTS users_search USING fts5(
+                username, bio, location,
+                content='users', content_rowid='id', tokenize='trigram')""",
+            """CREATE TRIGGER IF NOT EXISTS users_search_insert AFTER INSERT ON users BEGIN
+                INSERT INTO users_search(rowid, username, bio, location)
+                VALUES (new.id, new.username, new.bio, new.location);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS users_search_delete AFTER DELETE ON users BEGIN
+                INSERT INTO users_search(users_search, rowid, username, bio, location)
+                VALUES ('delete', old.id, old.username, old.bio, old.location);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS users_search_update
+            AFTER UPDATE OF username, bio, location ON users BEGIN
+                INSERT INTO users_search(users_search, rowid, username, bio, location)
+                VALUES ('delete', old.id, old.username, old.bio, old.location);
+                INSERT INTO users_search(rowid, username, bio, location)
+                VALUES (new.id, new.username, new.bio, new.location);
+            END""",
+        ]:
+            connection.execute(text(statement))
+        if not exists:
+            connection.execute(text("INSERT INTO users_search(users_search) VALUES ('rebuild')"))
+
+
+@migration('0005_likes_keyed_by_user_and_message')
+def likes_keyed_by_user_and_message(connection):
+    # the surrogate id and UNIQUE (message_id), which let only one user like
+    # each message, give way to the key (user_id, message_id)
+    if 'id' not in column_names(connection, 'likes'):
+        return
+
+    if connection.dialect.name == 'postgresql':
+        for constraint in inspect(connection).get_unique_constraints('likes'):
+            if constraint['column_names'] == ['message_id']:
+                connection.execute(text(f"ALTER TABLE likes DROP CONSTRAINT {constraint['name']}"))
+        connection.execute(text("DELETE FROM likes WHERE user_id IS NULL OR message_id IS NULL"))
+        # takes the old primary key and its sequence with it
+        connection.execute(text("ALTER TABLE likes DROP COLUMN id"))
+        connection.execute(text("ALTER TABLE likes ADD PRIMARY KEY (user_id, message_id)"))
+        return
+
+    # SQLite can't change a table's key in place: copy it into a new table,
+    # skipping rows whose user or message is gone (foreign keys weren't
+    # enforced there)
+    connection.execute(text(
+        "CREATE TABLE likes_new ("
+        "user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE cascade, "
+        "message_id INTEGER NOT NULL REFERENCES messages (id) ON DELETE cascade, "
+        "PRIMARY KEY (user_id, message_id))"))
+    connection.execute(text(
+        "INSERT INTO likes_new (user_id, message_id) "
+        "SELECT user_id, message_id FROM likes "
+        "WHERE user_id IN (SELECT id FROM users) AND message_id IN (SELECT id FROM messages)"))
+    connection.execute(text("DROP TABLE likes"))
+    connection.execute(text("ALTER TABLE likes_new RENAME TO likes"))
+
+
+@migration('0006_message_counters_version_and_trend', transactional=False)
+def message_counters_version_and_trend(connection):
+    add_column(connection, 'messages', 'likes_count', Integer(), "NOT NULL DEFAULT 0")
+    connection.execute(text(
+        "UPDATE messages SET "
+        "likes_count = (SELECT count(*) FROM likes WHERE likes.message_id = messages.id)"))
+
+    add_column(connection, 'messages', 'version', Integer(), "NOT NULL DEFAULT 1")
+    add_column(connection, 'messages', 'trend', Float())
+    build_index(connection, 'ix_messages_trend', 'messages', 'trend')
+
+
+@migration('0007_jobs')
+def create_jobs(connection):
+    jobs.create(bind=connection, checkfirst=True)
+
+
+@migration('0008_suggestions')
+def create_suggestions(connection):
+    suggestions.create(bind=connection, checkfirst=True)
+
+
+@migration('0009_timeline_and_graph_indexes', transactional=False)
+def timeline_and_graph_indexes(connection):
+    for name, table, columns in [
+            ('ix_messages_user_id_timestamp', 'messages', 'user_id, timestamp, id'),
+            ('ix_messages_timestamp', 'messages', 'timestamp, id'),
+            ('ix_follows_user_following_id', 'follows',
+             'user_following_id, user_being_followed_id'),
+            ('ix_likes_message_id', 'likes', 'message_id'),
+            ('ix_timelines_message_id', 'timelines', 'message_id')]:
+        build_index(connection, name, table, columns)
+
+
+@migration('0010_users_deleted_at')
+def users_deleted_at(connection):
+    add_column(connection, 'users', 'deleted_at', DateTime())
+
+
+@migration('0011_users_deleted_at_index', transactional=False)
+def users_deleted_at_index(connection):
+    build_index(connection, 'ix_users_deleted_at', 'users', 'deleted_at',
+                where='deleted_at IS NOT NULL')
+
+
+##############################################################################
+# Applying them
+
+def applied_versions(connection):
+    """Versions already applied, as a set."""
+
+    schema_migrations.create(bind=connection, checkfirst=True)
+    return {version for (version,) in connection.execute(select([schema_migrations.c.version]))}
+
+
+def pending():
+    """(version, fn, transactional) for each migration not yet applied, in order."""
+
+    with db.engine.begin() as connection:
+        applied = applied_versions(connection)
+    return [entry for entry in MIGRATIONS if entry[0] not in applied]
+
+
+def record(connection, version):
+    connection.execute(schema_migrations.insert().values(
+        version=version, applied_at=datetime.utcnow()))
+
+
+def migrate(target=None):
+    """Apply every pending migration, in order, up to and including version
+    `target` (default: all of them). Returns their versions.
+
+    Each gets a connection of its own, so no transaction of ours is left
+    open for a concurrent index build to wait on.
+    """
+
+    entries = pending()
+    if target is not None:
+        versions = [version for version, _, _ in MIGRATIONS]
+        entries = [entry for entry in entries
+                   if versions.index(entry[0]) <= versions.index(target)]
+
+    ran = []
+    for version, fn, transactional in entries:
+        if transactional:
+            with db.engine.begin() as connection:
+                fn(connection)
+                record(connection, version)
+        else:
+            with db.engine.connect() as connection:
+                if connection.dialect.name == 'postgresql':
+                    fn(connection.execution_options(isolation_level='AUTOCOMMIT'))
+                else:
+                    fn(connection)
+            with db.engine.begin() as connection:
+                record(connection, version)
+        ran.append(version)
+
+    return ran
@@ -1,12 +1,16 @@
 """SQLAlchemy models for Warbler."""
 
+import sqlite3
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from flask import abort
+from sqlalchemy import event, true
+from sqlalchemy.engine import Engine
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from passwords import hasher
+from replicas import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
 
 
 class Follows(db.Model):
@@ -26,26 +30,128 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    __table_args__ = (
+        # the key leads with the followed user; this serves who a user follows
+        db.Index('ix_follows_user_following_id',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
+    @classmethod
+    def exists(cls, follower_id, followed_id):
+        """Does `follower_id` follow `followed_id`?"""
+
+        query = cls.query.filter_by(user_being_followed_id=followed_id,
+                                    user_following_id=follower_id)
+        return db.session.query(query.exists()).scalar()
+
+    @classmethod
+    def followed_among(cls, follower_id, user_ids):
+        """Which of `user_ids` does `follower_id` follow? Returns a set."""
+
+        if not user_ids:
+            return set()
+
+        rows = (db.session.query(cls.user_being_followed_id)
+                .filter(cls.user_following_id == follower_id)
+                .filter(cls.user_being_followed_id.in_(user_ids)))
+        return {followed_id for (followed_id,) in rows}
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
 
     __tablename__ = 'likes' 
 
-    id = db.Column(
+    user_id = db.Column(
         db.Integer,
-        primary_key=True
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
     )
 
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # the key, (user_id, message_id), serves a user's likes
+    __table_args__ = (
+        # for the cascade when a message is deleted
+        db.Index('ix_likes_message_id', 'message_id'),
+    )
+
+    @classmethod
+    def exists(cls, user_id, message_id):
+        """Has `user_id` liked `message_id`?"""
+
+        query = cls.query.filter_by(user_id=user_id, message_id=message_id)
+        return db.session.query(query.exists()).scalar()
+
+    @classmethod
+    def liked_among(cls, user_id, message_ids):
+        """Which of `message_ids` has `user_id` liked? Returns a set."""
+
+        if not message_ids:
+            return set()
+
+        rows = (db.session.query(cls.message_id)
+                .filter(cls.user_id == user_id)
+                .filter(cls.message_id.in_(message_ids)))
+        return {message_id for (message_id,) in rows}
+
+
+class TimelineEntry(db.Model):
+    """A message pushed onto a user's precomputed home timeline."""
+
+    __tablename__ = 'timelines'
+
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
     )
 
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        primary_key=True,
+    )
+
+    # copied from the message so a timeline page is a single index range scan
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timelines_user_id_timestamp',
+                 'user_id', 'timestamp', 'message_id'),
+        # for the cascade when a message is deleted
+        db.Index('ix_timelines_message_id', 'message_id'),
+    )
+
+
+class Suggestion(db.Model):
+    """A user suggested to another to follow; see recommendations.py."""
+
+    __tablename__ = 'suggestions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    suggested_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # how many of the users `user_id` follows follow `suggested_id`
+    score = db.Column(
+        db.Integer,
+        nullable=False,
     )
 
 
@@ -96,41 +202,120 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message')
+    # denormalized count of messages written; maintained by counters.py
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # denormalized count of users this user follows; maintained by counters.py
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # denormalized count of users following this user; maintained by counters.py
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # denormalized count of messages this user has liked; maintained by counters.py
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # last-activity marker for conditional GETs (see conditional.py); bumped
+    # by every ORM or Core UPDATE of the row, counters included
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    # the tombstone: set when the account's deletion is requested, after
+    # which it's hidden everywhere while purge.py takes its rows apart
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
+    __table_args__ = (
+        # just the tombstoned accounts, for `deleted_ids`; empty as a rule
+        db.Index('ix_users_deleted_at', 'deleted_at',
+                 postgresql_where=db.text('deleted_at IS NOT NULL'),
+                 sqlite_where=db.text('deleted_at IS NOT NULL')),
+    )
+
+    # passive_deletes: deleting a user leaves these rows to the foreign keys'
+    # ON DELETE CASCADE instead of loading every one of them first
+    messages = db.relationship('Message', passive_deletes=True)
 
     followers = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_being_followed_id == id),
-        secondaryjoin=(Follows.user_following_id == id)
+        secondaryjoin=(Follows.user_following_id == id),
+        passive_deletes=True,
     )
 
     following = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_following_id == id),
-        secondaryjoin=(Follows.user_being_followed_id == id)
+        secondaryjoin=(Follows.user_being_followed_id == id),
+        passive_deletes=True,
     )
 
     likes = db.relationship(
         'Message',
-        secondary="likes"
+        secondary="likes",
+        passive_deletes=True,
     )
 
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
     def is_followed_by(self, other_user):
-        """Is this user followed by `other_user`?"""
+        """Is this user followed by `other_user`?
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        A single primary-key lookup on `follows`, not a scan of `followers`.
+        """
+
+        return Follows.exists(other_user.id, self.id)
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.exists(self.id, other_user.id)
+
+    @classmethod
+    def deleted_ids(cls):
+        """Ids of tombstoned accounts still waiting for their purge."""
+
+        return [id for (id,) in db.session.query(cls.id).filter(cls.deleted_at.isnot(None))]
+
+    @classmethod
+    def live_or_404(cls, user_id, query=None):
+        """User `user_id`, loaded with `query` (default `User.query`).
+
+        404s if there's no such user or their account is deleted.
+        """
+
+        user = (query or cls.query).get_or_404(user_id)
+        if user.deleted_at is not None:
+            abort(404)
+        return user
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -139,7 +324,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -160,13 +345,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        A hash made with a cost other than the configured one is replaced
+        on success; the caller commits.
         """
 
         user = cls.query.filter_by(username=username).first()
 
-        if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+        if user and user.deleted_at is None:
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
@@ -180,10 +370,10 @@ class User(db.Model):
             return False
         user = cls.query.filter_by(username=username).first()
 
-        if user:
-            is_auth = bcrypt.check_password_hash(user.password, old_password)
+        if user and user.deleted_at is None:
+            is_auth = hasher.check(user.password, old_password)
             if is_auth:
-                hashed_pwd = bcrypt.generate_password_hash(new_password).decode('UTF-8')
+                hashed_pwd = hasher.hash(new_password)
                 user.password = hashed_pwd
                 db.session.add(user)
                 return user
@@ -209,7 +399,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -218,8 +408,158 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # denormalized count of likes; maintained by counters.py
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # edit version for conditional GETs; SQLAlchemy bumps it on ORM updates
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        server_default='1',
+    )
+
+    # log of the message's time-weighted likes; maintained by trending.py
+    trend = db.Column(
+        db.Float,
+    )
+
     user = db.relationship('User')
 
+    __mapper_args__ = {
+        'version_id_col': version,
+    }
+
+    __table_args__ = (
+        db.Index('ix_messages_trend', 'trend'),
+        # a user's messages, newest first, and everyone's
+        db.Index('ix_messages_user_id_timestamp', 'user_id', 'timestamp', 'id'),
+        db.Index('ix_messages_timestamp', 'timestamp', 'id'),
+    )
+
+    @classmethod
+    def by_live_authors(cls):
+        """Criterion for messages whose author isn't tombstoned.
+
+        A NOT IN over the (usually empty) tombstoned ids rather than a join
+        to users, so newest-first feeds still walk their timestamp index and
+        stop at the LIMIT.
+        """
+
+        deleted = User.deleted_ids()
+        if not deleted:
+            return true()
+        return cls.user_id.notin_(deleted)
+
+
+class Job(db.Model):
+    """A unit of deferred work for the job worker; see jobs.py."""
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    # the registered task to run, and its keyword arguments as JSON
+    name = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    payload = db.Column(
+        db.Text,
+        nullable=False,
+        default='{}',
+    )
+
+    # enqueueing again with the same key is a no-op
+    key = db.Column(
+        db.Text,
+        unique=True,
+    )
+
+    # pending -> running -> done, or back to pending to retry, or failed
+    status = db.Column(
+        db.Text,
+        nullable=False,
+        default='pending',
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    max_attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=5,
+    )
+
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    locked_by = db.Column(
+        db.Text,
+    )
+
+    locked_at = db.Column(
+        db.DateTime,
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+
+class SchemaMigration(db.Model):
+    """A migration applied to this database; see migrations.py."""
+
+    __tablename__ = 'schema_migrations'
+
+    version = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    applied_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+
+@event.listens_for(Engine, 'connect')
+def _enforce_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys unless asked, per connection; deletes of
+    # users and messages rely on their ON DELETE CASCADE
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute('PRAGMA foreign_keys = ON')
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
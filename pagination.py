@@ -0,0 +1,119 @@
+"""Keyset (cursor) pagination helpers.
+
+Message lists are paged on (timestamp, id) and user lists on id, so every
+page is a bounded index range scan no matter how deep the reader goes --
+unlike OFFSET, which reads and throws away every row before the page.
+"""
+
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime
+
+from flask import request
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 200
+
+CURSOR_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def page_size(default=DEFAULT_PAGE_SIZE):
+    """Page size from the `limit` querystring param, clamped to a sane range."""
+
+    limit = request.args.get('limit', default, type=int)
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def encode_message_cursor(timestamp, id):
+    """Cursor pointing just past a message at (`timestamp`, `id`)."""
+
+    return f"{timestamp.strftime(CURSOR_TIME_FORMAT)}.{id}"
+
+
+def decode_message_cursor(cursor):
+    """Parse a message cursor; returns None if it is missing or malformed."""
+
+    try:
+        timestamp, id = cursor.split('.')
+        return datetime.strptime(timestamp, CURSOR_TIME_FORMAT), int(id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def decode_id_cursor(cursor):
+    """Parse a user id cursor; returns None if it is missing or malformed."""
+
+    try:
+        return int(cursor)
+    except (TypeError, ValueError):
+        return None
+
+
+def paginate_newest_first(query, timestamp_col, id_col, before, limit,
+                          key=lambda item: (item.timestamp, item.id)):
+    """Page through `query` newest first, starting after the `before` cursor.
+
+    `key` maps a result row to its (timestamp, id) so the next cursor can be
+    built from the last item on the page.
+    """
+
+    position = decode_message_cursor(before)
+    if position:
+        timestamp, id = position
+        query = query.filter(or_(timestamp_col < timestamp,
+                                 and_(timestamp_col == timestamp, id_col < id)))
+
+    items = (query
+             .order_by(timestamp_col.desc(), id_col.desc())
+             .limit(limit + 1)
+             .all())
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_message_cursor(*key(items[-1]))
+
+    return Page(items, next_cursor)
+
+
+def paginate_by_id(query, id_col, after, limit):
+    """Page through `query` in ascending id order, starting after `after`."""
+
+    last_id = decode_id_cursor(after)
+    if last_id is not None:
+        query = query.filter(id_col > last_id)
+
+    items = query.order_by(id_col).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = str(items[-1].id)
+
+    return Page(items, next_cursor)
+
+
+def paginate_ids(query, id_col, ids, after, limit):
+    """Page through `query`'s rows for the sorted id sequence `ids`, after `after`.
+
+    The page's ids are found in `ids` by binary search, so only that page's
+    rows are queried, however long `ids` is.
+    """
+
+    last_id = decode_id_cursor(after)
+    start = 0 if last_id is None else bisect_right(ids, last_id)
+    window = [int(id) for id in ids[start:start + limit + 1]]
+
+    next_cursor = None
+    if len(window) > limit:
+        window = window[:limit]
+        next_cursor = str(window[-1])
+
+    if not window:
+        return Page([], next_cursor)
+
+    items = query.filter(id_col.in_(window)).order_by(id_col).all()
+    return Page(items, next_cursor)
@@ -0,0 +1,143 @@
+"""Password hashing and verification off the request thread.
+
+bcrypt is deliberately slow (~250 ms at cost 12), so a burst of logins used
+to pin every worker. `hasher` runs each hash or check on a small, bounded
+thread pool instead:
+
+- at most `workers` hashes run at once, and at most `max_pending` more may
+  wait for a thread; past that `HasherBusy` is raised straight away, and the
+  app answers 503 rather than queueing the request behind everyone else's.
+- the work factor comes from BCRYPT_LOG_ROUNDS. `User.authenticate` rehashes
+  a password whose stored cost differs from it, so raising (or lowering) the
+  cost takes effect as users log in.
+
+Tune the cost against latency with benchmarks/bench_login.py.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+
+from flask_bcrypt import Bcrypt
+
+from metrics import BCRYPT_SECONDS
+
+DEFAULT_ROUNDS = 12
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_PENDING = 32
+DEFAULT_TIMEOUT = 10
+
+bcrypt = Bcrypt()
+
+
+class HasherBusy(Exception):
+    """Too many password hashes are already queued or running."""
+
+
+def hash_rounds(pw_hash):
+    """The cost a bcrypt hash ('$2b$12$...') was made with, or None."""
+
+    try:
+        return int(pw_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """Bounded thread pool for bcrypt hashing and checking."""
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=DEFAULT_WORKERS,
+                 max_pending=DEFAULT_MAX_PENDING, timeout=DEFAULT_TIMEOUT):
+        self.executor = None
+        self.lock = Lock()
+        self.in_flight = 0
+        self.rejected = 0
+        self.configure(rounds, workers, max_pending, timeout)
+
+    def configure(self, rounds=DEFAULT_ROUNDS, workers=DEFAULT_WORKERS,
+                  max_pending=DEFAULT_MAX_PENDING, timeout=DEFAULT_TIMEOUT):
+        """(Re)size the pool. Hashes already submitted finish on the old one."""
+
+        if self.executor:
+            self.executor.shutdown(wait=False)
+
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='bcrypt')
+        self.slots = BoundedSemaphore(workers + max_pending)
+
+    def init_app(self, app):
+        """Configure from BCRYPT_LOG_ROUNDS and the PASSWORD_HASH_* settings."""
+
+        self.configure(rounds=app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS),
+                       workers=app.config.get('PASSWORD_HASH_WORKERS', DEFAULT_WORKERS),
+                       max_pending=app.config.get('PASSWORD_HASH_MAX_PENDING',
+                                                  DEFAULT_MAX_PENDING),
+                       timeout=app.config.get('PASSWORD_HASH_TIMEOUT', DEFAULT_TIMEOUT))
+
+    def run(self, fn, *args):
+        """Run `fn(*args)` on the pool and wait for it.
+
+        Raises HasherBusy if the queue is full or the result takes longer
+        than `timeout` seconds.
+        """
+
+        slots = self.slots
+        if not slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise HasherBusy()
+
+        with self.lock:
+            self.in_flight += 1
+
+        def release(future):
+            with self.lock:
+                self.in_flight -= 1
+            slots.release()
+
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(release)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HasherBusy()
+
+    def hash(self, password):
+        """bcrypt hash of `password` at the configured cost, as text."""
+
+        start = perf_counter()
+        pw_hash = self.run(bcrypt.generate_password_hash, password, self.rounds)
+        BCRYPT_SECONDS.observe(perf_counter() - start, op='hash')
+        return pw_hash.decode('UTF-8')
+
+    def check(self, pw_hash, password):
+        """Does `password` match `pw_hash`?"""
+
+        start = perf_counter()
+        matches = self.run(bcrypt.check_password_hash, pw_hash, password)
+        BCRYPT_SECONDS.observe(perf_counter() - start, op='check')
+        return matches
+
+    def needs_rehash(self, pw_hash):
+        """Was `pw_hash` made with a cost other than the configured one?"""
+
+        return hash_rounds(pw_hash) != self.rounds
+
+    def stats(self):
+        """Pool size and load, for monitoring."""
+
+        with self.lock:
+            return dict(rounds=self.rounds,
+                        workers=self.workers,
+                        max_pending=self.max_pending,
+                        in_flight=self.in_flight,
+                        rejected=self.rejected)
+
+
+hasher = PasswordHasher()
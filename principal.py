@@ -0,0 +1,118 @@
+"""Cached request principal for the logged-in user.
+
+`add_user_to_g` used to run a full `User.query.get` on every request,
+including redirects and 404s. Instead, a bounded LRU cache with a TTL keeps
+a small snapshot of each recently seen user (the columns the nav bar and
+most views need), and `g.user` is a `CurrentUser` built from it.
+
+Anything beyond the snapshot -- counters, relationships, ORM writes -- is
+delegated to the full `User` row, loaded the first time it is touched.
+Views that change a user's profile, password or existence must call
+`principal_cache.invalidate(user_id)`.
+"""
+
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from time import monotonic
+
+from models import db, User
+
+Snapshot = namedtuple('Snapshot', ['id', 'username', 'image_url', 'header_image_url'])
+
+
+class PrincipalCache:
+    """Bounded LRU of user `Snapshot`s, each trusted for `ttl` seconds."""
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """Snapshot for `user_id`, or None if there is no such user."""
+
+        now = monotonic()
+
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry and entry[1] > now:
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        row = (db.session.query(User.id, User.username,
+                                User.image_url, User.header_image_url)
+               .filter(User.id == user_id, User.deleted_at.is_(None))
+               .first())
+
+        # unknown ids (stale sessions, deleted accounts) aren't cached, so a
+        # later signup that reuses the id is seen straight away
+        if row is None:
+            return None
+
+        snapshot = Snapshot(*row)
+
+        with self.lock:
+            self.entries[user_id] = (snapshot, now + self.ttl)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+        return snapshot
+
+    def invalidate(self, user_id):
+        """Forget `user_id`; the next request reloads it."""
+
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Hit/miss counts and current size, for monitoring."""
+
+        with self.lock:
+            lookups = self.hits + self.misses
+            return dict(hits=self.hits,
+                        misses=self.misses,
+                        hit_rate=self.hits / lookups if lookups else 0.0,
+                        size=len(self.entries))
+
+
+class CurrentUser:
+    """The logged-in user as seen by views and templates (`g.user`).
+
+    Snapshot columns are answered from the cache; any other attribute loads
+    the full `User` once per request and reads it from there.
+    """
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+        self._user = None
+
+    id = property(lambda self: self._snapshot.id)
+    username = property(lambda self: self._snapshot.username)
+    image_url = property(lambda self: self._snapshot.image_url)
+    header_image_url = property(lambda self: self._snapshot.header_image_url)
+
+    def load(self):
+        """The full `User` row for this principal."""
+
+        if self._user is None:
+            self._user = User.query.get(self._snapshot.id)
+        return self._user
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}: {self.username}>"
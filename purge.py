@@ -0,0 +1,141 @@
+"""Deleting an account in bounded batches, off the request path.
+
+`delete_user` tombstones the account (sets `deleted_at`, which hides it
+and its messages everywhere) and queues a `delete_account` job; the
+request does nothing else.
+The job calls `purge_user`, which takes the account apart a batch of
+PURGE_BATCH_SIZE rows at a time, each batch in its own short transaction:
+
+1. their messages -- likes and timeline entries go with each batch by the
+   foreign keys' ON DELETE CASCADE; the likers' counters come down first;
+2. the follows of their followers, then the follows they made, moving the
+   other side's counter and the follow graph index;
+3. their likes, taking each message's like count down.
+
+Every batch moves counters and deletes rows in the same transaction, so
+it can stop (or die) between any two and start again where it left off.
+What's left -- the user row, their own timeline and suggestions -- goes
+in one last DELETE, which the ORM issues without loading a collection
+(the relationships are `passive_deletes`).
+
+A run stops after PURGE_SECONDS, well inside the worker's stale timeout,
+and the job queues another to carry on.
+"""
+
+from collections import defaultdict
+from time import perf_counter
+
+from sqlalchemy import and_, func, select
+
+import counters
+import graph
+from models import db, Follows, Likes, Message, User
+
+PURGE_BATCH_SIZE = 1000
+PURGE_SECONDS = 60
+
+users = User.__table__
+messages = Message.__table__
+follows = Follows.__table__
+likes = Likes.__table__
+
+
+def first_ids(connection, column, where, batch_size):
+    """Up to `batch_size` values of `column` where `where`, lowest first."""
+
+    return [id for (id,) in connection.execute(
+        select([column]).where(where).order_by(column).limit(batch_size))]
+
+
+def purge_messages(connection, user_id, batch_size):
+    ids = first_ids(connection, messages.c.id, messages.c.user_id == user_id, batch_size)
+    if not ids:
+        return 0
+
+    likers = defaultdict(list)
+    for liker_id, liked in connection.execute(
+            select([likes.c.user_id, func.count()])
+            .where(likes.c.message_id.in_(ids))
+            .group_by(likes.c.user_id)):
+        likers[liked].append(liker_id)
+    for liked, liker_ids in likers.items():
+        counters.bump_many(connection, liker_ids, 'likes_count', -liked)
+
+    connection.execute(messages.delete().where(messages.c.id.in_(ids)))
+    return len(ids)
+
+
+def purge_followers(connection, user_id, batch_size):
+    ids = first_ids(connection, follows.c.user_following_id,
+                    follows.c.user_being_followed_id == user_id, batch_size)
+    if not ids:
+        return 0
+
+    counters.bump_many(connection, ids, 'following_count', -1)
+    connection.execute(follows.delete().where(and_(
+        follows.c.user_being_followed_id == user_id,
+        follows.c.user_following_id.in_(ids))))
+    for follower_id in ids:
+        graph.record(follower_id, [user_id], False)
+    return len(ids)
+
+
+def purge_following(connection, user_id, batch_size):
+    ids = first_ids(connection, follows.c.user_being_followed_id,
+                    follows.c.user_following_id == user_id, batch_size)
+    if not ids:
+        return 0
+
+    counters.bump_many(connection, ids, 'followers_count', -1)
+    connection.execute(follows.delete().where(and_(
+        follows.c.user_following_id == user_id,
+        follows.c.user_being_followed_id.in_(ids))))
+    graph.record(user_id, ids, False)
+    return len(ids)
+
+
+def purge_likes(connection, user_id, batch_size):
+    ids = first_ids(connection, likes.c.message_id, likes.c.user_id == user_id, batch_size)
+    if not ids:
+        return 0
+
+    connection.execute(messages.update()
+                       .where(messages.c.id.in_(ids))
+                       .values(likes_count=messages.c.likes_count - 1))
+    connection.execute(likes.delete().where(and_(likes.c.user_id == user_id,
+                                                 likes.c.message_id.in_(ids))))
+    return len(ids)
+
+
+STEPS = [purge_messages, purge_followers, purge_following, purge_likes]
+
+
+def purge_user(user_id, batch_size=PURGE_BATCH_SIZE, seconds=None):
+    """Delete `user_id` and everything of theirs, committing per batch.
+
+    Returns True once the user is gone, False if `seconds` (default
+    PURGE_SECONDS) ran out first.
+    """
+
+    deadline = perf_counter() + (PURGE_SECONDS if seconds is None else seconds)
+
+    for step in STEPS:
+        while True:
+            if perf_counter() > deadline:
+                return False
+
+            connection = db.session.connection()
+            # one purge at a time per user, even if a stale job is rerun
+            connection.execute(select([users.c.id])
+                               .where(users.c.id == user_id)
+                               .with_for_update())
+            purged = step(connection, user_id, batch_size)
+            db.session.commit()
+            if purged < batch_size:
+                break
+
+    user = User.query.get(user_id)
+    if user is not None:
+        db.session.delete(user)
+        db.session.commit()
+    return True
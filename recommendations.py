@@ -0,0 +1,202 @@
+"""Friends-of-friends "who to follow" suggestions.
+
+`flask recommend-follows` loads the whole `follows` table into a compressed
+sparse row (CSR) `Adjacency` (see graph.py) -- an int32 array of followed
+ids, sorted and grouped by follower, plus an int64 array of where each
+follower's group starts, so about 4 bytes per edge and 8 per user. For
+every user, the candidates are the users followed by the people they follow; a candidate's score is how
+many of those people follow them. The best SUGGESTIONS_PER_USER candidates
+the user doesn't already follow are stored in `suggestions`.
+
+Scoring one user is a handful of array operations (gather, unique, partial
+sort), not a Python loop over edges. Users are scored in chunks of
+consecutive ids by a pool of forked processes, which share the graph
+copy-on-write; the parent replaces each chunk's rows in its own
+transaction, so a user sees their old suggestions or their new ones,
+never none. Pass `user_ids` to refresh just those users.
+
+`suggested_users` reads them back for the home page and the user listing,
+skipping anyone followed since the last run.
+"""
+
+import multiprocessing
+import os
+from collections import namedtuple
+from time import perf_counter
+
+import numpy as np
+from sqlalchemy import and_, exists
+from sqlalchemy.orm import load_only
+
+from fragments import USER_CARD_COLUMNS
+from graph import Adjacency, load_edges
+import loader
+from models import db, Follows, Suggestion, User
+
+SUGGESTIONS_PER_USER = 20
+
+# Users following more people than this are scored from a fixed random
+# sample of them, which bounds the work per user.
+MAX_FOLLOWED_SCANNED = 2000
+
+DEFAULT_CHUNK_SIZE = 1000
+suggestions = Suggestion.__table__
+
+RecommendResult = namedtuple('RecommendResult', ['users', 'suggestions', 'edges',
+                                                 'graph_bytes', 'seconds'])
+
+
+def load_graph():
+    """The `follows` table as an `Adjacency` of who each user follows."""
+
+    followers, followed = load_edges()
+    return Adjacency.from_edges(followers, followed)
+
+
+def suggest_for(graph, user_id, limit=SUGGESTIONS_PER_USER):
+    """[(suggested id, score)] for `user_id`, best first, ties by id."""
+
+    followed = graph.row(user_id)
+    if len(followed) > MAX_FOLLOWED_SCANNED:
+        sample = np.random.default_rng(user_id).choice(
+            len(followed), MAX_FOLLOWED_SCANNED, replace=False)
+        scanned = followed[np.sort(sample)]
+    else:
+        scanned = followed
+
+    starts = graph.offsets[scanned]
+    lengths = graph.offsets[scanned + 1] - starts
+    total = int(lengths.sum())
+    if not total:
+        return []
+
+    # the positions of every followed-by-a-followed id, without a Python loop:
+    # 0..total-1, shifted so each group starts at its own offset
+    shifts = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    candidates, scores = np.unique(graph.ids[np.arange(total) + shifts],
+                                   return_counts=True)
+
+    keep = candidates != user_id
+    keep &= ~np.isin(candidates, followed, assume_unique=True)
+    candidates, scores = candidates[keep], scores[keep]
+
+    if len(candidates) > limit:
+        # everyone scoring at least the limit-th best, so ties break by id below
+        cutoff = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+        top = scores >= cutoff
+        candidates, scores = candidates[top], scores[top]
+
+    order = np.lexsort((candidates, -scores))[:limit]
+    return list(zip(candidates[order].tolist(), scores[order].tolist()))
+
+
+# The graph being scored. Set in the parent before the pool forks, so the
+# workers read the parent's arrays instead of each getting a pickled copy.
+_graph = None
+
+
+def score_chunk(user_ids):
+    """(user_ids, suggestion rows) for every user in `user_ids`."""
+
+    rows = []
+    for user_id in user_ids:
+        rows.extend((user_id, suggested, score)
+                    for suggested, score in suggest_for(_graph, user_id))
+    return user_ids, rows
+
+
+def chunk_filter(user_ids):
+    """WHERE clause selecting `suggestions` rows for a chunk."""
+
+    if isinstance(user_ids, range):
+        return and_(suggestions.c.user_id >= user_ids.start,
+                    suggestions.c.user_id < user_ids.stop)
+    return suggestions.c.user_id.in_(user_ids)
+
+
+def write_chunk(connection, user_ids, rows):
+    """Replace the stored suggestions for `user_ids` with `rows`."""
+
+    with connection.begin():
+        connection.execute(suggestions.delete().where(chunk_filter(user_ids)))
+        if not rows:
+            return
+        if connection.dialect.name == 'postgresql':
+            loader.copy_rows(connection, suggestions,
+                             ['user_id', 'suggested_id', 'score'], rows)
+        else:
+            connection.execute(suggestions.insert(), [
+                dict(user_id=user_id, suggested_id=suggested, score=score)
+                for user_id, suggested, score in rows])
+
+
+def recommend(user_ids=None, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, graph=None):
+    """Recompute suggestions for `user_ids` (default: every user).
+
+    `workers` processes score chunks of `chunk_size` users at once (default:
+    one per core). Returns a `RecommendResult`.
+    """
+
+    global _graph
+
+    start = perf_counter()
+    graph = graph or load_graph()
+
+    if user_ids is None:
+        chunks = [range(first, min(first + chunk_size, graph.size))
+                  for first in range(0, graph.size, chunk_size)]
+    else:
+        user_ids = sorted(set(user_ids))
+        chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+
+    workers = workers or os.cpu_count() or 1
+    users = rows_written = 0
+
+    _graph = graph
+    try:
+        with db.engine.connect() as connection:
+            if workers > 1 and len(chunks) > 1:
+                pool = multiprocessing.get_context('fork').Pool(workers)
+                results = pool.imap_unordered(score_chunk, chunks)
+            else:
+                pool = None
+                results = map(score_chunk, chunks)
+
+            try:
+                for chunk, rows in results:
+                    write_chunk(connection, chunk, rows)
+                    users += len({user_id for user_id, _, _ in rows})
+                    rows_written += len(rows)
+            finally:
+                if pool:
+                    pool.close()
+                    pool.join()
+
+            if user_ids is None:
+                # users with ids past the graph follow no one
+                with connection.begin():
+                    connection.execute(suggestions.delete()
+                                       .where(suggestions.c.user_id >= graph.size))
+    finally:
+        _graph = None
+
+    return RecommendResult(users, rows_written, graph.edges, graph.nbytes,
+                           perf_counter() - start)
+
+
+def suggested_users(user_id, limit=5):
+    """Up to `limit` suggested users for `user_id` who they don't yet follow."""
+
+    already_following = exists().where(and_(
+        Follows.user_following_id == user_id,
+        Follows.user_being_followed_id == Suggestion.suggested_id))
+
+    return (User.query
+            .options(load_only(*USER_CARD_COLUMNS))
+            .join(Suggestion, Suggestion.suggested_id == User.id)
+            .filter(Suggestion.user_id == user_id)
+            .filter(User.deleted_at.is_(None))
+            .filter(~already_following)
+            .order_by(Suggestion.score.desc(), User.id)
+            .limit(limit)
+            .all())
@@ -0,0 +1,161 @@
+"""Read-replica routing with read-your-writes consistency.
+
+With SQLALCHEMY_REPLICA_URIS set (DATABASE_REPLICA_URLS in the environment,
+comma separated), `db.session` picks an engine per statement:
+
+- GET and HEAD requests read from a replica -- one per request, taken in
+  turn, so a page sees a single snapshot.
+- everything else goes to the primary: flushes, Core inserts, updates and
+  deletes, `session.connection()`, statements outside a request, and every
+  statement of a non-GET request.
+- once a request writes, the rest of it reads from the primary, and when
+  it commits, the visitor's session cookie pins them to the primary for
+  REPLICA_PIN_SECONDS -- long enough for the replicas to catch up, so
+  whoever made a change sees it on the page they're redirected to.
+
+Without replicas everything goes to the primary, as before. `router.stats()`
+counts the statements run on each engine.
+
+Replication itself is the databases' business. To try this locally, point
+DATABASE_URL and DATABASE_REPLICA_URLS at two SQLite files (or two Postgres
+databases) and copy one over the other whenever the "replica" should catch
+up.
+"""
+
+import itertools
+import re
+from collections import Counter
+from threading import Lock
+from time import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.expression import CompoundSelect, Select, TextClause
+
+DEFAULT_PIN_SECONDS = 5
+
+READ_METHODS = ('GET', 'HEAD')
+
+# Flask session key: epoch seconds until which this visitor reads from the
+# primary
+PIN_KEY = 'primary_until'
+
+TEXT_SELECT = re.compile(r"\s*SELECT\b", re.IGNORECASE)
+
+
+def is_read(clause):
+    """Is `clause` a plain SELECT, safe to send to a replica?"""
+
+    if isinstance(clause, (Select, CompoundSelect)):
+        return True
+    return isinstance(clause, TextClause) and bool(TEXT_SELECT.match(clause.text))
+
+
+class ReplicaRouter:
+    """Chooses the engine for each statement of a `RoutingSession`."""
+
+    def __init__(self):
+        self.uris = ()
+        self.engines = []
+        self.names = {}
+        self.turn = itertools.count()
+        self.lock = Lock()
+        self.queries = Counter()
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_PIN_SECONDS', DEFAULT_PIN_SECONDS)
+
+    def replicas(self):
+        """The replica engines for the current app's SQLALCHEMY_REPLICA_URIS.
+
+        Engines are rebuilt if the setting changes (tests switch it on and off).
+        """
+
+        uris = tuple(current_app.config.get('SQLALCHEMY_REPLICA_URIS') or ())
+
+        with self.lock:
+            if uris != self.uris:
+                for engine in self.engines:
+                    engine.dispose()
+                self.engines = [create_engine(uri) for uri in uris]
+                self.names = {engine: f"replica{i}" for i, engine in enumerate(self.engines)}
+                self.uris = uris
+            return self.engines
+
+    def pinned(self):
+        return session.get(PIN_KEY, 0) > time()
+
+    def pin(self):
+        """Read from the primary for the next REPLICA_PIN_SECONDS."""
+
+        session[PIN_KEY] = time() + current_app.config['REPLICA_PIN_SECONDS']
+
+    def bind_for(self, db_session, clause):
+        """A replica engine for `clause`, or None to use the primary."""
+
+        if not has_request_context() or not current_app.config.get('SQLALCHEMY_REPLICA_URIS'):
+            return None
+
+        if db_session._flushing or not is_read(clause):
+            g.wrote_primary = True
+            return None
+
+        if (request.method not in READ_METHODS
+                or g.get('wrote_primary')
+                or self.pinned()):
+            return None
+
+        replica = g.get('replica')
+        if replica is None:
+            replicas = self.replicas()
+            replica = g.replica = replicas[next(self.turn) % len(replicas)]
+        return replica
+
+    def count(self, engine):
+        name = self.names.get(engine, 'primary')
+        with self.lock:
+            self.queries[name] += 1
+
+    def reset_stats(self):
+        with self.lock:
+            self.queries.clear()
+
+    def stats(self):
+        """Statements run per engine ('primary', 'replica0', ...), for monitoring."""
+
+        with self.lock:
+            return dict(queries=dict(self.queries), replicas=len(self.engines))
+
+
+router = ReplicaRouter()
+
+
+class RoutingSession(SignallingSession):
+    """`db.session`, with reads sent to replicas by `router`."""
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = router.bind_for(self, clause)
+        if replica is not None:
+            return replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy whose sessions are `RoutingSession`s."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _pin_after_write(db_session):
+    if has_request_context() and g.get('wrote_primary'):
+        router.pin()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    router.count(conn.engine)
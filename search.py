@@ -0,0 +1,217 @@
+"""Indexed user search for `/users?q=` and username autocomplete.
+
+A leading-wildcard LIKE can't use a b-tree index, so substring search gets a
+trigram index of its own, created alongside the `users` table:
+
+- Postgres: pg_trgm GIN indexes on username, bio and location. ILIKE
+  '%term%' is answered from those indexes and ranked by similarity().
+- SQLite: an external-content FTS5 table with the trigram tokenizer, kept in
+  sync by triggers and ranked by bm25.
+
+Terms shorter than a trigram fall back to a username prefix match, which
+is an index range scan: on SQLite over the unique index on username (whose
+BINARY collation orders by code point); on Postgres over an index on
+`username COLLATE "C"`, since under the database's usual linguistic
+collation the strings starting with a prefix aren't one contiguous range.
+Autocomplete is always a prefix match.
+"""
+
+from sqlalchemy import DDL, event, or_, func, text
+
+from models import db, User
+from pagination import Page
+
+MIN_TRIGRAM_LENGTH = 3
+MAX_SEARCH_RESULTS = 1000
+AUTOCOMPLETE_LIMIT = 10
+
+# Highest code point; under a code point collation `prefix + PREFIX_END` sorts
+# after every string starting with `prefix`, which turns a prefix match into
+# an index range scan.
+PREFIX_END = '\U0010ffff'
+
+users = User.__table__
+
+
+##############################################################################
+# Index DDL, run by db.create_all() / db.drop_all()
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users USING gin (username gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_bio_trgm ON users USING gin (bio gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_location_trgm ON users USING gin (location gin_trgm_ops)",
+    'CREATE INDEX IF NOT EXISTS ix_users_username_c ON users (username COLLATE "C")',
+]
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS users_search USING fts5(
+        username, bio, location,
+        content='users', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS users_search_insert AFTER INSERT ON users BEGIN
+        INSERT INTO users_search(rowid, username, bio, location)
+        VALUES (new.id, new.username, new.bio, new.location);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_search_delete AFTER DELETE ON users BEGIN
+        INSERT INTO users_search(users_search, rowid, username, bio, location)
+        VALUES ('delete', old.id, old.username, old.bio, old.location);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_search_update
+    AFTER UPDATE OF username, bio, location ON users BEGIN
+        INSERT INTO users_search(users_search, rowid, username, bio, location)
+        VALUES ('delete', old.id, old.username, old.bio, old.location);
+        INSERT INTO users_search(rowid, username, bio, location)
+        VALUES (new.id, new.username, new.bio, new.location);
+    END""",
+]
+
+for statement in POSTGRES_DDL:
+    event.listen(users, 'after_create',
+                 DDL(statement).execute_if(dialect='postgresql'))
+
+for statement in SQLITE_DDL:
+    event.listen(users, 'after_create',
+                 DDL(statement).execute_if(dialect='sqlite'))
+
+event.listen(users, 'before_drop',
+             DDL("DROP TABLE IF EXISTS users_search").execute_if(dialect='sqlite'))
+
+
+POSTGRES_DROP_DDL = [
+    "DROP INDEX IF EXISTS ix_users_username_trgm",
+    "DROP INDEX IF EXISTS ix_users_bio_trgm",
+    "DROP INDEX IF EXISTS ix_users_location_trgm",
+    "DROP INDEX IF EXISTS ix_users_username_c",
+]
+
+SQLITE_DROP_DDL = [
+    "DROP TRIGGER IF EXISTS users_search_insert",
+    "DROP TRIGGER IF EXISTS users_search_delete",
+    "DROP TRIGGER IF EXISTS users_search_update",
+]
+
+
+def drop_search_index():
+    """Stop maintaining the search index, e.g. around a bulk load.
+
+    Call `create_search_index()` afterwards to rebuild it.
+    """
+
+    dialect = db.engine.dialect.name
+    statements = {'postgresql': POSTGRES_DROP_DDL, 'sqlite': SQLITE_DROP_DDL}.get(dialect, [])
+
+    for statement in statements:
+        db.session.execute(text(statement))
+
+    db.session.commit()
+
+
+def create_search_index():
+    """Create (or on SQLite, repopulate) the search index on an existing db."""
+
+    dialect = db.engine.dialect.name
+    statements = {'postgresql': POSTGRES_DDL, 'sqlite': SQLITE_DDL}.get(dialect, [])
+
+    for statement in statements:
+        db.session.execute(text(statement))
+
+    if dialect == 'sqlite':
+        db.session.execute(
+            text("INSERT INTO users_search(users_search) VALUES ('rebuild')"))
+
+    db.session.commit()
+
+
+##############################################################################
+# Queries
+
+
+def escape_like(term):
+    """Escape LIKE wildcards in `term` (using backslash as the escape)."""
+
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def username_order():
+    """Usernames in the order of the index `prefix_filter` scans."""
+
+    if db.engine.dialect.name == 'postgresql':
+        return User.username.collate('C')
+    return User.username
+
+
+def prefix_filter(term):
+    """Filter for usernames starting with `term`, as an index range."""
+
+    if db.engine.dialect.name == 'postgresql':
+        return User.username.collate('C').like(f"{escape_like(term)}%", escape='\\')
+    return User.username.between(term, term + PREFIX_END)
+
+
+def search_users(term, limit, cursor=None):
+    """Ranked, paginated user search. Returns a `Page`.
+
+    The cursor is an opaque offset into the ranked results; paging stops
+    after MAX_SEARCH_RESULTS rows so deep pages stay cheap.
+    """
+
+    try:
+        offset = max(0, int(cursor or 0))
+    except ValueError:
+        offset = 0
+
+    if offset >= MAX_SEARCH_RESULTS:
+        return Page([], None)
+
+    limit = min(limit, MAX_SEARCH_RESULTS - offset)
+    dialect = db.engine.dialect.name
+
+    if len(term) < MIN_TRIGRAM_LENGTH:
+        found = (User.query
+                 .filter(prefix_filter(term), User.deleted_at.is_(None))
+                 .order_by(username_order())
+                 .offset(offset).limit(limit + 1).all())
+
+    elif dialect == 'sqlite':
+        match = '"' + term.replace('"', '""') + '"'
+        ids = [id for (id,) in db.session.execute(
+            text("SELECT rowid FROM users_search WHERE users_search MATCH :match "
+                 "ORDER BY rank LIMIT :limit OFFSET :offset"),
+            {'match': match, 'limit': limit + 1, 'offset': offset})]
+        by_id = {user.id: user
+                 for user in User.query.filter(User.id.in_(ids), User.deleted_at.is_(None))}
+        found = [by_id[id] for id in ids if id in by_id]
+
+    elif dialect == 'postgresql':
+        pattern = f"%{escape_like(term)}%"
+        found = (User.query
+                 .filter(or_(User.username.ilike(pattern, escape='\\'),
+                             User.bio.ilike(pattern, escape='\\'),
+                             User.location.ilike(pattern, escape='\\')),
+                         User.deleted_at.is_(None))
+                 .order_by(func.similarity(User.username, term).desc(), User.id)
+                 .offset(offset).limit(limit + 1).all())
+
+    else:
+        pattern = f"%{escape_like(term)}%"
+        found = (User.query
+                 .filter(User.username.like(pattern, escape='\\'), User.deleted_at.is_(None))
+                 .order_by(User.id)
+                 .offset(offset).limit(limit + 1).all())
+
+    next_cursor = None
+    if len(found) > limit:
+        found = found[:limit]
+        next_cursor = str(offset + limit)
+
+    return Page(found, next_cursor)
+
+
+def autocomplete(prefix, limit=AUTOCOMPLETE_LIMIT):
+    """Up to `limit` users whose username starts with `prefix`."""
+
+    return (db.session.query(User.id, User.username, User.image_url)
+            .filter(prefix_filter(prefix), User.deleted_at.is_(None))
+            .order_by(username_order())
+            .limit(limit)
+            .all())
@@ -1,20 +1,20 @@
 """Seed database with sample data from CSV Files."""
 
-from csv import DictReader
 from app import db
-from models import User, Message, Follows
+import counters
+import loader
+import timeline
 
 
 db.drop_all()
 db.create_all()
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+# streamed in chunks; see loader.py (or `flask load-csvs` for options)
+for result in loader.load_csvs('generator'):
+    rate = result.rows / result.seconds if result.seconds else 0
+    print(f"{result.table}: {result.rows} rows in {result.seconds:.1f}s ({rate:,.0f} rows/s)")
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
-
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
-
-db.session.commit()
+# bulk inserts skip the ORM hooks, so build the home timelines and
+# counters afterwards
+timeline.rebuild_all()
+counters.reconcile()
@@ -0,0 +1,192 @@
+"""Per-request SQL instrumentation.
+
+SQLAlchemy engine events time every statement and hand it to whichever
+`QueryRecorder`s are active on the current thread. `init_app` keeps one
+running for each request and, when it finishes:
+
+- adds a `Server-Timing` header (`db` and `app` durations, with the query
+  count), which browser dev tools show next to the request.
+- logs one JSON line to the `warbler.sql` logger: route, status, query
+  count, time in the database and in total.
+- flags statement shapes -- the SQL with bind values and IN lists
+  collapsed -- that ran SQL_N_PLUS_ONE_THRESHOLD times or more as likely
+  N+1 loads, and logs them as a warning.
+
+Tests can pin a query budget with `assert_max_queries(n)`:
+
+    with assert_max_queries(4):
+        client.get("/users")
+"""
+
+import json
+import logging
+import re
+from collections import Counter
+from contextlib import contextmanager
+from threading import local
+from time import perf_counter
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_N_PLUS_ONE_THRESHOLD = 5
+
+logger = logging.getLogger('warbler.sql')
+
+_active = local()
+
+# bind placeholders in the styles our drivers use: ?, %s, %(name)s, :name
+PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|:\w+)"
+IN_LIST = re.compile(r"\(\s*" + PLACEHOLDER + r"(?:\s*,\s*" + PLACEHOLDER + r")*\s*\)")
+NUMBERED_PARAM = re.compile(r"(%\(\w+?|:\w+?)_\d+")
+WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement):
+    """`statement` with whitespace, IN lists and numbered params normalized."""
+
+    shape = WHITESPACE.sub(' ', statement).strip()
+    shape = NUMBERED_PARAM.sub(r"\1_N", shape)
+    return IN_LIST.sub('(...)', shape)
+
+
+class QueryRecorder:
+    """The statements run while it's active, with their durations."""
+
+    def __init__(self):
+        self.statements = []
+
+    def record(self, statement, seconds):
+        self.statements.append((statement, seconds))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def seconds(self):
+        return sum(seconds for _, seconds in self.statements)
+
+    def repeated(self, threshold=DEFAULT_N_PLUS_ONE_THRESHOLD):
+        """[(shape, count)] of shapes run at least `threshold` times."""
+
+        shapes = Counter(statement_shape(statement) for statement, _ in self.statements)
+        return [(shape, count) for shape, count in shapes.most_common()
+                if count >= threshold]
+
+
+def active_recorders():
+    return getattr(_active, 'recorders', [])
+
+
+def start_recording():
+    """Start a `QueryRecorder` on this thread and return it."""
+
+    recorder = QueryRecorder()
+    _active.recorders = active_recorders() + [recorder]
+    return recorder
+
+
+def stop_recording(recorder):
+    _active.recorders = [r for r in active_recorders() if r is not recorder]
+
+
+@contextmanager
+def recording():
+    """Record the statements run inside the block."""
+
+    recorder = start_recording()
+    try:
+        yield recorder
+    finally:
+        stop_recording(recorder)
+
+
+@contextmanager
+def assert_max_queries(n):
+    """Fail if more than `n` statements run inside the block."""
+
+    with recording() as recorder:
+        yield recorder
+
+    if recorder.count > n:
+        listing = '\n'.join(f"  {statement_shape(statement)}"
+                            for statement, _ in recorder.statements)
+        raise AssertionError(f"{recorder.count} queries, expected at most {n}:\n{listing}")
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if active_recorders():
+        conn.info.setdefault('query_started', []).append(perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+
+    seconds = perf_counter() - started.pop()
+    for recorder in active_recorders():
+        recorder.record(statement, seconds)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _execute_failed(context):
+    # after_cursor_execute doesn't run for a failed statement; drop its start
+    # time so it isn't left on the pooled connection for the next one to pop
+    connection = context.connection
+    started = connection.info.get('query_started') if connection is not None else None
+    if started:
+        started.pop()
+
+
+##############################################################################
+# Flask integration
+
+
+def init_app(app):
+    """Record every request's SQL; see the module docstring."""
+
+    app.config.setdefault('SQL_N_PLUS_ONE_THRESHOLD', DEFAULT_N_PLUS_ONE_THRESHOLD)
+
+    @app.before_request
+    def start_request_recording():
+        g.request_started = perf_counter()
+        g.sql = start_recording()
+
+    @app.after_request
+    def report_request_sql(response):
+        recorder = g.get('sql')
+        if recorder is None:
+            return response
+
+        total_ms = 1000 * (perf_counter() - g.request_started)
+        db_ms = 1000 * recorder.seconds
+        response.headers.add('Server-Timing',
+                             f'db;dur={db_ms:.1f};desc="{recorder.count} queries"')
+        response.headers.add('Server-Timing', f'app;dur={total_ms:.1f}')
+
+        repeated = recorder.repeated(app.config['SQL_N_PLUS_ONE_THRESHOLD'])
+        logger.info(json.dumps(dict(method=request.method,
+                                    path=request.path,
+                                    endpoint=request.endpoint,
+                                    status=response.status_code,
+                                    queries=recorder.count,
+                                    db_ms=round(db_ms, 1),
+                                    total_ms=round(total_ms, 1))))
+        for shape, count in repeated:
+            logger.warning(json.dumps(dict(n_plus_one=shape,
+                                           count=count,
+                                           endpoint=request.endpoint,
+                                           path=request.path)))
+
+        return response
+
+    @app.teardown_request
+    def stop_request_recording(exc):
+        recorder = g.pop('sql', None)
+        if recorder is not None:
+            stop_recording(recorder)
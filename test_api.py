@@ -0,0 +1,178 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+GENERIC_IMAGE = "https://mylostpetalert.com/wp-content/themes/mlpa-child/images/nophoto.gif"
+
+
+class APITestCase(TestCase):
+    """Test the /api/v1 endpoints."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.drop_all()
+        db.create_all()
+
+        david = User.signup("david", "test@test1.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+        jorge = User.signup("jorge", "test@test2.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+        db.session.add_all([david, jorge])
+        db.session.commit()
+
+        self.david_id = david.id
+        self.jorge_id = jorge.id
+
+        db.session.add(Follows(user_being_followed_id=self.jorge_id,
+                               user_following_id=self.david_id))
+        for day in range(1, 4):
+            db.session.add(Message(text=f"warble {day}", user_id=self.jorge_id,
+                                   timestamp=datetime(2020, 1, day)))
+        db.session.commit()
+
+        self.message_id = Message.query.filter_by(text="warble 3").one().id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.david_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_requires_login(self):
+        with app.test_client() as client:
+            res = client.get("/api/v1/timeline")
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.get_json()["error"], "Unauthorized")
+
+    def test_timeline(self):
+        res = self.client.get("/api/v1/timeline")
+        data = res.get_json()["data"]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([msg["text"] for msg in data], ["warble 3", "warble 2", "warble 1"])
+        self.assertEqual(data[0]["user"], dict(id=self.jorge_id, username="jorge",
+                                               image_url=GENERIC_IMAGE))
+        self.assertFalse(data[0]["liked"])
+
+    def test_timeline_paginated(self):
+        res = self.client.get("/api/v1/timeline?limit=2")
+        body = res.get_json()
+        self.assertEqual([msg["text"] for msg in body["data"]], ["warble 3", "warble 2"])
+
+        res = self.client.get(f"/api/v1/timeline?limit=2&before={body['next_cursor']}")
+        body = res.get_json()
+        self.assertEqual([msg["text"] for msg in body["data"]], ["warble 1"])
+        self.assertIsNone(body["next_cursor"])
+
+    def test_field_selection(self):
+        res = self.client.get("/api/v1/timeline?fields=text,id")
+        self.assertEqual(list(res.get_json()["data"][0]), ["text", "id"])
+
+        res = self.client.get("/api/v1/timeline?fields=text,password")
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("password", res.get_json()["message"])
+
+    def test_user(self):
+        res = self.client.get(f"/api/v1/users/{self.jorge_id}")
+        user = res.get_json()
+
+        self.assertEqual(user["username"], "jorge")
+        self.assertEqual(user["messages_count"], 3)
+        self.assertEqual(user["followers_count"], 1)
+        self.assertTrue(user["following"])
+        self.assertNotIn("password", user)
+        self.assertNotIn("email", user)
+
+        res = self.client.get(f"/api/v1/users/{self.jorge_id}",
+                              headers={"If-None-Match": res.headers["ETag"]})
+        self.assertEqual(res.status_code, 304)
+
+        res = self.client.get("/api/v1/users/999999")
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res.get_json()["error"], "Not Found")
+
+        res = self.client.get("/api/v1/no-such-thing")
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res.get_json()["error"], "Not Found")
+
+    def test_user_messages(self):
+        res = self.client.get(f"/api/v1/users/{self.jorge_id}/messages?limit=1&fields=text")
+        body = res.get_json()
+
+        self.assertEqual(body["data"], [{"text": "warble 3"}])
+        self.assertIsNotNone(body["next_cursor"])
+
+    def test_follow_lists(self):
+        res = self.client.get(f"/api/v1/users/{self.david_id}/following?fields=id,username")
+        self.assertEqual(res.get_json()["data"], [dict(id=self.jorge_id, username="jorge")])
+
+        res = self.client.get(f"/api/v1/users/{self.jorge_id}/followers?fields=username,following")
+        self.assertEqual(res.get_json()["data"], [dict(username="david", following=False)])
+
+    def test_like_and_unlike(self):
+        url = f"/api/v1/messages/{self.message_id}/like"
+
+        res = self.client.put(url)
+        self.assertEqual(res.get_json(), dict(liked=True, likes_count=1))
+
+        # liking again changes nothing
+        res = self.client.put(url)
+        self.assertEqual(res.get_json(), dict(liked=True, likes_count=1))
+
+        res = self.client.get("/api/v1/timeline?fields=id,liked")
+        self.assertIn(dict(id=self.message_id, liked=True), res.get_json()["data"])
+
+        res = self.client.delete(url)
+        self.assertEqual(res.get_json(), dict(liked=False, likes_count=0))
+
+        res = self.client.delete(url)
+        self.assertEqual(res.get_json(), dict(liked=False, likes_count=0))
+
+    def test_follow_and_unfollow(self):
+        url = f"/api/v1/users/{self.jorge_id}/follow"
+
+        res = self.client.delete(url)
+        self.assertEqual(res.get_json(), dict(following=False, followers_count=0))
+        self.assertEqual(self.client.get("/api/v1/timeline").get_json()["data"], [])
+
+        res = self.client.put(url)
+        self.assertEqual(res.get_json(), dict(following=True, followers_count=1))
+        res = self.client.put(url)
+        self.assertEqual(res.get_json(), dict(following=True, followers_count=1))
+        self.assertEqual(len(self.client.get("/api/v1/timeline").get_json()["data"]), 3)
+
+        res = self.client.put(f"/api/v1/users/{self.david_id}/follow")
+        self.assertEqual(res.status_code, 400)
+
+    def test_writes_reject_post(self):
+        res = self.client.post(f"/api/v1/messages/{self.message_id}/like")
+        self.assertEqual(res.status_code, 405)
@@ -0,0 +1,232 @@
+"""Bulk follow tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_bulk_follows.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import bulk_follows
+from sqlstats import recording
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+GENERIC_IMAGE = "https://mylostpetalert.com/wp-content/themes/mlpa-child/images/nophoto.gif"
+
+
+class BulkFollowTestCase(TestCase):
+    """Test following and unfollowing many users at once."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.drop_all()
+        db.create_all()
+
+        users = [User.signup(f"user{i}", f"test{i}@test.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+                 for i in range(6)]
+        db.session.add_all(users)
+        db.session.commit()
+
+        self.ids = [user.id for user in users]
+        self.me = self.ids[0]
+        self.others = self.ids[1:]
+
+        for user_id in self.others:
+            db.session.add(Message(text=f"hello from {user_id}", user_id=user_id))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def following(self, user_id):
+        return {f.user_being_followed_id
+                for f in Follows.query.filter_by(user_following_id=user_id)}
+
+    def test_follow_many(self):
+        db.session.add(Follows(user_being_followed_id=self.others[0], user_following_id=self.me))
+        db.session.commit()
+
+        with recording() as recorder:
+            added = bulk_follows.follow_many(self.me, self.ids + [999999])
+            db.session.commit()
+
+        # self, unknown and already followed ids are skipped
+        self.assertEqual(added, set(self.others[1:]))
+        self.assertEqual(self.following(self.me), set(self.others))
+
+        inserts = [s for s, _ in recorder.statements if s.startswith("INSERT INTO follows")]
+        self.assertEqual(len(inserts), 1)
+
+        me = User.query.get(self.me)
+        self.assertEqual(me.following_count, len(self.others))
+        self.assertEqual(User.query.get(self.others[1]).followers_count, 1)
+
+        timeline = TimelineEntry.query.filter_by(user_id=self.me).count()
+        self.assertEqual(timeline, len(self.others))
+
+    def test_follow_many_skips_deleted_users(self):
+        deleted, kept = self.others[:2]
+        User.query.get(deleted).deleted_at = datetime.utcnow()
+        db.session.commit()
+
+        self.assertEqual(bulk_follows.follow_many(self.me, [deleted, kept]), {kept})
+        db.session.commit()
+        self.assertEqual(self.following(self.me), {kept})
+
+        # nor do deleted users follow anyone, as by import-follows
+        lines = ["user_being_followed_id,user_following_id", f"{self.me},{deleted}"]
+        self.assertEqual(bulk_follows.import_follows(lines), 0)
+        self.assertEqual(self.following(deleted), set())
+
+    def test_unfollow_many(self):
+        bulk_follows.follow_many(self.me, self.others)
+        db.session.commit()
+
+        removed = bulk_follows.unfollow_many(self.me, self.others[:3] + [999999])
+        db.session.commit()
+
+        self.assertEqual(removed, set(self.others[:3]))
+        self.assertEqual(self.following(self.me), set(self.others[3:]))
+        self.assertEqual(User.query.get(self.me).following_count, len(self.others) - 3)
+        self.assertEqual(User.query.get(self.others[0]).followers_count, 0)
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=self.me).count(),
+                         len(self.others) - 3)
+
+    def test_parse_ids(self):
+        self.assertEqual(bulk_follows.parse_ids(["1, 2", "3\n4", 5]), {1, 2, 3, 4, 5})
+
+        with self.assertRaises(ValueError):
+            bulk_follows.parse_ids(["1", "two"])
+
+        with self.assertRaises(ValueError):
+            bulk_follows.parse_ids(range(bulk_follows.MAX_BATCH_SIZE + 1))
+
+    def test_import_follows(self):
+        lines = ["user_being_followed_id,user_following_id"]
+        lines += [f"{followed},{self.me}" for followed in self.others]
+        lines += [f"{self.me},{self.others[0]}", f"{self.me},999999"]
+
+        added = bulk_follows.import_follows(lines, commit_every=2)
+
+        self.assertEqual(added, len(self.others) + 1)
+        self.assertEqual(self.following(self.me), set(self.others))
+        self.assertEqual(self.following(self.others[0]), {self.me})
+
+    def test_import_follows_groups_by_follower(self):
+        lines = ["user_being_followed_id,user_following_id"]
+        for followed in self.others[1:]:
+            lines += [f"{followed},{self.me}", f"{self.me},{followed}"]
+
+        calls = []
+        follow_many = bulk_follows.follow_many
+
+        def counted(follower, ids):
+            calls.append(follower)
+            return follow_many(follower, ids)
+
+        bulk_follows.follow_many = counted
+        try:
+            bulk_follows.import_follows(lines)
+        finally:
+            bulk_follows.follow_many = follow_many
+
+        # one batch for me, one for each of the others, however the rows interleave
+        self.assertEqual(sorted(calls), sorted([self.me] + self.others[1:]))
+        self.assertEqual(self.following(self.me), set(self.others[1:]))
+
+    def test_import_follows_writes_as_it_reads(self):
+        read = []
+
+        def lines():
+            yield "user_being_followed_id,user_following_id"
+            for followed in self.others:
+                read.append(followed)
+                yield f"{followed},{self.me}"
+
+        written = []
+        follow_many = bulk_follows.follow_many
+
+        def recorded(follower, ids):
+            written.append(len(read))
+            return follow_many(follower, ids)
+
+        bulk_follows.follow_many = recorded
+        try:
+            added = bulk_follows.import_follows(lines(), commit_every=2)
+        finally:
+            bulk_follows.follow_many = follow_many
+
+        # a batch every two rows, before the rest of the file is read
+        self.assertEqual(added, len(self.others))
+        self.assertEqual(written, [2, 4, 5])
+
+    def test_import_follows_for_one_follower(self):
+        lines = ["user_being_followed_id,user_following_id",
+                 f"{self.others[0]},{self.me}",
+                 f"{self.me},{self.others[0]}"]
+
+        added = bulk_follows.import_follows(lines, follower_id=self.me)
+
+        self.assertEqual(added, 1)
+        self.assertEqual(self.following(self.others[0]), set())
+
+    def test_follow_many_route(self):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.me
+
+            res = client.post("/users/follow",
+                              data={"user_ids": ",".join(map(str, self.others))},
+                              follow_redirects=True)
+            self.assertEqual(res.status_code, 200)
+            self.assertIn(f"Followed {len(self.others)} users.", res.get_data(as_text=True))
+
+            res = client.post("/users/stop-following",
+                              data={"user_ids": [str(self.others[0]), str(self.others[1])]},
+                              follow_redirects=True)
+            self.assertIn("Unfollowed 2 users.", res.get_data(as_text=True))
+
+        self.assertEqual(self.following(self.me), set(self.others[2:]))
+
+    def test_follow_many_api(self):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.me
+
+            res = client.put("/api/v1/following", json={"user_ids": self.others[:2]})
+            self.assertEqual(res.get_json(), dict(followed=self.others[:2], following_count=2))
+
+            res = client.delete("/api/v1/following", json={"user_ids": [self.others[0]]})
+            self.assertEqual(res.get_json(), dict(unfollowed=[self.others[0]], following_count=1))
+
+            res = client.put("/api/v1/following", json={"user_ids": "nope"})
+            self.assertEqual(res.status_code, 400)
+
+            csv = "user_being_followed_id\n" + "\n".join(map(str, self.others))
+            res = client.put("/api/v1/following/import", data=csv,
+                             content_type="text/csv")
+            self.assertEqual(res.get_json(),
+                             dict(followed_count=len(self.others) - 1,
+                                  following_count=len(self.others)))
@@ -0,0 +1,111 @@
+"""User counter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_counters.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+GENERIC_IMAGE = "https://mylostpetalert.com/wp-content/themes/mlpa-child/images/nophoto.gif"
+
+
+class CountersTestCase(TestCase):
+    """Test the denormalized user counters."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.drop_all()
+        db.create_all()
+
+        david = User.signup("david", "test@test1.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+        jorge = User.signup("jorge", "test@test2.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+
+        db.session.add_all([david, jorge])
+        db.session.commit()
+
+        self.david_id = david.id
+        self.jorge_id = jorge.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def counts(self, user_id):
+        u = User.query.get(user_id)
+        return (u.messages_count, u.following_count, u.followers_count, u.likes_count)
+
+    def test_new_user_counters(self):
+        self.assertEqual(self.counts(self.david_id), (0, 0, 0, 0))
+
+    def test_counters_follow_writes(self):
+        m = Message(text="counted", user_id=self.david_id)
+        db.session.add(m)
+        db.session.add(Follows(user_being_followed_id=self.david_id,
+                               user_following_id=self.jorge_id))
+        db.session.commit()
+        db.session.add(Likes(user_id=self.jorge_id, message_id=m.id))
+        db.session.commit()
+
+        self.assertEqual(self.counts(self.david_id), (1, 0, 1, 0))
+        self.assertEqual(self.counts(self.jorge_id), (0, 1, 0, 1))
+
+        db.session.delete(m)
+        db.session.delete(Follows.query.one())
+        db.session.commit()
+
+        self.assertEqual(self.counts(self.david_id), (0, 0, 0, 0))
+        self.assertEqual(self.counts(self.jorge_id), (0, 0, 0, 0))
+
+    def test_toggle_like_view_counts(self):
+        m = Message(text="counted", user_id=self.david_id)
+        db.session.add(m)
+        db.session.commit()
+        message_id = m.id
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.jorge_id
+
+            client.post(f"/users/add_like/{message_id}")
+            self.assertEqual(self.counts(self.jorge_id)[3], 1)
+
+            client.post(f"/users/add_like/{message_id}")
+            self.assertEqual(self.counts(self.jorge_id)[3], 0)
+
+    def test_reconcile(self):
+        m = Message(text="counted", user_id=self.david_id)
+        db.session.add(m)
+        db.session.add(Follows(user_being_followed_id=self.david_id,
+                               user_following_id=self.jorge_id))
+        db.session.commit()
+
+        User.query.update({User.messages_count: 7, User.followers_count: 7})
+        db.session.commit()
+
+        self.assertEqual(counters.reconcile(batch_size=1), 2)
+        self.assertEqual(self.counts(self.david_id), (1, 0, 1, 0))
+        self.assertEqual(self.counts(self.jorge_id), (0, 1, 0, 0))
@@ -0,0 +1,121 @@
+"""Fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY, fragment_cache
+from fragments import FragmentCache, MESSAGE_TEMPLATE, USER_CARD_TEMPLATE
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+GENERIC_IMAGE = "https://mylostpetalert.com/wp-content/themes/mlpa-child/images/nophoto.gif"
+
+
+class DictBackend:
+    """Stand-in for a shared store."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test caching of message items and user cards."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        david = User.signup("david", "test@test1.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+        jorge = User.signup("jorge", "test@test2.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+        db.session.add_all([david, jorge])
+        db.session.commit()
+
+        db.session.add(Message(id=700, text="cached warble", user_id=david.id))
+        db.session.commit()
+
+        self.david_id = david.id
+        self.jorge_id = jorge.id
+        fragment_cache.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_profile_hits_cache(self):
+        with app.test_client() as client:
+            for i in range(3):
+                res = client.get(f"/users/{self.david_id}")
+                self.assertIn("cached warble", res.get_data(as_text=True))
+
+        stats = fragment_cache.stats()["templates"][MESSAGE_TEMPLATE]
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 2)
+
+    def test_edit_changes_stamp(self):
+        with app.test_request_context():
+            msg = Message.query.get(700)
+            self.assertIn("cached warble", fragment_cache.message(msg))
+
+            msg.text = "edited warble"
+            db.session.commit()
+            self.assertIn("edited warble", fragment_cache.message(msg))
+
+    def test_per_viewer_follow_buttons(self):
+        db.session.add(Follows(user_being_followed_id=self.jorge_id,
+                               user_following_id=self.david_id))
+        db.session.commit()
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.david_id
+            html = client.get("/users").get_data(as_text=True)
+            self.assertIn(f"/users/stop-following/{self.jorge_id}", html)
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.jorge_id
+            html = client.get("/users").get_data(as_text=True)
+            self.assertNotIn(f"/users/stop-following/{self.jorge_id}", html)
+            self.assertIn(f"/users/follow/{self.david_id}", html)
+
+        stats = fragment_cache.stats()["templates"][USER_CARD_TEMPLATE]
+        self.assertEqual(stats["hits"], 2)
+
+    def test_shared_backend(self):
+        backend = DictBackend()
+        first = FragmentCache(backend=backend)
+        second = FragmentCache(backend=backend)
+
+        with app.test_request_context():
+            user = User.query.get(self.david_id)
+            first.user_card(user)
+            self.assertIn("@david", second.user_card(user))
+
+        self.assertEqual(second.stats()["templates"][USER_CARD_TEMPLATE]["hits"], 1)
@@ -0,0 +1,195 @@
+"""Follow graph index tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_graph.py
+
+
+import os
+from unittest import TestCase
+
+import numpy as np
+
+from models import db, User, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import bulk_follows
+from follow_state import FollowState
+import graph
+from graph import Adjacency
+from sqlstats import recording
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+GENERIC_IMAGE = "https://mylostpetalert.com/wp-content/themes/mlpa-child/images/nophoto.gif"
+
+
+class AdjacencyTestCase(TestCase):
+    """Test the CSR arrays on their own."""
+
+    def setUp(self):
+        pairs = np.array([(1, 3), (1, 2), (2, 3)], dtype=np.int32)
+        self.adjacency = Adjacency.from_edges(pairs[:, 0], pairs[:, 1])
+
+    def test_rows_are_sorted(self):
+        self.assertEqual(list(self.adjacency.row(1)), [2, 3])
+        self.assertEqual(list(self.adjacency.row(4)), [])
+        self.assertTrue(self.adjacency.contains(1, 3))
+        self.assertFalse(self.adjacency.contains(3, 1))
+
+    def test_add_and_remove(self):
+        self.adjacency.add(1, 5)
+        self.adjacency.add(1, 0)
+        self.adjacency.add(1, 5)
+        self.adjacency.remove(2, 3)
+        self.adjacency.add(9, 1)
+
+        self.assertEqual(list(self.adjacency.row(1)), [0, 2, 3, 5])
+        self.assertEqual(list(self.adjacency.row(2)), [])
+        self.assertEqual(list(self.adjacency.row(9)), [1])
+        self.assertEqual(self.adjacency.edges, 5)
+
+    def test_empty(self):
+        adjacency = Adjacency.from_edges(graph.EMPTY, graph.EMPTY)
+
+        self.assertEqual(adjacency.edges, 0)
+        self.assertFalse(adjacency.contains(1, 2))
+
+
+class FollowGraphTestCase(TestCase):
+    """Test loading the index and keeping it current."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.drop_all()
+        db.create_all()
+
+        users = [User.signup(f"user{i}", f"test{i}@test.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+                 for i in range(5)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.ids = [user.id for user in users]
+
+        me, a, b, c, d = self.ids
+        for follower, followed in [(me, a), (me, b), (a, me)]:
+            db.session.add(Follows(user_following_id=follower, user_being_followed_id=followed))
+        db.session.commit()
+
+        graph.index.load()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def following(self, user_id):
+        return list(graph.index.following_ids(User.query.get(user_id)))
+
+    def followers(self, user_id):
+        return list(graph.index.follower_ids(User.query.get(user_id)))
+
+    def test_load(self):
+        me, a, b, c, d = self.ids
+
+        self.assertEqual(self.following(me), [a, b])
+        self.assertEqual(self.followers(me), [a])
+        self.assertTrue(graph.index.is_following(a, me))
+        self.assertFalse(graph.index.is_following(me, c))
+
+        stats = graph.index.stats()
+        self.assertEqual(stats['edges'], 3)
+        self.assertGreater(stats['bytes_per_edge'], 0)
+
+    def test_commits_are_applied(self):
+        me, a, b, c, d = self.ids
+
+        db.session.add(Follows(user_following_id=me, user_being_followed_id=c))
+        db.session.commit()
+        bulk_follows.follow_many(d, [me, a])
+        db.session.commit()
+        bulk_follows.unfollow_many(me, [a])
+        db.session.commit()
+
+        self.assertTrue(graph.index.is_following(me, c))
+        self.assertEqual(list(graph.index.followers.row(me)), [a, d])
+        self.assertEqual(list(graph.index.following.row(me)), [b, c])
+
+    def test_rollbacks_are_dropped(self):
+        me, a, b, c, d = self.ids
+
+        db.session.add(Follows(user_following_id=me, user_being_followed_id=c))
+        db.session.flush()
+        db.session.rollback()
+
+        self.assertFalse(graph.index.is_following(me, c))
+
+    def test_stale_rows_are_reread(self):
+        me, a, b, c, d = self.ids
+
+        # another process's follow: in the table and the counts, not the index
+        graph.index.following.remove(me, b)
+        self.assertEqual(self.following(me), [a, b])
+
+    def test_follow_state_from_the_index(self):
+        me, a, b, c, d = self.ids
+        viewer = User.query.get(me)
+
+        with recording() as recorder:
+            state = FollowState(viewer)
+            state.prime([a, b, c])
+
+        self.assertEqual(state.followed, {a, b})
+        self.assertEqual([s for s, _ in recorder.statements if 'follows' in s], [])
+
+        graph.index.clear()
+        state = FollowState(viewer)
+        self.assertTrue(state.is_following(b))
+        self.assertFalse(state.is_following(c))
+
+    def test_pages(self):
+        me, a, b, c, d = self.ids
+
+        page = graph.following_page(User.query.get(me), User.query, None, 1)
+        self.assertEqual([user.id for user in page.items], [a])
+
+        page = graph.following_page(User.query.get(me), User.query, page.next_cursor, 1)
+        self.assertEqual([user.id for user in page.items], [b])
+        self.assertIsNone(page.next_cursor)
+
+    def test_pages_before_loading(self):
+        me, a, b, c, d = self.ids
+        graph.index.clear()
+
+        page = graph.followers_page(User.query.get(me), User.query, None, 10)
+        self.assertEqual([user.id for user in page.items], [a])
+        self.assertTrue(graph.index.is_following(me, b))
+
+    def test_following_page_links_more(self):
+        me = self.ids[0]
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = me
+
+            html = client.get(f"/users/{me}/following?limit=1").get_data(as_text=True)
+            self.assertIn("@user1", html)
+            self.assertNotIn("@user2", html)
+            self.assertIn(f"after={self.ids[1]}", html)
+
+            html = client.get(f"/users/{me}/following?limit=1&after={self.ids[1]}").get_data(as_text=True)
+            self.assertIn("@user2", html)
+            self.assertNotIn("More", html)
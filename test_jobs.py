@@ -0,0 +1,216 @@
+"""Background job tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from time import sleep
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry, Job
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY, principal_cache
+import jobs
+import timeline
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+GENERIC_IMAGE = "https://mylostpetalert.com/wp-content/themes/mlpa-child/images/nophoto.gif"
+
+calls = []
+
+
+@jobs.task
+def record_call(**kwargs):
+    calls.append(kwargs)
+
+
+@jobs.task
+def always_fails():
+    raise RuntimeError("nope")
+
+
+class JobsTestCase(TestCase):
+    """Test queueing and running background jobs."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.drop_all()
+        db.create_all()
+
+        david = User.signup("david", "test@test1.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+        jorge = User.signup("jorge", "test@test2.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+        db.session.add_all([david, jorge])
+        db.session.commit()
+
+        self.david_id = david.id
+        self.jorge_id = jorge.id
+
+        db.session.add(Follows(user_being_followed_id=self.jorge_id,
+                               user_following_id=self.david_id))
+        db.session.commit()
+
+        calls.clear()
+        principal_cache.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_enqueue_and_work_off(self):
+        job_id = jobs.enqueue('record_call', a=1, b="two")
+        db.session.commit()
+
+        self.assertEqual(Job.query.get(job_id).status, 'pending')
+        self.assertEqual(jobs.work_off(), 1)
+
+        self.assertEqual(calls, [dict(a=1, b="two")])
+        job = Job.query.get(job_id)
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_enqueue_by_key_is_idempotent(self):
+        first = jobs.enqueue('record_call', key="once", a=1)
+        second = jobs.enqueue('record_call', key="once", a=2)
+        db.session.commit()
+
+        self.assertEqual(first, second)
+        jobs.work_off()
+        self.assertEqual(calls, [dict(a=1)])
+
+    def test_racing_enqueues_by_key_share_a_job(self):
+        def enqueue_once():
+            with db.engine.begin() as connection:
+                return jobs.enqueue('record_call', key="race", connection=connection, a=2)
+
+        with db.engine.connect() as first:
+            transaction = first.begin()
+            first_id = jobs.enqueue('record_call', key="race", connection=first, a=1)
+
+            # the second one can't see the first job yet, so it gets as far as
+            # inserting, and waits on the first transaction there
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                second = pool.submit(enqueue_once)
+                sleep(0.2)
+                transaction.commit()
+                second_id = second.result()
+
+        self.assertEqual(first_id, second_id)
+        self.assertEqual(Job.query.count(), 1)
+
+    def test_delayed_job_waits(self):
+        jobs.enqueue('record_call', delay=60)
+        db.session.commit()
+
+        self.assertEqual(jobs.work_off(), 0)
+        self.assertEqual(calls, [])
+
+    def test_retries_then_fails(self):
+        job_id = jobs.enqueue('always_fails', max_attempts=2)
+        db.session.commit()
+
+        jobs.work_off()
+        job = Job.query.get(job_id)
+        self.assertEqual(job.status, 'pending')
+        self.assertGreater(job.run_at, datetime.utcnow())
+        self.assertEqual(job.last_error, "RuntimeError: nope")
+
+        # skip the backoff
+        job.run_at = datetime.utcnow()
+        db.session.commit()
+
+        jobs.work_off()
+        job = Job.query.get(job_id)
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(jobs.stats(), {'failed': 1})
+
+    def test_unknown_task_fails(self):
+        job_id = jobs.enqueue('no_such_task', max_attempts=1)
+        db.session.commit()
+
+        jobs.work_off()
+        self.assertIn("no_such_task", Job.query.get(job_id).last_error)
+
+    def test_requeue_stale(self):
+        job_id = jobs.enqueue('record_call')
+        db.session.commit()
+
+        job = jobs.claim('dead-worker')
+        self.assertEqual(job.id, job_id)
+        self.assertIsNone(jobs.claim('other-worker'))
+
+        job.locked_at = datetime.utcnow() - timedelta(hours=1)
+        db.session.commit()
+
+        self.assertEqual(jobs.requeue_stale(stale_after=60), 1)
+        self.assertEqual(jobs.work_off(), 1)
+        self.assertEqual(Job.query.get(job_id).status, 'done')
+
+    def test_worker_burst(self):
+        for i in range(5):
+            jobs.enqueue('record_call', i=i)
+        db.session.commit()
+
+        jobs.Worker(app, concurrency=2).run(burst=True)
+
+        self.assertEqual(sorted(call['i'] for call in calls), list(range(5)))
+        self.assertEqual(jobs.stats(), {'done': 5})
+
+    def test_large_fan_out_is_deferred(self):
+        limit = timeline.FAN_OUT_INLINE_LIMIT
+        timeline.FAN_OUT_INLINE_LIMIT = 0
+        try:
+            db.session.add(Message(text="to my many fans", user_id=self.jorge_id))
+            db.session.commit()
+        finally:
+            timeline.FAN_OUT_INLINE_LIMIT = limit
+
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=self.jorge_id).count(), 1)
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=self.david_id).count(), 0)
+
+        jobs.work_off()
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=self.david_id).count(), 1)
+
+        # running the fan-out again adds nothing
+        msg = Message.query.filter_by(user_id=self.jorge_id).one()
+        timeline.fan_out_to_followers(message_id=msg.id)
+        db.session.commit()
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=self.david_id).count(), 1)
+
+    def test_delete_user_is_deferred(self):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.david_id
+
+            res = client.post("/users/delete")
+            self.assertEqual(res.status_code, 302)
+
+        # locked out at once, purged by the worker
+        self.assertFalse(User.authenticate("david", "HASHED_PASSWORD"))
+        self.assertIsNotNone(User.query.get(self.david_id))
+
+        jobs.work_off()
+
+        self.assertIsNone(User.query.get(self.david_id))
+        self.assertEqual(User.query.get(self.jorge_id).followers_count, 0)
@@ -0,0 +1,73 @@
+"""Bulk loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+
+import csv
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import loader
+import search
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+
+class LoaderTestCase(TestCase):
+    """Test streaming the seed CSVs into the database."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_read_chunks(self):
+        chunks = list(loader.read_chunks('generator/users.csv', chunk_size=128))
+
+        self.assertEqual([len(rows) for _, rows in chunks], [128, 128, 44])
+        self.assertEqual(chunks[0][0][:2], ['email', 'username'])
+
+    def test_load_generator_csvs(self):
+        results = loader.load_csvs('generator', chunk_size=128)
+
+        self.assertEqual({r.table: r.rows for r in results},
+                         {'users': 300, 'messages': 1000, 'follows': 5000})
+        self.assertEqual(User.query.count(), 300)
+        self.assertEqual(Message.query.count(), 1000)
+        self.assertEqual(Follows.query.count(), 5000)
+
+        # indexes and search come back after the load
+        user = User.query.get(1)
+        self.assertIn(user, search.search_users(user.username, 10).items)
+
+    def test_unknown_column(self):
+        directory = tempfile.mkdtemp()
+        with open(os.path.join(directory, 'users.csv'), 'w', newline='') as f:
+            csv.writer(f).writerows([['username', 'shoe_size'], ['david', '9']])
+
+        with self.assertRaises(ValueError):
+            loader.load_table(db.engine, User.__table__,
+                              os.path.join(directory, 'users.csv'))
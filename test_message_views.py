@@ -121,6 +121,46 @@ class MessageViewTestCase(TestCase):
             html = res.get_data(as_text=True)
             self.assertIn("test test", html)
     
+    def test_message_show_not_modified(self):
+        """A repeat view with the ETag gets a 304; an edit changes the ETag"""
+
+        m = Message(id=1000, text="test test", user_id=self.david_id)
+        db.session.add(m)
+        db.session.commit()
+
+        with app.test_client() as client:
+            res = client.get('/messages/1000')
+            etag = res.headers["ETag"]
+            self.assertIn("public", res.headers["Cache-Control"])
+            self.assertIn("Last-Modified", res.headers)
+
+            res = client.get('/messages/1000', headers={"If-None-Match": etag})
+            self.assertEqual(res.status_code, 304)
+            self.assertEqual(res.get_data(), b"")
+
+            Message.query.get(1000).text = "edited"
+            db.session.commit()
+
+            res = client.get('/messages/1000', headers={"If-None-Match": etag})
+            self.assertEqual(res.status_code, 200)
+            self.assertIn("edited", res.get_data(as_text=True))
+
+    def test_message_show_private_when_logged_in(self):
+        m = Message(id=1000, text="test test", user_id=self.david_id)
+        db.session.add(m)
+        db.session.commit()
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.jorge_id
+
+            res = client.get('/messages/1000')
+            self.assertIn("private", res.headers["Cache-Control"])
+
+            # the viewer's ETag differs from the anonymous one
+            anon = app.test_client().get('/messages/1000')
+            self.assertNotEqual(res.headers["ETag"], anon.headers["ETag"])
+
     def test_message_invalid_show(self):
         with app.test_client() as client:
             with client.session_transaction() as sess:
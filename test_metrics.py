@@ -0,0 +1,142 @@
+"""Metrics tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_metrics.py
+
+
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from metrics import Registry
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+GENERIC_IMAGE = "https://mylostpetalert.com/wp-content/themes/mlpa-child/images/nophoto.gif"
+
+# no process has this pid
+DEAD_PID = 2 ** 22 + 1
+
+
+class RegistryTestCase(TestCase):
+    """Test the registry and its exposition format."""
+
+    def setUp(self):
+        self.registry = Registry()
+        self.requests = self.registry.counter('requests_total', "Requests.", ['endpoint'])
+        self.latency = self.registry.histogram('latency_seconds', "Latency.", ['endpoint'],
+                                               buckets=(.1, 1))
+        self.registry.callback('busy', "Busy.", 'gauge', [], lambda: {(): 2})
+
+    def test_exposition(self):
+        self.requests.inc(endpoint='homepage')
+        self.requests.inc(2, endpoint='homepage')
+        for seconds in (0.05, 0.5, 5):
+            self.latency.observe(seconds, endpoint='homepage')
+
+        text = self.registry.exposition()
+
+        self.assertIn("# TYPE requests_total counter", text)
+        self.assertIn('requests_total{endpoint="homepage"} 3\n', text)
+        self.assertIn("# TYPE latency_seconds histogram", text)
+        self.assertIn('latency_seconds_bucket{endpoint="homepage",le="0.1"} 1\n', text)
+        self.assertIn('latency_seconds_bucket{endpoint="homepage",le="1"} 2\n', text)
+        self.assertIn('latency_seconds_bucket{endpoint="homepage",le="+Inf"} 3\n', text)
+        self.assertIn('latency_seconds_count{endpoint="homepage"} 3\n', text)
+        self.assertIn('latency_seconds_sum{endpoint="homepage"} 5.55\n', text)
+        self.assertIn("busy 2\n", text)
+
+    def test_label_escaping(self):
+        self.requests.inc(endpoint='say "hi"\n')
+
+        self.assertIn(r'requests_total{endpoint="say \"hi\"\n"} 1',
+                      self.registry.exposition())
+
+    def test_aggregates_processes(self):
+        """Counters and histograms add up across processes, gauges only
+        across live ones"""
+
+        self.requests.inc(endpoint='homepage')
+        self.latency.observe(0.5, endpoint='homepage')
+
+        directory = tempfile.mkdtemp()
+        with open(os.path.join(directory, f"{DEAD_PID}.json"), 'w') as f:
+            json.dump(self.registry.snapshot(), f)
+
+        text = self.registry.exposition(directory)
+
+        self.assertIn('requests_total{endpoint="homepage"} 2\n', text)
+        self.assertIn('latency_seconds_count{endpoint="homepage"} 2\n', text)
+        self.assertIn("busy 2\n", text)
+
+
+class MetricsViewTestCase(TestCase):
+    """Test the /metrics endpoint."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        david = User.signup("david", "test@test1.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+        db.session.add(david)
+        db.session.commit()
+        self.david_id = david.id
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['METRICS_DIR'] = None
+
+    def test_metrics(self):
+        with app.test_client() as client:
+            client.get(f"/users/{self.david_id}")
+            client.get("/users/999999")
+
+            res = client.get("/metrics")
+            text = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith("text/plain"))
+        self.assertIn('warbler_http_request_duration_seconds_count'
+                      '{endpoint="users_show",method="GET"}', text)
+        self.assertIn('warbler_http_responses_total{endpoint="users_show",status="404"}', text)
+        self.assertIn('warbler_sql_queries_total{endpoint="users_show"}', text)
+        self.assertIn('warbler_db_pool_checked_out{engine="primary"}', text)
+        self.assertIn('warbler_cache_hits_total', text)
+
+    def test_metrics_dir(self):
+        app.config['METRICS_DIR'] = tempfile.mkdtemp()
+
+        with app.test_client() as client:
+            client.get(f"/users/{self.david_id}")
+            res = client.get("/metrics")
+
+        self.assertIn('endpoint="users_show"', res.get_data(as_text=True))
+        self.assertEqual(os.listdir(app.config['METRICS_DIR']), [f"{os.getpid()}.json"])
+
+    def test_login_records_bcrypt_time(self):
+        with app.test_client() as client:
+            client.post("/login", data={"username": "david", "password": "HASHED_PASSWORD"})
+            res = client.get("/metrics")
+
+        self.assertIn('warbler_bcrypt_duration_seconds_count{op="check"}',
+                      res.get_data(as_text=True))
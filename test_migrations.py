@@ -0,0 +1,122 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_migrations.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import inspect
+
+from models import db, User, Message, Likes, SchemaMigration
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import migrations
+import search
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+
+class MigrationsTestCase(TestCase):
+    """Test applying migrations."""
+
+    def setUp(self):
+        db.drop_all()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def index_names(self, table):
+        return {index['name'] for index in inspect(db.engine).get_indexes(table)}
+
+    def likes_key(self):
+        return sorted(inspect(db.engine).get_pk_constraint('likes')['constrained_columns'])
+
+    def test_migrate_is_applied_once(self):
+        versions = [version for version, _, _ in migrations.MIGRATIONS]
+
+        self.assertEqual(migrations.migrate(), versions)
+        self.assertEqual(migrations.pending(), [])
+        self.assertEqual(migrations.migrate(), [])
+        self.assertEqual(sorted(m.version for m in SchemaMigration.query), versions)
+
+    def test_upgrade_from_baseline(self):
+        self.assertEqual(migrations.migrate('0001_baseline'), ['0001_baseline'])
+
+        # data written by the release before migrations
+        with db.engine.begin() as connection:
+            alice, bob = (
+                connection.execute(migrations.users.insert().values(
+                    email=f"{name}@test.com", username=name, password="HASHED_PASSWORD")
+                ).inserted_primary_key[0]
+                for name in ("alice", "bob"))
+            message_id = connection.execute(migrations.messages.insert().values(
+                text="warble", timestamp=datetime.utcnow(), user_id=alice)
+            ).inserted_primary_key[0]
+            connection.execute(migrations.follows.insert().values(
+                user_following_id=bob, user_being_followed_id=alice))
+            connection.execute(migrations.likes.insert().values(
+                user_id=bob, message_id=message_id))
+
+        self.assertEqual(migrations.migrate(),
+                         [version for version, _, _ in migrations.MIGRATIONS[1:]])
+
+        alice_user, bob_user = User.query.get(alice), User.query.get(bob)
+        self.assertEqual((alice_user.messages_count, alice_user.followers_count), (1, 1))
+        self.assertEqual((bob_user.following_count, bob_user.likes_count), (1, 1))
+        self.assertIsNotNone(alice_user.updated_at)
+        self.assertIsNone(alice_user.deleted_at)
+
+        msg = Message.query.get(message_id)
+        self.assertEqual((msg.likes_count, msg.version, msg.trend), (1, 1, None))
+
+        # likes are keyed by (user_id, message_id): more than one user can like a message
+        self.assertEqual(self.likes_key(), ['message_id', 'user_id'])
+        db.session.add(Likes(user_id=alice, message_id=message_id))
+        db.session.commit()
+        self.assertEqual(Likes.query.filter_by(message_id=message_id).count(), 2)
+
+        self.assertEqual([username for _, username, _ in search.autocomplete("ali")], ["alice"])
+        self.assertIn('ix_users_username_c', self.index_names('users'))
+        self.assertIn('ix_users_deleted_at', self.index_names('users'))
+        self.assertIn('ix_messages_trend', self.index_names('messages'))
+        self.assertIn('ix_likes_message_id', self.index_names('likes'))
+
+    def test_migrations_over_create_all_change_nothing(self):
+        db.create_all()
+
+        self.assertEqual(migrations.migrate(),
+                         [version for version, _, _ in migrations.MIGRATIONS])
+        self.assertEqual(self.likes_key(), ['message_id', 'user_id'])
+
+    def test_missing_indexes_are_built(self):
+        migrations.migrate()
+
+        # a database from before the indexes were declared
+        db.session.execute("DROP INDEX ix_messages_user_id_timestamp")
+        db.session.execute("DROP INDEX ix_follows_user_following_id")
+        SchemaMigration.query.filter_by(version='0009_timeline_and_graph_indexes').delete()
+        db.session.commit()
+        self.assertNotIn('ix_messages_user_id_timestamp', self.index_names('messages'))
+
+        self.assertEqual(migrations.migrate(), ['0009_timeline_and_graph_indexes'])
+        self.assertIn('ix_messages_user_id_timestamp', self.index_names('messages'))
+        self.assertIn('ix_follows_user_following_id', self.index_names('follows'))
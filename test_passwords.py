@@ -0,0 +1,97 @@
+"""Password hasher tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+import os
+from threading import Event, Thread
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from passwords import hasher, hash_rounds, PasswordHasher, HasherBusy
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+GENERIC_IMAGE = "https://mylostpetalert.com/wp-content/themes/mlpa-child/images/nophoto.gif"
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test hashing on the bounded pool and rehash on login."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        hasher.configure(rounds=4)
+
+    def tearDown(self):
+        db.session.rollback()
+        hasher.init_app(app)
+
+    def test_hash_and_check(self):
+        pw_hash = hasher.hash("secret")
+
+        self.assertEqual(hash_rounds(pw_hash), 4)
+        self.assertTrue(hasher.check(pw_hash, "secret"))
+        self.assertFalse(hasher.check(pw_hash, "wrong"))
+
+    def test_busy_when_queue_full(self):
+        small = PasswordHasher(rounds=4, workers=1, max_pending=0)
+        started, release = Event(), Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        blocked = Thread(target=small.run, args=(block,))
+        blocked.start()
+        started.wait()
+
+        with self.assertRaises(HasherBusy):
+            small.hash("secret")
+        self.assertEqual(small.stats()["rejected"], 1)
+
+        release.set()
+        blocked.join()
+
+    def test_rehash_on_login(self):
+        david = User.signup("david", "test@test1.com", "secret", GENERIC_IMAGE)
+        db.session.commit()
+        self.assertEqual(hash_rounds(david.password), 4)
+
+        hasher.configure(rounds=5)
+        self.assertFalse(User.authenticate("david", "wrong"))
+        self.assertEqual(hash_rounds(User.query.get(david.id).password), 4)
+
+        self.assertTrue(User.authenticate("david", "secret"))
+        db.session.commit()
+        self.assertEqual(hash_rounds(User.query.get(david.id).password), 5)
+
+    def test_login_view_rehashes(self):
+        User.signup("david", "test@test1.com", "secret", GENERIC_IMAGE)
+        db.session.commit()
+        hasher.configure(rounds=5)
+
+        with app.test_client() as client:
+            res = client.post("/login", data=dict(username="david", password="secret"))
+            self.assertEqual(res.status_code, 302)
+
+        self.assertEqual(hash_rounds(User.query.filter_by(username="david").one().password), 5)
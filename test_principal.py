@@ -0,0 +1,95 @@
+"""Principal cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_principal.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY, principal_cache
+from principal import PrincipalCache
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+GENERIC_IMAGE = "https://mylostpetalert.com/wp-content/themes/mlpa-child/images/nophoto.gif"
+
+
+class PrincipalCacheTestCase(TestCase):
+    """Test the cached request principal."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.drop_all()
+        db.create_all()
+
+        david = User.signup("david", "test@test1.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+        db.session.add(david)
+        db.session.commit()
+
+        self.david_id = david.id
+        principal_cache.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_requests_hit_cache(self):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.david_id
+
+            for i in range(3):
+                res = client.get("/users")
+                self.assertIn("@david", res.get_data(as_text=True))
+
+        stats = principal_cache.stats()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 2)
+
+    def test_unknown_user_not_cached(self):
+        self.assertIsNone(principal_cache.get(1000))
+        self.assertEqual(principal_cache.stats()["size"], 0)
+
+    def test_invalidate(self):
+        self.assertEqual(principal_cache.get(self.david_id).username, "david")
+
+        User.query.get(self.david_id).username = "davey"
+        db.session.commit()
+        self.assertEqual(principal_cache.get(self.david_id).username, "david")
+
+        principal_cache.invalidate(self.david_id)
+        self.assertEqual(principal_cache.get(self.david_id).username, "davey")
+
+    def test_lru_and_ttl(self):
+        cache = PrincipalCache(maxsize=1, ttl=60)
+        jorge = User.signup("jorge", "test@test2.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+        db.session.add(jorge)
+        db.session.commit()
+
+        cache.get(self.david_id)
+        cache.get(jorge.id)
+        self.assertEqual(list(cache.entries), [jorge.id])
+
+        expired = PrincipalCache(ttl=0)
+        expired.get(self.david_id)
+        expired.get(self.david_id)
+        self.assertEqual(expired.stats()["hits"], 0)
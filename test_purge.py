@@ -0,0 +1,182 @@
+"""Account purge tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_purge.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes, TimelineEntry, Job
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import graph
+import jobs
+import purge
+from sqlstats import recording
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+GENERIC_IMAGE = "https://mylostpetalert.com/wp-content/themes/mlpa-child/images/nophoto.gif"
+
+
+class PurgeTestCase(TestCase):
+    """Test deleting an account in batches."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.drop_all()
+        db.create_all()
+
+        users = [User.signup(f"user{i}", f"test{i}@test.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+                 for i in range(4)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.ids = [user.id for user in users]
+        gone, a, b, c = self.ids
+
+        # the user being deleted posts, follows and is followed, likes and is liked
+        msgs = [Message(text=f"warble {i}", user_id=gone) for i in range(5)]
+        other = Message(text="someone else's warble", user_id=a)
+        db.session.add_all(msgs + [other])
+        db.session.commit()
+        self.other_id = other.id
+
+        db.session.add_all(
+            [Follows(user_following_id=follower, user_being_followed_id=gone)
+             for follower in (a, b, c)]
+            + [Follows(user_following_id=gone, user_being_followed_id=a),
+               Follows(user_following_id=b, user_being_followed_id=a)]
+            + [Likes(user_id=liker, message_id=msg.id)
+               for liker in (a, b) for msg in msgs[:3]]
+            + [Likes(user_id=gone, message_id=other.id),
+               Likes(user_id=b, message_id=other.id)])
+        db.session.commit()
+
+        graph.index.load()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def assertPurged(self):
+        gone, a, b, c = self.ids
+
+        self.assertIsNone(User.query.get(gone))
+        self.assertEqual(Message.query.filter_by(user_id=gone).count(), 0)
+        self.assertEqual(Likes.query.filter_by(user_id=gone).count(), 0)
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=gone).count(), 0)
+
+        a_user, b_user, c_user = (User.query.get(user_id) for user_id in (a, b, c))
+        self.assertEqual((a_user.followers_count, a_user.following_count, a_user.likes_count),
+                         (1, 0, 0))
+        self.assertEqual((b_user.following_count, b_user.likes_count), (1, 1))
+        self.assertEqual(c_user.following_count, 0)
+        self.assertEqual(Message.query.get(self.other_id).likes_count, 1)
+
+        self.assertEqual(list(graph.index.follower_ids(a_user)), [b])
+        self.assertFalse(graph.index.is_following(c, gone))
+
+    def test_purge_in_batches(self):
+        self.assertTrue(purge.purge_user(self.ids[0], batch_size=2))
+        self.assertPurged()
+
+    def test_out_of_time(self):
+        self.assertFalse(purge.purge_user(self.ids[0], seconds=0))
+        self.assertIsNotNone(User.query.get(self.ids[0]))
+
+    def test_delete_account_job_carries_on(self):
+        seconds = purge.PURGE_SECONDS
+        purge.PURGE_SECONDS = 0
+        try:
+            jobs.enqueue('delete_account', key=f"delete-account:{self.ids[0]}",
+                         user_id=self.ids[0])
+            db.session.commit()
+            jobs.work_off(limit=1)
+        finally:
+            purge.PURGE_SECONDS = seconds
+
+        pending = Job.query.filter_by(status='pending').all()
+        self.assertEqual([job.key for job in pending], [f"delete-account:{self.ids[0]}:1"])
+
+        jobs.work_off()
+        self.assertPurged()
+
+    def test_user_delete_loads_no_collections(self):
+        gone = self.ids[0]
+        user = User.query.get(gone)
+
+        with recording() as recorder:
+            db.session.delete(user)
+            db.session.commit()
+
+        # the rows go by cascade, not by the ORM loading and deleting them
+        self.assertEqual([statement for statement, _ in recorder.statements
+                          if statement.lstrip().startswith('SELECT')], [])
+        self.assertEqual(Message.query.filter_by(user_id=gone).count(), 0)
+        self.assertEqual(Follows.query.filter_by(user_following_id=gone).count(), 0)
+
+    def test_delete_user_view(self):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ids[0]
+
+            res = client.post("/users/delete")
+            self.assertEqual(res.status_code, 302)
+
+        jobs.work_off()
+        self.assertPurged()
+
+    def test_deleted_account_is_hidden_before_the_purge(self):
+        gone, a, b, c = self.ids
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = gone
+            client.post("/users/delete")
+
+            # any other session of theirs is logged out too
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = gone
+            res = client.get(f"/users/{a}/following")
+            self.assertEqual(res.status_code, 302)
+
+        self.assertIsNotNone(User.query.get(gone).deleted_at)
+        self.assertFalse(User.authenticate("user0", "HASHED_PASSWORD"))
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = a
+
+            self.assertEqual(client.get(f"/users/{gone}").status_code, 404)
+
+            res = client.get("/users/autocomplete?q=user")
+            self.assertNotIn(gone, [user['id'] for user in res.json['users']])
+
+            res = client.get(f"/users/{a}/followers")
+            self.assertIn("@user2", str(res.data))
+            self.assertNotIn("@user0", str(res.data))
+
+            res = client.get("/")
+            self.assertNotIn("warble 0", str(res.data))
+
+        self.assertEqual(User.deleted_ids(), [gone])
+        with app.test_client() as client:
+            res = client.get("/")
+            self.assertNotIn("warble 0", res.get_data(as_text=True))
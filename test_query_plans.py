@@ -0,0 +1,151 @@
+"""Query plan tests: the main views' queries are served by indexes."""
+
+# run these tests like:
+#
+#    python -m unittest test_query_plans.py
+
+
+import os
+from threading import get_ident
+from unittest import TestCase
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import graph
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+GENERIC_IMAGE = "https://mylostpetalert.com/wp-content/themes/mlpa-child/images/nophoto.gif"
+
+
+def selects_run_by(client, url):
+    """[(statement, parameters)] for the SELECTs a GET of `url` runs."""
+
+    selects = []
+    thread = get_ident()
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        # only this request's; not the index threads'
+        if get_ident() == thread and statement.lstrip().upper().startswith('SELECT'):
+            selects.append((statement, parameters))
+
+    event.listen(Engine, 'before_cursor_execute', capture)
+    try:
+        res = client.get(url)
+    finally:
+        event.remove(Engine, 'before_cursor_execute', capture)
+
+    assert res.status_code == 200, res.status_code
+    return selects
+
+
+def plans(selects):
+    """The EXPLAIN output of each of `selects`, with sequential scans disabled.
+
+    The test tables are tiny, so the planner would rightly read them whole.
+    With enable_seqscan off it uses an index wherever one applies, and
+    falls back to a sequential scan only where none does.
+    """
+
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        found = []
+        for statement, parameters in selects:
+            cursor.execute("EXPLAIN " + statement, parameters)
+            found.append("\n".join(row[0] for row in cursor.fetchall()))
+        return found
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+class QueryPlanTestCase(TestCase):
+    """EXPLAIN the queries behind the timeline, profile and follow pages."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.drop_all()
+        db.create_all()
+
+        users = [User.signup(f"user{i}", f"test{i}@test.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+                 for i in range(4)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.ids = [user.id for user in users]
+        me = self.ids[0]
+
+        for user_id in self.ids[1:]:
+            db.session.add_all([Follows(user_following_id=me, user_being_followed_id=user_id),
+                                Follows(user_following_id=user_id, user_being_followed_id=me)])
+        msgs = [Message(text=f"warble {i}", user_id=user_id)
+                for i, user_id in enumerate(self.ids * 3)]
+        db.session.add_all(msgs)
+        db.session.commit()
+
+        db.session.add_all([Likes(user_id=me, message_id=msg.id) for msg in msgs[1::2]])
+        db.session.commit()
+
+        # read follows from the database, not the in-memory index
+        graph.index.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def assertIndexed(self, url, logged_in=True, uses=None):
+        """Every SELECT behind `url` avoids sequential scans; some use `uses`."""
+
+        with app.test_client() as client:
+            if logged_in:
+                with client.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.ids[0]
+            found = plans(selects_run_by(client, url))
+
+        self.assertTrue(found)
+        for plan in found:
+            self.assertNotIn("Seq Scan", plan)
+        self.assertTrue(any("Index" in plan for plan in found))
+        if uses:
+            self.assertTrue(any(uses in plan for plan in found), "\n\n".join(found))
+
+    def test_homepage(self):
+        self.assertIndexed("/", uses="ix_timelines_user_id_timestamp")
+
+    def test_anonymous_homepage(self):
+        self.assertIndexed("/", logged_in=False, uses="ix_messages_timestamp")
+
+    def test_users_show(self):
+        self.assertIndexed(f"/users/{self.ids[1]}", uses="ix_messages_user_id_timestamp")
+
+    def test_show_following(self):
+        self.assertIndexed(f"/users/{self.ids[0]}/following")
+
+    def test_users_followers(self):
+        self.assertIndexed(f"/users/{self.ids[0]}/followers")
+
+    def test_follow_lists_from_the_graph_index(self):
+        graph.index.load()
+
+        self.assertIndexed(f"/users/{self.ids[0]}/following")
+        self.assertIndexed(f"/users/{self.ids[0]}/followers")
@@ -0,0 +1,157 @@
+"""Who-to-follow suggestion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_recommendations.py
+
+
+import os
+from unittest import TestCase
+
+import numpy as np
+
+from models import db, User, Follows, Suggestion
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from graph import Adjacency
+import recommendations
+from recommendations import suggest_for
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+GENERIC_IMAGE = "https://mylostpetalert.com/wp-content/themes/mlpa-child/images/nophoto.gif"
+
+
+def graph_of(edges):
+    pairs = np.array(edges, dtype=np.int32)
+    return Adjacency.from_edges(pairs[:, 0], pairs[:, 1])
+
+
+class ScoringTestCase(TestCase):
+    """Test scoring candidates on an in-memory graph."""
+
+    def test_graph(self):
+        graph = graph_of([(1, 3), (1, 2), (2, 3)])
+
+        self.assertEqual(list(graph.row(1)), [2, 3])
+        self.assertEqual(list(graph.row(3)), [])
+        self.assertEqual(list(graph.row(99)), [])
+        self.assertEqual(graph.edges, 3)
+
+    def test_scores_by_shared_followers(self):
+        # 1 follows 2 and 3; both follow 4, only 3 follows 5
+        graph = graph_of([(1, 2), (1, 3), (2, 4), (3, 4), (3, 5), (2, 1), (3, 2)])
+
+        # 2 is already followed and 1 is the user themselves
+        self.assertEqual(suggest_for(graph, 1), [(4, 2), (5, 1)])
+        self.assertEqual(suggest_for(graph, 4), [])
+
+    def test_limit_breaks_ties_by_id(self):
+        graph = graph_of([(1, 2)] + [(2, user_id) for user_id in range(10, 3, -1)])
+
+        self.assertEqual(suggest_for(graph, 1, limit=3), [(4, 1), (5, 1), (6, 1)])
+
+
+class RecommendTestCase(TestCase):
+    """Test computing, storing and showing suggestions."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.drop_all()
+        db.create_all()
+
+        users = [User.signup(f"user{i}", f"test{i}@test.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+                 for i in range(5)]
+        db.session.add_all(users)
+        db.session.commit()
+
+        self.ids = [user.id for user in users]
+        me, a, b, c, d = self.ids
+
+        for follower, followed in [(me, a), (me, b), (a, c), (b, c), (b, d)]:
+            db.session.add(Follows(user_following_id=follower, user_being_followed_id=followed))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def suggestions(self, user_id):
+        return [(s.suggested_id, s.score)
+                for s in Suggestion.query.filter_by(user_id=user_id)
+                                         .order_by(Suggestion.score.desc(),
+                                                   Suggestion.suggested_id)]
+
+    def test_recommend(self):
+        me, a, b, c, d = self.ids
+
+        result = recommendations.recommend(workers=1, chunk_size=2)
+
+        self.assertEqual(result.edges, 5)
+        self.assertEqual(self.suggestions(me), [(c, 2), (d, 1)])
+        self.assertEqual(self.suggestions(a), [])
+
+        # stale suggestions are replaced
+        Follows.query.filter_by(user_following_id=me, user_being_followed_id=b).delete()
+        db.session.commit()
+        recommendations.recommend(workers=1)
+        self.assertEqual(self.suggestions(me), [(c, 1)])
+
+    def test_recommend_in_parallel(self):
+        me = self.ids[0]
+
+        recommendations.recommend(workers=2, chunk_size=1)
+
+        self.assertEqual(len(self.suggestions(me)), 2)
+
+    def test_recommend_some_users(self):
+        me, a, b, c, d = self.ids
+        db.session.add(Follows(user_following_id=a, user_being_followed_id=b))
+        db.session.commit()
+
+        recommendations.recommend([a], workers=1)
+
+        self.assertEqual(self.suggestions(a), [(d, 1)])
+        self.assertEqual(self.suggestions(me), [])
+
+    def test_suggested_users_skips_followed(self):
+        me, a, b, c, d = self.ids
+        recommendations.recommend(workers=1)
+
+        self.assertEqual([user.id for user in recommendations.suggested_users(me)], [c, d])
+
+        db.session.add(Follows(user_following_id=me, user_being_followed_id=c))
+        db.session.commit()
+        self.assertEqual([user.id for user in recommendations.suggested_users(me)], [d])
+
+    def test_shown_on_homepage_and_users(self):
+        recommendations.recommend(workers=1)
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ids[0]
+
+            html = client.get("/").get_data(as_text=True)
+            self.assertIn("Who to follow", html)
+            self.assertIn("@user3", html)
+
+            html = client.get("/users").get_data(as_text=True)
+            self.assertIn("Who to follow", html)
+
+            html = client.get("/users?q=user").get_data(as_text=True)
+            self.assertNotIn("Who to follow", html)
@@ -0,0 +1,154 @@
+"""Read-replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_replicas.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY, principal_cache
+from replicas import router, PIN_KEY
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+GENERIC_IMAGE = "https://mylostpetalert.com/wp-content/themes/mlpa-child/images/nophoto.gif"
+
+# the "replica" is a SQLite file, brought up to date by hand with catch_up()
+REPLICA_URI = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'replica.db')}"
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Test sending reads to replicas."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.drop_all()
+        db.create_all()
+
+        david = User.signup("david", "test@test1.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+        db.session.add(david)
+        db.session.flush()
+        db.session.add(Message(text="first warble", user_id=david.id))
+        db.session.commit()
+
+        self.david_id = david.id
+        principal_cache.clear()
+
+        self.replica = create_engine(REPLICA_URI)
+        self.catch_up()
+
+        app.config['SQLALCHEMY_REPLICA_URIS'] = [REPLICA_URI]
+        router.reset_stats()
+
+    def tearDown(self):
+        app.config['SQLALCHEMY_REPLICA_URIS'] = []
+        db.session.rollback()
+        self.replica.dispose()
+
+    def catch_up(self):
+        """Copy the primary over the replica.
+
+        Reads `db.engine` itself: inside a test client's request the routed
+        session would read the replica.
+        """
+
+        db.metadata.drop_all(bind=self.replica)
+        db.metadata.create_all(bind=self.replica)
+        with db.engine.connect() as primary, self.replica.begin() as conn:
+            for table in db.metadata.sorted_tables:
+                rows = [dict(row) for row in primary.execute(table.select())]
+                if rows:
+                    conn.execute(table.insert(), rows)
+
+    def test_reads_go_to_replica(self):
+        db.session.add(Message(text="not replicated yet", user_id=self.david_id))
+        db.session.commit()
+
+        with app.test_client() as client:
+            res = client.get(f"/users/{self.david_id}")
+            html = res.get_data(as_text=True)
+
+            self.assertIn("first warble", html)
+            self.assertNotIn("not replicated yet", html)
+
+        queries = router.stats()['queries']
+        self.assertGreater(queries['replica0'], 0)
+
+    def test_writes_pin_to_primary(self):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.david_id
+
+            res = client.post("/messages/new", data={"text": "fresh warble"})
+            self.assertEqual(res.status_code, 302)
+
+            # the replica hasn't seen it, but the author reads the primary
+            res = client.get(f"/users/{self.david_id}")
+            self.assertIn("fresh warble", res.get_data(as_text=True))
+
+            with client.session_transaction() as sess:
+                sess[PIN_KEY] = 0
+
+            res = client.get(f"/users/{self.david_id}")
+            self.assertNotIn("fresh warble", res.get_data(as_text=True))
+
+            self.catch_up()
+            res = client.get(f"/users/{self.david_id}")
+            self.assertIn("fresh warble", res.get_data(as_text=True))
+
+    def test_other_visitors_read_replica_after_write(self):
+        with app.test_client() as author:
+            with author.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.david_id
+            author.post("/messages/new", data={"text": "fresh warble"})
+
+        with app.test_client() as client:
+            res = client.get(f"/users/{self.david_id}")
+            self.assertNotIn("fresh warble", res.get_data(as_text=True))
+
+    def test_per_engine_counts(self):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.david_id
+
+            client.post("/messages/new", data={"text": "fresh warble"})
+            queries = router.stats()['queries']
+            self.assertGreater(queries['primary'], 0)
+            self.assertNotIn('replica0', queries)
+
+            with client.session_transaction() as sess:
+                sess[PIN_KEY] = 0
+            client.get(f"/users/{self.david_id}")
+            self.assertGreater(router.stats()['queries']['replica0'], 0)
+
+    def test_no_replicas_uses_primary(self):
+        app.config['SQLALCHEMY_REPLICA_URIS'] = []
+        db.session.add(Message(text="not replicated yet", user_id=self.david_id))
+        db.session.commit()
+
+        with app.test_client() as client:
+            res = client.get(f"/users/{self.david_id}")
+            self.assertIn("not replicated yet", res.get_data(as_text=True))
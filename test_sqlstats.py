@@ -0,0 +1,96 @@
+"""SQL instrumentation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_sqlstats.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import text
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from sqlstats import recording, assert_max_queries, statement_shape
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+GENERIC_IMAGE = "https://mylostpetalert.com/wp-content/themes/mlpa-child/images/nophoto.gif"
+
+
+class SQLStatsTestCase(TestCase):
+    """Test per-request query counting and N+1 detection."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        david = User.signup("david", "test@test1.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+        db.session.add(david)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_server_timing_header(self):
+        with app.test_client() as client:
+            res = client.get("/users")
+
+            timing = res.headers.getlist("Server-Timing")
+            self.assertTrue(timing[0].startswith("db;dur="))
+            self.assertIn("queries", timing[0])
+            self.assertTrue(timing[1].startswith("app;dur="))
+
+    def test_repeated_shapes(self):
+        with recording() as recorder:
+            for i in range(6):
+                db.session.execute(text("SELECT :n"), {"n": i})
+            db.session.execute(text("SELECT 1"))
+
+        self.assertEqual(recorder.count, 7)
+        [(shape, count)] = recorder.repeated(5)
+        self.assertEqual(count, 6)
+        self.assertNotIn("SELECT 1", shape)
+
+    def test_statement_shape(self):
+        self.assertEqual(
+            statement_shape("SELECT * FROM users WHERE id IN (%(id_1)s,\n %(id_2)s)"),
+            "SELECT * FROM users WHERE id IN (...)")
+
+    def test_assert_max_queries(self):
+        with assert_max_queries(1):
+            User.query.first()
+
+        with self.assertRaises(AssertionError):
+            with assert_max_queries(1):
+                User.query.first()
+                User.query.count()
+
+    def test_failed_statement_leaves_no_start_time(self):
+        with recording() as recorder:
+            with self.assertRaises(Exception):
+                db.session.execute(text("SELECT * FROM no_such_table"))
+            db.session.rollback()
+
+            connection = db.session.connection()
+            self.assertFalse(connection.info.get('query_started'))
+            db.session.execute(text("SELECT 1"))
+
+        self.assertEqual(recorder.count, 1)
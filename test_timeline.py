@@ -0,0 +1,128 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timeline.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import timeline
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+GENERIC_IMAGE = "https://mylostpetalert.com/wp-content/themes/mlpa-child/images/nophoto.gif"
+
+
+class TimelineTestCase(TestCase):
+    """Test the precomputed home timelines."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.drop_all()
+        db.create_all()
+
+        david = User.signup("david", "test@test1.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+        jorge = User.signup("jorge", "test@test2.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+
+        db.session.add_all([david, jorge])
+        db.session.commit()
+
+        self.david_id = david.id
+        self.jorge_id = jorge.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def timeline_ids(self, user_id):
+        return [m.id for m in timeline.get_timeline(user_id).items]
+
+    def test_own_message_on_timeline(self):
+        m = Message(text="mine", user_id=self.david_id)
+        db.session.add(m)
+        db.session.commit()
+
+        self.assertEqual(self.timeline_ids(self.david_id), [m.id])
+        self.assertEqual(self.timeline_ids(self.jorge_id), [])
+
+    def test_fan_out_to_followers(self):
+        db.session.add(Follows(user_being_followed_id=self.david_id,
+                               user_following_id=self.jorge_id))
+        db.session.commit()
+
+        m = Message(text="hello followers", user_id=self.david_id)
+        db.session.add(m)
+        db.session.commit()
+
+        self.assertEqual(self.timeline_ids(self.jorge_id), [m.id])
+
+        db.session.delete(m)
+        db.session.commit()
+
+        self.assertEqual(self.timeline_ids(self.jorge_id), [])
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        m = Message(text="before the follow", user_id=self.david_id)
+        db.session.add(m)
+        db.session.commit()
+        message_id = m.id
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.jorge_id
+
+            client.post(f"/users/follow/{self.david_id}")
+            self.assertEqual(self.timeline_ids(self.jorge_id), [message_id])
+
+            res = client.get("/")
+            self.assertIn("before the follow", res.get_data(as_text=True))
+
+            client.post(f"/users/stop-following/{self.david_id}")
+            self.assertEqual(self.timeline_ids(self.jorge_id), [])
+
+    def test_rebuild(self):
+        db.session.add(Follows(user_being_followed_id=self.david_id,
+                               user_following_id=self.jorge_id))
+        m = Message(text="rebuilt", user_id=self.david_id)
+        db.session.add(m)
+        db.session.commit()
+
+        TimelineEntry.query.delete()
+        db.session.commit()
+
+        self.assertEqual(timeline.rebuild_all(), 2)
+        self.assertEqual(self.timeline_ids(self.jorge_id), [m.id])
+        self.assertEqual(self.timeline_ids(self.david_id), [m.id])
+
+    def test_trim(self):
+        db.session.add(Follows(user_being_followed_id=self.david_id,
+                               user_following_id=self.jorge_id))
+        msgs = [Message(text=f"warble {i}", user_id=self.david_id) for i in range(5)]
+        db.session.add_all(msgs)
+        db.session.commit()
+        newest = sorted(msgs, key=lambda m: (m.timestamp, m.id), reverse=True)[:3]
+
+        self.assertEqual(timeline.trim_all(limit=3), 2)
+        self.assertEqual(self.timeline_ids(self.jorge_id), [m.id for m in newest])
+        self.assertEqual(timeline.trim_all(limit=3), 0)
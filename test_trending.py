@@ -0,0 +1,180 @@
+"""Trending message tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import likes
+import trending
+
+app.config['SQLALCHEMY_ECHO'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+GENERIC_IMAGE = "https://mylostpetalert.com/wp-content/themes/mlpa-child/images/nophoto.gif"
+
+
+class ScoreTestCase(TestCase):
+    """Test the decayed score arithmetic."""
+
+    def test_decay(self):
+        now = datetime(2026, 1, 1)
+        trend = trending.combine(None, trending.weight(now), 2.0)
+
+        self.assertAlmostEqual(trending.score(trend, now), 2.0)
+        self.assertAlmostEqual(trending.score(trend, now + timedelta(seconds=trending.MEAN_LIFE)),
+                               2.0 / 2.718281828459045)
+
+    def test_unlike_never_goes_negative(self):
+        now = datetime(2026, 1, 1)
+        trend = trending.combine(None, trending.weight(now), 1.0)
+
+        self.assertIsNone(trending.combine(trend, trending.weight(now), -1.0))
+        self.assertIsNone(trending.combine(trend, trending.weight(now), -3.0))
+        self.assertIsNone(trending.combine(None, trending.weight(now), -1.0))
+
+
+class TrendingTestCase(TestCase):
+    """Test keeping and serving trending messages."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.drop_all()
+        db.create_all()
+
+        users = [User.signup(f"user{i}", f"test{i}@test.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+                 for i in range(3)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.user_ids = [user.id for user in users]
+
+        msgs = [Message(text=f"warble {i}", user_id=self.user_ids[0]) for i in range(3)]
+        db.session.add_all(msgs)
+        db.session.commit()
+        self.msg_ids = [msg.id for msg in msgs]
+
+        trending.index.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def like(self, user_index, msg_index):
+        likes.toggle_like(self.user_ids[user_index], self.msg_ids[msg_index])
+        db.session.commit()
+
+    def trending_ids(self, limit=10, after=None):
+        return [msg.id for msg in trending.trending_page(limit, after).items]
+
+    def test_likes_rank_messages(self):
+        self.like(0, 1)
+        self.like(1, 1)
+        self.like(0, 2)
+
+        # nothing moves until the pending likes are flushed
+        self.assertEqual(self.trending_ids(), [])
+        trending.index.flush()
+
+        self.assertEqual(self.trending_ids(), [self.msg_ids[1], self.msg_ids[2]])
+        self.assertAlmostEqual(trending.score(Message.query.get(self.msg_ids[1]).trend), 2.0,
+                               places=2)
+
+    def test_older_likes_count_less(self):
+        long_ago = datetime.utcnow() - timedelta(days=3)
+        for _ in range(3):
+            trending.index.add(self.msg_ids[0], 1, when=long_ago)
+        trending.index.add(self.msg_ids[1], 1)
+        trending.index.flush()
+
+        self.assertEqual(self.trending_ids(), [self.msg_ids[1], self.msg_ids[0]])
+
+    def test_unlike(self):
+        self.like(0, 0)
+        trending.index.flush()
+        self.assertEqual(self.trending_ids(), [self.msg_ids[0]])
+
+        self.like(0, 0)
+        trending.index.flush()
+        self.assertEqual(self.trending_ids(), [])
+        self.assertIsNone(Message.query.get(self.msg_ids[0]).trend)
+
+    def test_rolled_back_likes_are_dropped(self):
+        likes.add_like(self.user_ids[0], self.msg_ids[0])
+        db.session.rollback()
+
+        trending.index.flush()
+        self.assertEqual(self.trending_ids(), [])
+
+    def test_failed_flush_keeps_likes(self):
+        self.like(0, 1)
+
+        with patch.object(trending, 'combine', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                trending.index.flush()
+        self.assertIsNone(Message.query.get(self.msg_ids[1]).trend)
+
+        trending.index.flush()
+        self.assertEqual(self.trending_ids(), [self.msg_ids[1]])
+
+    def test_pages(self):
+        for msg_index in range(3):
+            for user_index in range(msg_index + 1):
+                self.like(user_index, msg_index)
+        trending.index.flush()
+
+        page = trending.trending_page(2)
+        self.assertEqual([msg.id for msg in page.items], [self.msg_ids[2], self.msg_ids[1]])
+        self.assertEqual(self.trending_ids(2, page.next_cursor), [self.msg_ids[0]])
+
+    def test_rebuild(self):
+        old, new = Message.query.get(self.msg_ids[0]), Message.query.get(self.msg_ids[1])
+        old.timestamp = datetime.utcnow() - timedelta(days=2)
+        old.likes_count = new.likes_count = 2
+        db.session.commit()
+
+        self.assertEqual(trending.rebuild(batch_size=2), 3)
+        self.assertEqual(self.trending_ids(), [self.msg_ids[1], self.msg_ids[0]])
+
+    def test_trending_views(self):
+        self.like(0, 2)
+        trending.index.flush()
+
+        with app.test_client() as client:
+            html = client.get("/").get_data(as_text=True)
+            self.assertIn('id="trending"', html)
+            self.assertIn("warble 2", html)
+
+            res = client.get("/trending")
+            self.assertEqual(res.status_code, 200)
+            self.assertIn("warble 2", res.get_data(as_text=True))
+
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_ids[1]
+
+            res = client.post(f"/users/add_like/{self.msg_ids[0]}")
+            self.assertEqual(res.status_code, 302)
+
+        trending.index.flush()
+        self.assertEqual(self.trending_ids(), [self.msg_ids[0], self.msg_ids[2]])
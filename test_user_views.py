@@ -6,6 +6,8 @@
 
 
 import os
+import re
+from datetime import datetime
 from unittest import TestCase
 # added from solution
 from sqlalchemy import exc
@@ -23,6 +25,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 # Now we can import app
 
 from app import app, CURR_USER_KEY
+from sqlstats import assert_max_queries, recording
 
 app.config['SQLALCHEMY_ECHO'] = False
 # Create our tables (we do this here, so we only create the tables
@@ -90,6 +93,45 @@ class UserViewTestCase(TestCase):
             self.assertIn("@david", html)
     
     # TESTING users route
+
+    def test_users_route_paginated(self):
+        """Users listing pages by id with an 'after' cursor"""
+        with app.test_client() as client:
+            res = client.get("/users?limit=1")
+            html = res.get_data(as_text=True)
+
+            self.assertIn("@david", html)
+            self.assertNotIn("@jorge", html)
+            self.assertIn(f"after={self.david_id}", html)
+
+            res = client.get(f"/users?limit=1&after={self.david_id}")
+            html = res.get_data(as_text=True)
+
+            self.assertIn("@jorge", html)
+            self.assertNotIn("More users", html)
+
+    def test_users_show_paginated(self):
+        """Profile messages page newest first with a 'before' cursor"""
+        for day in range(1, 4):
+            db.session.add(Message(text=f"message {day}", user_id=self.david_id,
+                                   timestamp=datetime(2020, 1, day)))
+        db.session.commit()
+
+        with app.test_client() as client:
+            res = client.get(f"/users/{self.david_id}?limit=2")
+            html = res.get_data(as_text=True)
+
+            self.assertIn("message 3", html)
+            self.assertIn("message 2", html)
+            self.assertNotIn("message 1", html)
+
+            cursor = re.search(r'before=([0-9.]+)', html).group(1)
+            res = client.get(f"/users/{self.david_id}?limit=2&before={cursor}")
+            html = res.get_data(as_text=True)
+
+            self.assertIn("message 1", html)
+            self.assertNotIn("message 2", html)
+            self.assertNotIn("Older", html)
     
     def test_users_route(self):
         """Testiing users route as logged in"""
@@ -103,6 +145,35 @@ class UserViewTestCase(TestCase):
             self.assertIn("@david", html)
             self.assertIn("@jorge", html)
     
+    def test_users_route_query_budget(self):
+        """Listing and profile pages issue a bounded number of queries"""
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.jorge_id
+
+            with assert_max_queries(4):
+                client.get("/users")
+
+            with assert_max_queries(6):
+                client.get(f"/users/{self.david_id}")
+
+    def test_users_route_follow_state(self):
+        """Users listing shows Unfollow only for followed users"""
+        db.session.add(Follows(user_being_followed_id=self.jorge_id,
+                               user_following_id=self.david_id))
+        db.session.commit()
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.david_id
+
+            res = client.get("/users")
+            html = res.get_data(as_text=True)
+
+            self.assertIn(f"/users/stop-following/{self.jorge_id}", html)
+            self.assertIn(f"/users/follow/{self.david_id}", html)
+            self.assertNotIn(f"/users/follow/{self.jorge_id}", html)
+
     def test_users_search_route(self):
         """Testing search routes"""
         with app.test_client() as client:
@@ -115,6 +186,36 @@ class UserViewTestCase(TestCase):
             self.assertIn("@david", html)
             self.assertNotIn("@jorge", html)
     
+    def test_users_search_bio_and_location(self):
+        """Search matches bio and location as well as username"""
+        jorge = User.query.get(self.jorge_id)
+        jorge.bio = "Loves tacos"
+        jorge.location = "San Diego"
+        db.session.commit()
+
+        with app.test_client() as client:
+            html = client.get("/users?q=taco").get_data(as_text=True)
+            self.assertIn("@jorge", html)
+            self.assertNotIn("@david", html)
+
+            html = client.get("/users?q=diego").get_data(as_text=True)
+            self.assertIn("@jorge", html)
+
+            html = client.get("/users?q=da").get_data(as_text=True)
+            self.assertIn("@david", html)
+            self.assertNotIn("@jorge", html)
+
+    def test_users_autocomplete(self):
+        """Autocomplete returns username prefix matches as JSON"""
+        with app.test_client() as client:
+            res = client.get("/users/autocomplete?q=jo")
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual([u["username"] for u in res.json["users"]], ["jorge"])
+
+            res = client.get("/users/autocomplete?q=zz")
+            self.assertEqual(res.json["users"], [])
+
     def test_users_userid_route(self):
         """ Testing users show route as user and not user"""
         with app.test_client() as client:
@@ -221,6 +322,23 @@ class UserViewTestCase(TestCase):
             
             self.assertEqual(len(toggle_like), 0)
     
+    def test_two_users_like_same_message(self):
+        """Likes are keyed per user, so a message can have many likes"""
+        m1 = Message(id=600, text="popular", user_id=self.david_id)
+        db.session.add(m1)
+        db.session.commit()
+
+        for user_id in (self.david_id, self.jorge_id):
+            with app.test_client() as client:
+                with client.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = user_id
+
+                res = client.post("/users/add_like/600")
+                self.assertEqual(res.status_code, 302)
+
+        self.assertEqual(Likes.query.filter(Likes.message_id == 600).count(), 2)
+        self.assertEqual(Message.query.get(600).likes_count, 2)
+
     def test_unauth_like(self):
         m1 = Message(id=500, text="test test", user_id=self.david_id)
         
@@ -267,6 +385,28 @@ class UserViewTestCase(TestCase):
             self.assertIn('following"\n                >1', html)
             self.assertIn('followers"\n                >1', html)
       
+    def test_user_show_not_modified(self):
+        """Profile ETags change when the user's activity marker does"""
+
+        with app.test_client() as client:
+            res = client.get(f"/users/{self.david_id}")
+            etag = res.headers["ETag"]
+
+            res = client.get(f"/users/{self.david_id}", headers={"If-None-Match": etag})
+            self.assertEqual(res.status_code, 304)
+
+            # another page of the same profile is another resource
+            res = client.get(f"/users/{self.david_id}?limit=1", headers={"If-None-Match": etag})
+            self.assertEqual(res.status_code, 200)
+            self.assertNotEqual(res.headers["ETag"], etag)
+
+            # a new follower bumps david's followers_count, and so updated_at
+            self.setup_followers()
+
+            res = client.get(f"/users/{self.david_id}", headers={"If-None-Match": etag})
+            self.assertEqual(res.status_code, 200)
+            self.assertNotEqual(res.headers["ETag"], etag)
+
     def test_show_following_and_followers(self):
 
         self.setup_followers()
@@ -307,4 +447,65 @@ class UserViewTestCase(TestCase):
             self.assertEqual(res.status_code, 200)
             html = res.get_data(as_text=True)
 
-            self.assertIn("Access unauthorized", html)
\ No newline at end of file
+            self.assertIn("Access unauthorized", html)
+
+    # TESTING QUERY PLANS
+
+    def add_crowd(self, n, start=0):
+        """`n` more users who each post a message, follow david, are followed
+        by david and have their message liked by him"""
+
+        for i in range(start, start + n):
+            user = User.signup(f"crowd{i}", f"crowd{i}@test.com", "HASHED_PASSWORD", GENERIC_IMAGE)
+            db.session.add(user)
+            db.session.flush()
+
+            msg = Message(text=f"crowd message {i}", user_id=user.id)
+            db.session.add(msg)
+            db.session.flush()
+
+            db.session.add_all([
+                Follows(user_being_followed_id=user.id, user_following_id=self.david_id),
+                Follows(user_being_followed_id=self.david_id, user_following_id=user.id),
+                Likes(user_id=self.david_id, message_id=msg.id),
+            ])
+        db.session.commit()
+
+    def query_count(self, client, url):
+        with recording() as recorder:
+            res = client.get(url)
+        self.assertEqual(res.status_code, 200)
+        return recorder.count
+
+    def test_query_count_independent_of_page_size(self):
+        """Timelines load message authors eagerly, whatever the page size"""
+
+        self.add_crowd(10)
+
+        with app.test_client() as client:
+            self.assertEqual(self.query_count(client, "/?limit=2"),
+                             self.query_count(client, "/?limit=10"))
+
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.david_id
+
+            self.assertEqual(self.query_count(client, "/?limit=2"),
+                             self.query_count(client, "/?limit=10"))
+
+    def test_query_count_independent_of_collection_size(self):
+        """Follow lists and likes load their users and messages eagerly"""
+
+        self.add_crowd(2)
+        urls = [f"/users/{self.david_id}/following",
+                f"/users/{self.david_id}/followers",
+                f"/users/{self.david_id}/likes"]
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.david_id
+
+            few = [self.query_count(client, url) for url in urls]
+            self.add_crowd(8, start=2)
+            many = [self.query_count(client, url) for url in urls]
+
+        self.assertEqual(few, many)
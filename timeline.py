@@ -0,0 +1,278 @@
+"""Precomputed (fan-out-on-write) home timelines for Warbler.
+
+Every message id is pushed into the `timelines` table for its author and
+each of the author's followers when it is written, so reading the home page
+is one bounded range scan on (user_id, timestamp) instead of an IN query
+over everyone the user follows.
+
+The mapper events below keep the table current for ORM writes of `Message`
+and `Follows` rows. Bulk writes that bypass the ORM should call the helpers
+directly or run `flask rebuild-timelines` afterwards.
+
+A message by an author with more than FAN_OUT_INLINE_LIMIT followers only
+reaches the author's own timeline inline; a background job (see jobs.py)
+pushes it to the followers, so posting doesn't wait on thousands of inserts.
+
+Timelines are kept to TIMELINE_MAX_LENGTH entries. A backfill or a push to
+the author trims that one timeline on the spot; fanning out to followers
+doesn't, since it would mean a trim per follower per message, so their
+timelines can run over until `trim_all` (`flask trim-timelines`, run
+periodically) cuts them back.
+"""
+
+from sqlalchemy import event, func, select, literal, and_, not_, exists, or_
+
+from models import db, Follows, Message, TimelineEntry, User
+from pagination import paginate_newest_first
+import jobs
+
+# How many of a followed user's recent messages are copied into a follower's
+# timeline when they start following, and how long a timeline is kept.
+BACKFILL_LENGTH = 100
+TIMELINE_MAX_LENGTH = 800
+
+# Followers past which a new message is fanned out by a job, not inline.
+FAN_OUT_INLINE_LIMIT = 1000
+
+timelines = TimelineEntry.__table__
+messages = Message.__table__
+follows = Follows.__table__
+
+
+def push_to_author(connection, message_id):
+    """Push `message_id` onto its author's timeline."""
+
+    author = (select([messages.c.user_id.label('user_id'),
+                      messages.c.id,
+                      messages.c.timestamp])
+              .where(messages.c.id == message_id))
+
+    connection.execute(timelines.insert().from_select(
+        ['user_id', 'message_id', 'timestamp'], author))
+
+    author_id = select([messages.c.user_id]).where(messages.c.id == message_id)
+    trim_timeline(connection, connection.execute(author_id).scalar())
+
+
+def push_to_followers(connection, message_id):
+    """Push `message_id` onto the timelines of its author's followers.
+
+    Followers who already have it (say, from a backfill) are skipped, so
+    this can run again after a failed attempt.
+    """
+
+    already_there = exists().where(and_(
+        timelines.c.user_id == follows.c.user_following_id,
+        timelines.c.message_id == messages.c.id))
+
+    followers = (select([follows.c.user_following_id.label('user_id'),
+                         messages.c.id,
+                         messages.c.timestamp])
+                 .select_from(follows.join(
+                     messages,
+                     messages.c.user_id == follows.c.user_being_followed_id))
+                 .where(messages.c.id == message_id)
+                 .where(not_(already_there)))
+
+    connection.execute(timelines.insert().from_select(
+        ['user_id', 'message_id', 'timestamp'], followers))
+
+
+def fan_out_message(connection, message_id):
+    """Push `message_id` onto its author's and the author's followers' timelines."""
+
+    push_to_author(connection, message_id)
+    push_to_followers(connection, message_id)
+
+
+@jobs.task
+def fan_out_to_followers(message_id):
+    """Push a message by an author with many followers to their timelines."""
+
+    push_to_followers(db.session.connection(), message_id)
+
+
+def remove_message(connection, message_id):
+    """Remove `message_id` from every timeline it was pushed to."""
+
+    connection.execute(
+        timelines.delete().where(timelines.c.message_id == message_id))
+
+
+def backfill_follow(connection, follower_id, followed_id, limit=BACKFILL_LENGTH):
+    """Copy the newest messages of `followed_id` into `follower_id`'s timeline."""
+
+    already_there = exists().where(and_(
+        timelines.c.user_id == follower_id,
+        timelines.c.message_id == messages.c.id))
+
+    recent = (select([literal(follower_id).label('user_id'),
+                      messages.c.id,
+                      messages.c.timestamp])
+              .where(messages.c.user_id == followed_id)
+              .where(not_(already_there))
+              .order_by(messages.c.timestamp.desc())
+              .limit(limit))
+
+    connection.execute(timelines.insert().from_select(
+        ['user_id', 'message_id', 'timestamp'], recent))
+    trim_timeline(connection, follower_id)
+
+
+def trim_timeline(connection, user_id, limit=TIMELINE_MAX_LENGTH):
+    """Drop all but the newest `limit` entries of `user_id`'s timeline."""
+
+    oldest_dropped = connection.execute(
+        select([timelines.c.timestamp, timelines.c.message_id])
+        .where(timelines.c.user_id == user_id)
+        .order_by(timelines.c.timestamp.desc(), timelines.c.message_id.desc())
+        .offset(limit)
+        .limit(1)).first()
+    if oldest_dropped is None:
+        return
+
+    timestamp, message_id = oldest_dropped
+    connection.execute(timelines.delete()
+                       .where(timelines.c.user_id == user_id)
+                       .where(or_(timelines.c.timestamp < timestamp,
+                                  and_(timelines.c.timestamp == timestamp,
+                                       timelines.c.message_id <= message_id))))
+
+
+def trim_all(batch_size=500, limit=TIMELINE_MAX_LENGTH):
+    """Trim every timeline longer than `limit`, committing per batch.
+
+    Returns the number of timelines trimmed.
+    """
+
+    too_long = [user_id for (user_id,) in
+                db.session.query(TimelineEntry.user_id)
+                .group_by(TimelineEntry.user_id)
+                .having(func.count() > limit)
+                .order_by(TimelineEntry.user_id)]
+    db.session.commit()
+
+    for start in range(0, len(too_long), batch_size):
+        connection = db.session.connection()
+        for user_id in too_long[start:start + batch_size]:
+            trim_timeline(connection, user_id, limit)
+        db.session.commit()
+
+    return len(too_long)
+
+
+def remove_follow(connection, follower_id, followed_id):
+    """Drop messages by `followed_id` from `follower_id`'s timeline."""
+
+    authored = select([messages.c.id]).where(messages.c.user_id == followed_id)
+
+    connection.execute(
+        timelines.delete()
+        .where(timelines.c.user_id == follower_id)
+        .where(timelines.c.message_id.in_(authored)))
+
+
+def rebuild_timeline(connection, user_id, limit=TIMELINE_MAX_LENGTH):
+    """Recompute `user_id`'s timeline from the follows and messages tables."""
+
+    followed = (select([follows.c.user_being_followed_id])
+                .where(follows.c.user_following_id == user_id))
+
+    newest = (select([literal(user_id).label('user_id'),
+                      messages.c.id,
+                      messages.c.timestamp])
+              .where((messages.c.user_id == user_id)
+                     | messages.c.user_id.in_(followed))
+              .order_by(messages.c.timestamp.desc())
+              .limit(limit))
+
+    connection.execute(timelines.delete().where(timelines.c.user_id == user_id))
+    connection.execute(timelines.insert().from_select(
+        ['user_id', 'message_id', 'timestamp'], newest))
+
+
+def rebuild_all(batch_size=500, user_ids=None):
+    """Rebuild timelines for `user_ids` (default: every user), committing per batch.
+
+    Returns the number of timelines rebuilt.
+    """
+
+    query = db.session.query(User.id).order_by(User.id)
+    if user_ids:
+        query = query.filter(User.id.in_(user_ids))
+
+    rebuilt = 0
+    last_id = 0
+
+    while True:
+        batch = [uid for (uid,) in query.filter(User.id > last_id).limit(batch_size)]
+        if not batch:
+            break
+
+        connection = db.session.connection()
+        for uid in batch:
+            rebuild_timeline(connection, uid)
+        db.session.commit()
+
+        rebuilt += len(batch)
+        last_id = batch[-1]
+
+    return rebuilt
+
+
+def get_timeline(user_id, limit=100, before=None, options=()):
+    """Return a `Page` of `user_id`'s home timeline, newest first.
+
+    `before` is the cursor of the previous page (see pagination.py);
+    `options` are loader options for the messages, e.g. to eager-load authors.
+    """
+
+    query = (Message
+             .query
+             .options(*options)
+             .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+             .filter(TimelineEntry.user_id == user_id)
+             # entries of a deleted author linger until the purge reaches them
+             .filter(Message.by_live_authors()))
+
+    return paginate_newest_first(query,
+                                 TimelineEntry.timestamp,
+                                 TimelineEntry.message_id,
+                                 before, limit)
+
+
+##############################################################################
+# Keep timelines current for ORM writes
+
+
+@event.listens_for(Message, 'after_insert')
+def _message_added(mapper, connection, target):
+    followers = connection.execute(
+        select([User.followers_count]).where(User.id == target.user_id)).scalar()
+
+    if (followers or 0) <= FAN_OUT_INLINE_LIMIT:
+        fan_out_message(connection, target.id)
+        return
+
+    push_to_author(connection, target.id)
+    jobs.enqueue('fan_out_to_followers', key=f"fan-out:{target.id}",
+                 connection=connection, message_id=target.id)
+
+
+@event.listens_for(Message, 'before_delete')
+def _message_deleted(mapper, connection, target):
+    remove_message(connection, target.id)
+
+
+@event.listens_for(Follows, 'after_insert')
+def _follow_added(mapper, connection, target):
+    backfill_follow(connection,
+                    target.user_following_id,
+                    target.user_being_followed_id)
+
+
+@event.listens_for(Follows, 'after_delete')
+def _follow_removed(mapper, connection, target):
+    remove_follow(connection,
+                  target.user_following_id,
+                  target.user_being_followed_id)
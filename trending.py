@@ -0,0 +1,282 @@
+"""Trending messages: likes, decayed exponentially with age.
+
+A like made at time t counts exp(-(now - t) / MEAN_LIFE) now. Every score
+decays at the same rate, so a like can instead add the fixed weight
+exp((t - EPOCH) / MEAN_LIFE): the sums rank messages the same way at any
+moment, and a stored score never has to be recomputed as time passes.
+`messages.trend` holds the natural log of the sum, which never overflows
+(NULL when a message has no likes); the decayed score itself is
+exp(trend - (now - EPOCH) / MEAN_LIFE).
+
+Likes and unlikes don't write it themselves. Once their transaction
+commits, the like is added to this process's `TrendingIndex`. A background
+thread, started with the first request, folds what it has collected into
+`messages.trend` every TRENDING_FLUSH_SECONDS in one transaction, then
+reloads the ids of the top TOP_N messages from the index on it. A
+`/trending` page is a slice of that list plus one query for the page's
+messages, however many likes there are.
+
+`likes` has no timestamps, so an unlike takes back the weight of a like made
+now -- more than an old like added -- and a score never goes below zero.
+`rebuild` recomputes every score from the like counts, dating each message's
+likes at its timestamp; run it after bulk loads (`flask rebuild-trending`).
+"""
+
+from datetime import datetime
+from math import exp, log
+import logging
+from threading import Event, Lock, Thread
+
+from sqlalchemy import bindparam, event, select
+
+from fragments import author_option
+from models import db, Message
+from pagination import Page
+from replicas import RoutingSession
+
+EPOCH = datetime(2020, 1, 1)
+MEAN_LIFE = 24 * 60 * 60
+
+TOP_N = 1000
+DEFAULT_FLUSH_SECONDS = 5
+
+logger = logging.getLogger('warbler.trending')
+
+messages = Message.__table__
+
+
+def weight(when=None):
+    """The log of a like's weight, for a like at `when` (default now)."""
+
+    when = when or datetime.utcnow()
+    return (when - EPOCH).total_seconds() / MEAN_LIFE
+
+
+def score(trend, now=None):
+    """The decayed score behind a `messages.trend` value, as of `now`."""
+
+    if trend is None:
+        return 0.0
+    return exp(trend - weight(now))
+
+
+def combine(trend, base, delta):
+    """`trend` with `delta` added, where `delta` is in units of exp(`base`)."""
+
+    total = delta
+    if trend is not None:
+        total += exp(trend - base)
+    if total <= 1e-9:
+        return None
+    return base + log(total)
+
+
+class TrendingIndex:
+    """Pending like weights, and the ids of the top trending messages."""
+
+    def __init__(self, size=TOP_N):
+        self.size = size
+        self.lock = Lock()
+        # message id -> summed weights, relative to exp(self.base)
+        self.pending = {}
+        self.base = None
+        self.top = None
+        self.stopping = Event()
+
+    def add(self, message_id, sign, when=None):
+        """Count a like (`sign` 1) or unlike (-1) of `message_id`."""
+
+        with self.lock:
+            if self.base is None:
+                self.base = weight(when)
+            delta = sign * exp(weight(when) - self.base)
+            self.pending[message_id] = self.pending.get(message_id, 0.0) + delta
+
+    def flush(self):
+        """Fold pending weights into `messages.trend`, then reload the top ids."""
+
+        with self.lock:
+            pending, base = self.pending, self.base
+            self.pending, self.base = {}, None
+
+        if pending:
+            ids = sorted(pending)
+            try:
+                with db.engine.begin() as connection:
+                    # locked in id order, so concurrent flushes can't deadlock
+                    current = {message_id: trend for message_id, trend in connection.execute(
+                        select([messages.c.id, messages.c.trend])
+                        .where(messages.c.id.in_(ids))
+                        .order_by(messages.c.id)
+                        .with_for_update())}
+
+                    updates = [dict(message_id=message_id,
+                                    new_trend=combine(current[message_id], base,
+                                                      pending[message_id]))
+                               for message_id in ids if message_id in current]
+                    if updates:
+                        connection.execute(messages.update()
+                                           .where(messages.c.id == bindparam('message_id'))
+                                           .values(trend=bindparam('new_trend')),
+                                           updates)
+            except Exception:
+                # nothing was written; keep the weights for the next flush
+                self.restore(pending, base)
+                raise
+
+        self.refresh()
+
+    def restore(self, pending, base):
+        """Put back weights taken by a `flush` that failed."""
+
+        with self.lock:
+            if self.base is None:
+                self.base = base
+            scale = exp(base - self.base)
+            for message_id, delta in pending.items():
+                self.pending[message_id] = self.pending.get(message_id, 0.0) + delta * scale
+
+    def flush_every(self, app, seconds):
+        """`flush` in a daemon thread every `seconds` until `stop()`."""
+
+        def run():
+            while not self.stopping.wait(seconds):
+                try:
+                    with app.app_context():
+                        self.flush()
+                except Exception:
+                    logger.exception("flushing trending scores failed")
+
+        Thread(target=run, name='trending-flush', daemon=True).start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def refresh(self):
+        """Reload the ids of the top `size` messages by trend."""
+
+        with db.engine.connect() as connection:
+            rows = connection.execute(select([messages.c.id])
+                                      .where(messages.c.trend.isnot(None))
+                                      .order_by(messages.c.trend.desc(), messages.c.id.desc())
+                                      .limit(self.size))
+            top = [message_id for (message_id,) in rows]
+
+        with self.lock:
+            self.top = top
+
+    def ids(self, offset, limit):
+        """A slice of the top ids, loading them first if need be."""
+
+        if self.top is None:
+            self.refresh()
+        return self.top[offset:offset + limit]
+
+    def clear(self):
+        """Forget the pending weights and the loaded top ids."""
+
+        with self.lock:
+            self.pending, self.base = {}, None
+            self.top = None
+
+    def page(self, after, limit, options=()):
+        """A `Page` of trending messages, best first, from position `after`."""
+
+        try:
+            offset = max(0, int(after))
+        except (TypeError, ValueError):
+            offset = 0
+
+        ids = self.ids(offset, limit + 1)
+        next_cursor = str(offset + limit) if len(ids) > limit else None
+        ids = ids[:limit]
+        if not ids:
+            return Page([], None)
+
+        found = {msg.id: msg
+                 for msg in (Message.query
+                             .options(*options)
+                             .filter(Message.id.in_(ids),
+                                     Message.by_live_authors()))}
+        return Page([found[message_id] for message_id in ids if message_id in found],
+                    next_cursor)
+
+
+index = TrendingIndex()
+
+
+def record(message_id, sign):
+    """Count a like or unlike once the current transaction commits."""
+
+    db.session.info.setdefault('trending', []).append((message_id, sign, datetime.utcnow()))
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _apply_after_commit(db_session):
+    for message_id, sign, when in db_session.info.pop('trending', ()):
+        index.add(message_id, sign, when)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_after_rollback(db_session):
+    db_session.info.pop('trending', None)
+
+
+def trending_page(limit, after=None):
+    """A page of trending messages with their authors, for the views."""
+
+    return index.page(after, limit, options=[author_option()])
+
+
+def rebuild(batch_size=1000):
+    """Recompute every message's trend from its like count; returns how many.
+
+    Pending weights in this process are dropped: the counts include them.
+    """
+
+    with index.lock:
+        index.pending, index.base = {}, None
+
+    rebuilt = 0
+    last_id = 0
+    query = (select([messages.c.id, messages.c.timestamp, messages.c.likes_count])
+             .order_by(messages.c.id)
+             .limit(batch_size))
+
+    while True:
+        with db.engine.begin() as connection:
+            rows = connection.execute(query.where(messages.c.id > last_id)).fetchall()
+            if not rows:
+                break
+
+            connection.execute(messages.update()
+                               .where(messages.c.id == bindparam('message_id'))
+                               .values(trend=bindparam('new_trend')),
+                               [dict(message_id=id,
+                                     new_trend=(log(likes_count) + weight(timestamp)
+                                                if likes_count > 0 else None))
+                                for id, timestamp, likes_count in rows])
+
+        rebuilt += len(rows)
+        last_id = rows[-1].id
+
+    index.refresh()
+    return rebuilt
+
+
+@event.listens_for(messages, 'after_create')
+def _messages_created(target, connection, **kw):
+    # a new table has nothing trending; no need to ask it
+    with index.lock:
+        index.pending, index.base = {}, None
+        index.top = []
+
+
+def init_app(app):
+    """Flush collected likes every `TRENDING_FLUSH_SECONDS`, from the first request on."""
+
+    app.config.setdefault('TRENDING_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS)
+
+    @app.before_first_request
+    def start_trending_flush():
+        index.flush_every(app, app.config['TRENDING_FLUSH_SECONDS'])